@@ -1,55 +1,83 @@
 from dataclasses import dataclass,field
 from typing import Any,List,Optional
 from enum import Enum
+import base64
 import uuid
-import torch 
+import numpy as np
 
-def tensor_to_list(tensors: Optional[List[torch.Tensor]]) -> List:
-    if not tensors:
-        return []
-    return [t.tolist() for t in tensors]
+class Verbosity(str, Enum):
+    SUMMARY = "summary"   # status, shapes and search results only
+    CHUNKS = "chunks"     # + chunk texts
+    FULL = "full"         # + embedding and centroid vectors
 
-@dataclass
+class UploadMode(str, Enum):
+    SYNC = "sync"         # process the files before responding
+    JOB = "job"           # spool the files, respond with a job id, poll GET /jobs/{id}
+
+class VectorEncoding(str, Enum):
+    LIST = "list"         # JSON arrays of floats
+    BASE64 = "base64"     # base64 of little-endian float32 bytes, with shape
+
+def empty_embeddings() -> np.ndarray:
+    return np.empty((0, 0), dtype=np.float32)
+
+def encode_vectors(array: np.ndarray, encoding: VectorEncoding) -> Any:
+    array = np.ascontiguousarray(array, dtype="<f4")
+    if encoding == VectorEncoding.BASE64:
+        return {
+            "dtype": "float32",
+            "shape": list(array.shape),
+            "data": base64.b64encode(array.tobytes()).decode("ascii")
+        }
+    # Left as an ndarray, ORJSONResponse serializes it natively without a .tolist() copy
+    return array
+
+@dataclass(slots=True)
 class Text:
     content: List[str] = field(default_factory=list)
     error : Optional[str] = None
     shape: List[int] = field(default_factory=list)
 
-    def to_dict(self):
-        return {
-            "content": self.content,
+    def to_dict(self, verbosity: Verbosity = Verbosity.FULL):
+        data = {
             "error": self.error,
             "shape": self.shape
         }
+        if verbosity != Verbosity.SUMMARY:
+            data["content"] = self.content
+        return data
 
-@dataclass
+@dataclass(slots=True)
 class Embedding:
-    content: Optional[List[torch.Tensor]] = field(default_factory=list)
-    vectordb_embeddings: Optional[List[List[float]]] = field(default_factory=list)
+    # One contiguous (num_chunks, dim) float32 array per document, rows are views into it
+    content: np.ndarray = field(default_factory=empty_embeddings)
     shape: List[int] = field(default_factory=list)
+    error: Optional[str] = None
 
-    def to_dict(self):
-        return {
-            "content": tensor_to_list(self.content),
+    def to_dict(self, verbosity: Verbosity = Verbosity.FULL, encoding: VectorEncoding = VectorEncoding.LIST):
+        data = {
+            "error": self.error,
             "shape": self.shape,
-            "vectordb_embeddings": len(self.vectordb_embeddings)
+            "vectordb_embeddings": len(self.content)
         }
+        if verbosity == Verbosity.FULL:
+            data["content"] = encode_vectors(self.content, encoding)
+        return data
 
-    def convert_to_list_floats(self):
-        self.vectordb_embeddings = []
-        for embed in self.content:
-            self.vectordb_embeddings.append(embed.tolist())
+    def to_wire(self, start: int = 0, end: Optional[int] = None) -> List[List[float]]:
+        # Chroma wire format; only call this at the Chroma boundary, right before the request is sent
+        return self.content[start:end].tolist()
 
-@dataclass
+@dataclass(slots=True)
 class BaseDocument:
     text: Text
     embedding: Embedding
     uuid : str = field(default_factory=lambda: str(uuid.uuid4()))
 
-    def to_dict(self):
+    def to_dict(self, verbosity: Verbosity = Verbosity.FULL, encoding: VectorEncoding = VectorEncoding.LIST):
         return {
-            "text": self.text.to_dict(),
-            "embedding": self.embedding.to_dict(),
+            "text": self.text.to_dict(verbosity),
+            "embedding": self.embedding.to_dict(verbosity, encoding),
             "uuid": self.uuid
         }
 
@@ -58,7 +86,7 @@ class StatusEnum(str, Enum):
     FAILED = "failed"
     INIT = "default"
 
-@dataclass
+@dataclass(slots=True)
 class Status:
     code: Optional[StatusEnum] = None
     error: Optional[str] = None
@@ -69,31 +97,43 @@ class Status:
             "error": self.error
         }
 
-@dataclass
+@dataclass(slots=True)
 class UploadDocument(BaseDocument):
     status: Optional[Status] = None
     collection: Optional[List[str]] = None
 
-    def to_dict(self):
-        data = super().to_dict()
+    def to_dict(self, verbosity: Verbosity = Verbosity.FULL, encoding: VectorEncoding = VectorEncoding.LIST):
+        # Explicit base call: zero-argument super() breaks on slots=True dataclasses
+        data = BaseDocument.to_dict(self, verbosity, encoding)
         data.update({
             "status": self.status.to_dict() if self.status else None,
             "collection": self.collection
         })
         return data
     
-@dataclass
+@dataclass(slots=True)
 class SearchDocument(BaseDocument):
     centroid: Optional[Embedding] = None
     top_k_collections: List[str] = field(default_factory=list)
     top_k_results: List[str] = field(default_factory=list)
+    top_k_scores: List[float] = field(default_factory=list)
+    # Set when routing or retrieval failed, the top k lists are then incomplete
+    error: Optional[str] = None
 
-    def to_dict(self):
-        data = super().to_dict()
+    @property
+    def failed(self) -> bool:
+        centroid_error = self.centroid.error if self.centroid else None
+        return bool(self.text.error or self.embedding.error or centroid_error or self.error)
+
+    def to_dict(self, verbosity: Verbosity = Verbosity.FULL, encoding: VectorEncoding = VectorEncoding.LIST):
+        data = BaseDocument.to_dict(self, verbosity, encoding)
+        if verbosity == Verbosity.FULL:
+            data["centroid"] = self.centroid.to_dict(verbosity, encoding) if self.centroid else None
         data.update({
-            "centroid": self.centroid.to_dict() if self.centroid else None,
             "top_k_collections": self.top_k_collections,
-            "top_k_results": self.top_k_results
+            "top_k_results": self.top_k_results,
+            "top_k_scores": self.top_k_scores,
+            "error": self.error
         })
         return data
 
@@ -102,11 +142,17 @@ class SearchRequest:
     query: str
     top_k_collections: int = 1
     top_k_documents: int = 5
+    verbosity: Verbosity = Verbosity.SUMMARY
+    vector_encoding: VectorEncoding = VectorEncoding.LIST
+
+@dataclass
+class BatchSearchRequest:
+    requests: List[SearchRequest] = field(default_factory=list)
 
 def create_search_document(text:str) -> SearchDocument:
     text_data = Text(content=[text], error=None, shape=[])
-    embedding_data = Embedding(content=[torch.empty(0)], shape=[])
-    centroid_data = Embedding(content=[torch.empty(0)],shape=[])
+    embedding_data = Embedding(shape=[])
+    centroid_data = Embedding(shape=[])
 
     return SearchDocument(
         text=text_data,
@@ -119,7 +165,7 @@ def create_search_document(text:str) -> SearchDocument:
 
 def create_upload_document() -> UploadDocument:
     text_data = Text(content=[""], error=None, shape=[])
-    embedding_data = Embedding(content=[torch.empty(0)],shape=[])
+    embedding_data = Embedding(shape=[])
     
     # Create the UploadDocument instance
     return UploadDocument(
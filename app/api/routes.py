@@ -1,20 +1,40 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
-from app.document.batch import process_file,process_text,process_embeddings
-from app.document.extract import text_splitter
-from app.db.client import chroma_client,update_query_centroid,update_top_k_collections,update_top_k_documents
+from fastapi.responses import ORJSONResponse,Response,StreamingResponse
+from app.document.batch import process_file,process_text,process_embeddings_batch,process_large_file
+from app.document.pipeline import spool_uploads,stream_upload
+from app.document.jobs import ingest_queue
+from app.document.extract import text_splitter,embedding_cache,embeddings_ready,generate_embeddings,should_stream
+from app.document.scheduler import Priority
+from app.db.client import chroma_client,load_centroid_index,update_query_centroid,update_top_k_collections,update_top_k_documents
+from app.db.client import update_top_k_collections_batch,update_top_k_documents_batch
+from app.db.index import centroid_index
+from app.db.compaction import collection_compactor
+from app.db.writer import recompute_all_centroids
+from app.db.executor import chroma_call
+from app.metrics import render_metrics,track_in_flight
+from app.api.search_cache import search_cache
 import app.api.request as request
 from app.logger import logger
 import asyncio
 from typing import List
-import uuid
 
 router = APIRouter()
 
 #---------------------------------------------------------------------------------------------------------------
 
 @router.post("/upload")
-async def upload_files(files: List[UploadFile] = File(...)):
+@track_in_flight("upload")
+async def upload_files(
+    files: List[UploadFile] = File(...),
+    verbosity: request.Verbosity = request.Verbosity.SUMMARY,
+    vector_encoding: request.VectorEncoding = request.VectorEncoding.LIST,
+    mode: request.UploadMode = request.UploadMode.SYNC
+):
+    if mode == request.UploadMode.JOB:
+        # Spool and return; the ingest workers process the files and GET /jobs/{job_id} reports their status
+        job_id = await ingest_queue.submit(files)
+        return ORJSONResponse(status_code=202, content={"job_id": job_id, "files": [file.filename for file in files]})
+
     logger.info(f"Starting file upload for {len(files)} files.")
 
     file_map = {
@@ -24,10 +44,18 @@ async def upload_files(files: List[UploadFile] = File(...)):
 
     logger.debug(f"File map created: {file_map}")
 
+    # Large files are extracted, embedded and written window by window, alongside the other files' extraction
+    streamed = {file.filename for file in files if should_stream(file.file)}
+    batched = {filename: upload_doc for filename, upload_doc in file_map.items() if filename not in streamed}
+
     # Use asyncio.gather to run file processing concurrently
     logger.info("Starting file processing...")
     await asyncio.gather(
         *[
+            process_large_file(
+                file=file,
+                upload_document=file_map[file.filename]
+            ) if file.filename in streamed else
             process_file(
                 file=file,
                 upload_document=file_map[file.filename]
@@ -45,37 +73,60 @@ async def upload_files(files: List[UploadFile] = File(...)):
                 filename=filename,
                 upload_document=file_map[filename]
             )
-            for filename in file_map
+            for filename in batched
         ]
     )
     logger.info("Text embeddings batch processing completed.")
 
-    # Batch processing to add embeddings and documents to chromadb
+    # Route every file's chunks first, then one write per destination collection for the whole request
     logger.info("Starting batch processing to add embeddings to chromadb...")
-    await asyncio.gather(
-        *[
-            process_embeddings(
-                filename=filename,
-                upload_document=file_map[filename]
-            )
-            for filename in file_map
-        ]
-    )
+    await process_embeddings_batch(batched)
     logger.info("Embeddings and documents added to chromadb.")
 
     logger.info("File upload and processing completed.")
     
-    return JSONResponse(
+    return ORJSONResponse(
         content={
-            "state": [upload_doc.to_dict() for filename, upload_doc in file_map.items()]
+            "state": [upload_doc.to_dict(verbosity, vector_encoding) for filename, upload_doc in file_map.items()]
         }
     )
 
 #---------------------------------------------------------------------------------------------------------------
 
+@router.post("/upload/stream")
+async def upload_files_stream(files: List[UploadFile] = File(...)):
+    # Each file flows through extract -> embed -> write on its own, progress is streamed as NDJSON events.
+    # FastAPI closes the uploaded files when this returns, before the body is sent, so the pipeline reads copies.
+    spooled = await spool_uploads(files)
+    return StreamingResponse(stream_upload(spooled), media_type="application/x-ndjson")
+
+#---------------------------------------------------------------------------------------------------------------
+
+@router.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    status = await ingest_queue.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return ORJSONResponse(content=status)
+
+#---------------------------------------------------------------------------------------------------------------
+
 @router.post("/search/")
+@track_in_flight("search")
 async def search(requestParam: request.SearchRequest):
 
+    cache_key = search_cache.key(requestParam.query, requestParam.top_k_collections, requestParam.top_k_documents)
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        logger.info("Serving search from the search cache")
+        return ORJSONResponse(
+            content={
+                "state": [search_doc.to_dict(requestParam.verbosity, requestParam.vector_encoding) for search_doc in cached]
+            }
+        )
+    # Read before routing: a write landing while this search runs leaves its cache entry stale
+    cache_clock = centroid_index.versions.clock
+
     chunks = text_splitter.split_text(requestParam.query)
 
     file_map = {
@@ -91,7 +142,8 @@ async def search(requestParam: request.SearchRequest):
         *[
             process_text(
                 filename=query,
-                upload_document=file_map[query]
+                upload_document=file_map[query],
+                priority=Priority.SEARCH
             )
             for query in file_map
         ]
@@ -139,20 +191,87 @@ async def search(requestParam: request.SearchRequest):
         ]
     )
     logger.info("update_top_k_documents for all queries completed")  
+
+    # A failed stage leaves empty or partial results, which must not be served again from the cache
+    if not any(document.failed for document in file_map.values()):
+        search_cache.put(cache_key, list(file_map.values()), clock=cache_clock)
+    else:
+        logger.warning("Search had failed stages, result not cached")
     
-    
-    return JSONResponse(
+    return ORJSONResponse(
         content={
-            "state": [upload_doc.to_dict() for filename, upload_doc in file_map.items()]
+            "state": [
+                upload_doc.to_dict(requestParam.verbosity, requestParam.vector_encoding)
+                for filename, upload_doc in file_map.items()
+            ]
         }
     )
 
 #---------------------------------------------------------------------------------------------------------------
 
+@router.post("/search/batch")
+@track_in_flight("search_batch")
+async def search_batch(requestParam: request.BatchSearchRequest):
+    # Same result as calling /search/ per query, but with one embedding batch, one routing matrix multiply
+    # and one collection.query per routed collection for all queries together
+    logger.info(f"Starting batch search for {len(requestParam.requests)} queries...")
+
+    query_maps = []
+    documents = []
+    top_k_collections = []
+    top_k_documents = []
+    for searchParam in requestParam.requests:
+        chunks = text_splitter.split_text(searchParam.query)
+        file_map = {idx: request.create_search_document(text=chunk) for idx, chunk in enumerate(chunks)}
+        query_maps.append(file_map)
+
+        for document in file_map.values():
+            documents.append(document)
+            top_k_collections.append(searchParam.top_k_collections)
+            top_k_documents.append(searchParam.top_k_documents)
+
+    if documents:
+        #convert every query chunk to embeddings in one batch
+        embeddings = await generate_embeddings([document.text.content[0] for document in documents], priority=Priority.SEARCH)
+        for row, document in enumerate(documents):
+            document.embedding.content = embeddings[row:row + 1]
+            document.embedding.shape = 1
+            document.centroid.content = embeddings[row:row + 1]
+        logger.info(f"Query embeddings completed for {len(documents)} chunks")
+
+        await update_top_k_collections_batch(documents, top_k=top_k_collections)
+        logger.info("update_top_k_collections_batch completed")
+
+        await update_top_k_documents_batch(documents, top_k=top_k_documents)
+        logger.info("update_top_k_documents_batch completed")
+
+    return ORJSONResponse(
+        content={
+            "results": [
+                {
+                    "query": searchParam.query,
+                    "state": [
+                        search_doc.to_dict(searchParam.verbosity, searchParam.vector_encoding)
+                        for idx, search_doc in file_map.items()
+                    ]
+                }
+                for searchParam, file_map in zip(requestParam.requests, query_maps)
+            ]
+        }
+    )
+
+#---------------------------------------------------------------------------------------------------------------
+
+@router.get("/ready")
+async def ready():
+    # 503 until the embedding model is warm and the routing index is loaded; liveness is any answer at all
+    status = {"ready": embeddings_ready() and centroid_index.loaded, "model": embeddings_ready(), "index": centroid_index.loaded}
+    return ORJSONResponse(status, status_code=200 if status["ready"] else 503)
+
 @router.get("/health_db")
 async def check_chroma():
     try:
-        collections = chroma_client.list_collections()
+        collections = await chroma_call(chroma_client.list_collections)
         collection_names = [collection.name for collection in collections]
     
         if "test" in collection_names:
@@ -161,3 +280,46 @@ async def check_chroma():
             return {"status": "ChromaDB is up", "collection": "test not found"}
     except Exception as e:
         return {"status": "Error", "message": str(e)}
+
+#---------------------------------------------------------------------------------------------------------------
+
+@router.post("/index/resync")
+async def resync_index(recompute: bool = False):
+    # Reload every collection centroid from Chroma, e.g. after collections were changed by another process
+    # recompute=true also rebuilds every centroid from its chunk embeddings to correct running-sum drift
+    try:
+        await load_centroid_index(force=True)
+        if recompute:
+            await recompute_all_centroids()
+        return {"status": "Routing index resynced", "collections": len(centroid_index)}
+    except Exception as e:
+        return {"status": "Error", "message": str(e)}
+
+#---------------------------------------------------------------------------------------------------------------
+
+@router.post("/index/compact")
+async def compact_index():
+    # Runs one split / merge compaction pass now instead of waiting for the background job
+    try:
+        report = await collection_compactor.run_once()
+        return {"status": "Compaction finished", "collections": len(centroid_index), **report}
+    except Exception as e:
+        return {"status": "Error", "message": str(e)}
+
+#---------------------------------------------------------------------------------------------------------------
+
+@router.get("/embedding_cache")
+async def embedding_cache_stats():
+    return embedding_cache.stats()
+
+@router.get("/search_cache")
+async def search_cache_stats():
+    return search_cache.stats()
+
+#---------------------------------------------------------------------------------------------------------------
+
+@router.get("/metrics")
+async def metrics():
+    # Prometheus scrape endpoint: stage and Chroma call latencies, chunk / file / error counters, in-flight and queue gauges
+    content, media_type = render_metrics()
+    return Response(content=content, media_type=media_type)
@@ -0,0 +1,112 @@
+import os
+import re
+import unicodedata
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from app.api.request import SearchDocument
+from app.db.index import CollectionVersions,centroid_index
+
+# In-memory budget for cached /search/ results, 0 disables the cache
+SEARCH_CACHE_MAX_BYTES = int(os.getenv("SEARCH_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Rough per-entry / per-document bookkeeping cost counted against the byte budget
+_ENTRY_OVERHEAD_BYTES = 400
+_DOCUMENT_OVERHEAD_BYTES = 600
+
+_WHITESPACE = re.compile(r"\s+")
+
+SearchKey = Tuple[str, int, int]
+
+class _Entry:
+    __slots__ = ("documents", "clock", "collections", "size")
+
+    def __init__(self, documents: List[SearchDocument], clock: int):
+        self.documents = documents
+        self.clock = clock
+        self.collections = {name for document in documents for name in document.top_k_collections}
+        self.size = _ENTRY_OVERHEAD_BYTES + sum(_document_size(document) for document in documents)
+
+def _document_size(document: SearchDocument) -> int:
+    size = _DOCUMENT_OVERHEAD_BYTES + document.embedding.content.nbytes
+    if document.centroid is not None:
+        size += document.centroid.content.nbytes
+    size += sum(len(text) for text in document.text.content)
+    size += sum(len(text) for text in document.top_k_results)
+    return size
+
+#---------------------------------------------------------------------------------------------------------------
+
+class SearchCache:
+    """
+    LRU cache of /search/ results keyed by normalized query text and the two top-k settings, bounded by max_bytes.
+    An entry remembers the version clock from before it was computed and is only served while none of the
+    collections it was routed to were written since and no collection joined or left routing.
+    Cached documents are shared between responses and must not be modified.
+    """
+
+    def __init__(self, versions: CollectionVersions, max_bytes: int):
+        self.versions = versions
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self._entries: "OrderedDict[SearchKey, _Entry]" = OrderedDict()
+        self._bytes = 0
+
+    @staticmethod
+    def key(query: str, top_k_collections: int, top_k_documents: int) -> SearchKey:
+        # Unicode-compatibility fold and collapsed whitespace; case is kept, the embedding model sees it
+        normalized = _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", query)).strip()
+        return normalized, top_k_collections, top_k_documents
+
+    def get(self, key: SearchKey) -> Optional[List[SearchDocument]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if self.versions.changed_since(entry.collections, entry.clock):
+            self._evict(key)
+            self.stale += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.documents
+
+    def put(self, key: SearchKey, documents: List[SearchDocument], clock: int):
+        """
+        clock is versions.clock read before routing started, so writes that raced the search invalidate the entry
+        """
+        if self.max_bytes <= 0:
+            return
+
+        entry = _Entry(documents, clock)
+        if entry.size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._evict(key)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+
+    def _evict(self, key: SearchKey):
+        self._bytes -= self._entries.pop(key).size
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+search_cache = SearchCache(versions=centroid_index.versions, max_bytes=SEARCH_CACHE_MAX_BYTES)
@@ -1,21 +1,60 @@
 import chromadb
-from chromadb.config import Settings
 from chromadb.api.models.Collection import Collection
-from sklearn.metrics.pairwise import cosine_similarity
 from app.api.request import SearchDocument
-from app.document.extract import device
+from app.db.index import CENTROID_SNAPSHOT_PATH,centroid_index,CentroidStats
+from app.db.executor import CHROMA_HTTP_TIMEOUT_S,chroma_call
+from app.metrics import CHUNKS_TOTAL, ERRORS_TOTAL, observe_stage
+import asyncio
+import heapq
+import httpx
 import numpy as np
+import os
 import uuid
-import time
 from app.logger import logger
-import torch 
-from typing import List
-
-# Initialize Chroma client with persistent storage (if needed)
-chroma_client = chromadb.HttpClient(host='localhost', port=8000)
-
-def get_or_create_collection(collection_name: str):
-    return chroma_client.get_or_create_collection(name=collection_name)
+from typing import Dict, List, Optional, Tuple
+
+# Incremental centroid updates between full recomputes that correct floating-point drift
+CENTROID_RECOMPUTE_EVERY = int(os.getenv("CENTROID_RECOMPUTE_EVERY", "500"))
+
+# Document search stops querying further collections once the global top k all score at least this
+SEARCH_EARLY_STOP_SCORE = float(os.getenv("SEARCH_EARLY_STOP_SCORE", "0.9"))
+# Two result chunks where one ends with at least this many leading characters of the other are neighbours from the
+# splitter's chunk_overlap; only the better one is returned
+SEARCH_DEDUPE_MIN_OVERLAP = int(os.getenv("SEARCH_DEDUPE_MIN_OVERLAP", "20"))
+
+# Chunks per collection.upsert call; Chroma rejects larger batches (its sqlite backend allows 5461)
+CHROMA_MAX_BATCH_SIZE = int(os.getenv("CHROMA_MAX_BATCH_SIZE", "5000"))
+
+# (score, chunk id, chunk text), best first
+ScoredChunk = Tuple[float, str, str]
+
+# http: a Chroma server (default). persistent / ephemeral: an in-process client, used by the benchmarks
+CHROMA_MODE = os.getenv("CHROMA_MODE", "http")
+CHROMA_HOST = os.getenv("CHROMA_HOST", "localhost")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8000"))
+CHROMA_PATH = os.getenv("CHROMA_PATH", "chroma_data")
+
+def create_chroma_client():
+    if CHROMA_MODE == "http":
+        client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+        # chromadb creates its httpx session without a timeout and has no setting for one
+        session = getattr(getattr(client, "_server", None), "_session", None)
+        if isinstance(session, httpx.Client):
+            session.timeout = httpx.Timeout(CHROMA_HTTP_TIMEOUT_S)
+        else:
+            logger.warning("Could not set a timeout on the Chroma HTTP client, a hung request keeps its pool thread")
+        return client
+    if CHROMA_MODE == "persistent":
+        return chromadb.PersistentClient(path=CHROMA_PATH)
+    if CHROMA_MODE == "ephemeral":
+        return chromadb.EphemeralClient()
+    raise ValueError(f"Unknown CHROMA_MODE '{CHROMA_MODE}'. Use one of: http, persistent, ephemeral")
+
+chroma_client = create_chroma_client()
+logger.info(f"Chroma client mode: {CHROMA_MODE}")
+
+async def get_or_create_collection(collection_name: str) -> Collection:
+    return await chroma_call(chroma_client.get_or_create_collection, name=collection_name)
 
 def generate_doc_ids(filename:str, num_chunks:int, start_idx:int):
     return [f"{filename}_chunk_{start_idx + idx}" for idx in range(num_chunks)]
@@ -32,147 +71,294 @@ def generate_metadatas(filename: str, num_chunks: int, start_idx: int , is_centr
 
 #---------------------------------------------------------------------------------------------------------------
 
+@observe_stage("add_to_collection")
 async def add_to_collection(
     text: List[str],
-    embedding: List[List[float]],
-    filename: str,
-    start_idx: int,
-    collection: Collection = None
-):
-    # Log the function entry and input parameters
-    logger.debug(f"add_to_collection called with start_idx: {start_idx}, filename: {filename}, collection: {collection}")
+    embedding: np.ndarray,
+    ids: List[str],
+    metadatas: List[Dict],
+    collection: Collection
+) -> Tuple[int, np.ndarray]:
+    """
+    Upserts chunks in slices of at most CHROMA_MAX_BATCH_SIZE; stops at the first failed slice.
+    Returns how many input chunks were written and the embeddings they replaced: chunks already stored under the
+    same id (a re-uploaded file) and earlier duplicates of an id within the slice. The centroid update subtracts
+    those from the running sum, so it only counts what the collection holds.
+    Leaves the centroid alone, the collection writer applies everything it wrote in one update.
+    """
+    logger.debug(f"add_to_collection called with {len(text)} chunks for collection: {collection.name}")
 
+    written = 0
+    replaced: List[np.ndarray] = []
     try:
-        logger.debug(f"Adding document to collection: {collection.name}")
-        # Add the document to the collection
-        collection.add(
-            documents=text,
-            embeddings=embedding,
-            ids=generate_doc_ids(filename=filename,num_chunks=len(text),start_idx=start_idx),
-            metadatas=generate_metadatas(filename=filename,num_chunks=len(text),start_idx=start_idx)
-        )
-        
-        logger.debug(f"Successfully added documents with start_idx: {start_idx} to collection: {collection.name}")
+        for start in range(0, len(text), CHROMA_MAX_BATCH_SIZE):
+            end = min(start + CHROMA_MAX_BATCH_SIZE, len(text))
+
+            # The last occurrence of an id wins, as it would across two separate writes
+            last = {chunk_id: idx for idx, chunk_id in enumerate(ids[start:end], start=start)}
+            rows = sorted(last.values())
+            superseded = [idx for idx in range(start, end) if last[ids[idx]] != idx]
+
+            existing = await chroma_call(collection.get, ids=list(last), include=["embeddings"])
+            await chroma_call(
+                collection.upsert,
+                documents=[text[idx] for idx in rows],
+                embeddings=embedding[rows].tolist(),
+                ids=[ids[idx] for idx in rows],
+                metadatas=[metadatas[idx] for idx in rows]
+            )
+            written = end
+
+            if len(existing["ids"]):
+                replaced.append(np.asarray(existing["embeddings"], dtype=np.float32))
+            if superseded:
+                replaced.append(np.asarray(embedding[superseded], dtype=np.float32))
 
-        # Update the collection centroid
-        await update_collection_centroid(collection=collection)
-        logger.debug(f"Collection centroid updated for collection: {collection.name}")
+        logger.debug(f"Successfully added {written} chunks to collection: {collection.name}")
 
     except Exception as e:
-        logger.error(f"An error occurred while adding the document with start_idx: {start_idx} to collection: {collection.name}. Error: {e}", exc_info=True)
+        ERRORS_TOTAL.labels("add_to_collection").inc()
+        logger.error(f"An error occurred while adding {len(text)} chunks to collection: {collection.name} after {written} were written. Error: {e}", exc_info=True)
+
+    CHUNKS_TOTAL.labels("stored").inc(written)
+    if written:
+        # Invalidates cached search results that read this collection
+        centroid_index.versions.bump(collection.name)
+    return written, np.concatenate(replaced) if replaced else np.empty((0, embedding.shape[1]), dtype=np.float32)
 
 #---------------------------------------------------------------------------------------------------------------
 
-async def update_collection_centroid(collection: Collection):
+async def delete_from_collection(ids: List[str], collection: Collection) -> np.ndarray:
     """
-    Gets a collection object and updates the centroid embedding of the object
+    Deletes chunks by id and returns the embeddings of the deleted chunks for the centroid update.
+    The embeddings are read right before the delete, so they are the stored ones even if an upsert replaced a chunk.
+    """
+    logger.debug(f"delete_from_collection called with {len(ids)} ids for collection: {collection.name}")
+
+    existing = await chroma_call(collection.get, ids=ids, include=["embeddings"])
+    ids = existing["ids"]
+    embeddings = np.asarray(existing["embeddings"], dtype=np.float32)
+    if len(ids) == 0:
+        logger.debug(f"None of the ids exist in collection: {collection.name}")
+        return embeddings
+
+    await chroma_call(collection.delete, ids=ids)
+    centroid_index.versions.bump(collection.name)
+    logger.debug(f"Deleted {len(ids)} documents from collection: {collection.name}")
+    return embeddings
+
+#---------------------------------------------------------------------------------------------------------------
+
+@observe_stage("update_collection_centroid")
+async def update_collection_centroid(
+    collection: Collection,
+    added: Optional[np.ndarray] = None,
+    removed: Optional[np.ndarray] = None
+):
+    """
+    Applies added / removed chunk embeddings to the running centroid sum of the collection in O(batch).
+    Falls back to a full recompute when no running sum is known or every CENTROID_RECOMPUTE_EVERY updates.
+    Only the collection's writer (app.db.writer) calls this, so updates of one collection never interleave.
     """
     logger.debug(f"update_collection_centroid called for collection: {collection.name if collection else 'Unnamed'}")
 
+    try:
+        stats = centroid_index.stats.get(collection.name)
+        if stats is None:
+            logger.debug(f"No running centroid sum for collection: {collection.name}. Recomputing from all embeddings.")
+            await recompute_collection_centroid(collection=collection)
+            return
+
+        if added is not None and len(added):
+            stats.total += added.sum(axis=0, dtype=np.float64)
+            stats.count += len(added)
+        if removed is not None and len(removed):
+            stats.total -= removed.sum(axis=0, dtype=np.float64)
+            stats.count -= len(removed)
+        stats.updates += 1
+
+        if stats.count <= 0 or stats.updates >= CENTROID_RECOMPUTE_EVERY:
+            await recompute_collection_centroid(collection=collection)
+            return
+
+        await write_collection_centroid(collection=collection, stats=stats)
+
+    except Exception as e:
+        ERRORS_TOTAL.labels("update_collection_centroid").inc()
+        logger.error(f"An error occurred while updating the centroid for collection: {collection.name if collection else 'Unnamed'}. Error: {str(e)}", exc_info=True)
+
+#---------------------------------------------------------------------------------------------------------------
+
+async def recompute_collection_centroid(collection: Collection):
+    """
+    Rebuilds the running centroid sum of a collection from every chunk embedding it holds
+    """
+    logger.debug(f"recompute_collection_centroid called for collection: {collection.name}")
+
     try:
         # Fetch all documents from the collection
         logger.debug("Fetching all documents from the collection...")
-        all_docs = collection.get(include=["embeddings"])
+        all_docs = await chroma_call(collection.get, include=["embeddings"])
         ids = all_docs.get("ids", [])
         embeddings = all_docs.get("embeddings", [])
 
-        logger.debug(f"Fetched {len(ids)} documents from the collection.")
+        # Filter out the centroid embedding
+        keep = [idx for idx, doc_id in enumerate(ids) if doc_id != "centroid"]
+        logger.debug(f"Fetched {len(ids)} documents, {len(keep)} embeddings will be used to calculate the centroid.")
 
-        # Filter out the embeddings for the centroid calculation
-        filtered_embeddings = [
-            torch.Tensor(emb) for doc_id, emb in zip(ids, embeddings) if doc_id != "centroid"
-        ]
-        logger.debug(f"Filtered out centroid embedding. {len(filtered_embeddings)} embeddings will be used to calculate the centroid.")
-
-        # Calculate the centroid
-        logger.debug(f"Calculating centroid from {len(filtered_embeddings)} embeddings...")
-        stacked_embeddings = torch.stack(filtered_embeddings)
-        avg_query_embedding = torch.mean(stacked_embeddings, dim=0)
-        logger.debug("Centroid calculated successfully.")
-
-        centroid_metadata = {
-            "description": "Centroid embedding of the collection",
-            "is_centroid": True
-        }
-
-        # Add the centroid embedding as a new document
-        logger.debug(f"Adding centroid document to the collection with id 'centroid'.")
-        collection.add(
-            documents=["Centroid Document"],
-            embeddings=[avg_query_embedding.tolist()],
-            metadatas=[centroid_metadata],
-            ids=["centroid"]
-        )
-
-        logger.debug(f"Centroid document added successfully to collection: {collection.name}")
+        if not keep:
+            logger.debug(f"Collection {collection.name} has no chunks left. Removing its centroid.")
+            await chroma_call(collection.delete, ids=["centroid"])
+            centroid_index.remove(collection.name)
+            return
+
+        total = np.asarray(embeddings, dtype=np.float64)[keep].sum(axis=0)
+        stats = CentroidStats(total=total, count=len(keep))
+        await write_collection_centroid(collection=collection, stats=stats)
 
     except Exception as e:
-        logger.error(f"An error occurred while updating the centroid for collection: {collection.name if collection else 'Unnamed'}. Error: {str(e)}", exc_info=True)
+        logger.error(f"An error occurred while recomputing the centroid for collection: {collection.name}. Error: {str(e)}", exc_info=True)
+
+async def write_collection_centroid(collection: Collection, stats: CentroidStats):
+    """
+    Persists the centroid and its chunk count as the "centroid" document so the running sum survives restarts
+    """
+    centroid_metadata = {
+        "description": "Centroid embedding of the collection",
+        "is_centroid": True,
+        "count": stats.count
+    }
+
+    logger.debug(f"Upserting centroid document for collection: {collection.name} over {stats.count} chunks")
+    await chroma_call(
+        collection.upsert,
+        documents=["Centroid Document"],
+        embeddings=[stats.mean.tolist()],
+        metadatas=[centroid_metadata],
+        ids=["centroid"]
+    )
+    centroid_index.set_stats(collection.name, stats)
 
 #---------------------------------------------------------------------------------------------------------------
 
-async def top_1_collection(query_embedding: List[torch.Tensor], threshold: float = 0.35) -> str:
-    client = chroma_client
+async def _load_centroid(collection: Collection):
+    try:
+        centroid_doc = await chroma_call(collection.get, ids=["centroid"], include=["embeddings", "metadatas"])
+        if len(centroid_doc["embeddings"]) == 0:
+            logger.warning(f"No centroid embedding found for collection: {collection.name}")
+            return
+
+        centroid = np.asarray(centroid_doc["embeddings"][0], dtype=np.float32)
+        count = (centroid_doc["metadatas"][0] or {}).get("count")
+        if count:
+            # Rebuild the running sum from the persisted mean and chunk count
+            centroid_index.set_stats(collection.name, CentroidStats(total=centroid.astype(np.float64) * count, count=count))
+        else:
+            centroid_index.upsert(collection.name, centroid)
 
-    logger.debug(f"top_1_collection called with threshold: {threshold}")
+    except Exception as e:
+        logger.error(f"Error retrieving centroid for collection '{collection.name}': {e}", exc_info=True)
 
-    collection_names = client.list_collections()
-    logger.debug(f"Found {len(collection_names)} collections.")
+# One load at a time: requests arriving while the startup load runs wait for it instead of starting their own
+_centroid_load_lock = asyncio.Lock()
+
+async def load_centroid_index(force: bool = False):
+    """
+    Loads every collection centroid from Chroma into the in-process routing index.
+    Called lazily on first use; force=True resyncs after collections were changed outside this process.
+    """
+    if centroid_index.loaded and not force:
+        return
 
-    # If no collections are present, create a new collection and return it
-    if not collection_names:
-        new_collection_name = f"collection-{uuid.uuid4()}"
-        logger.debug(f"No collections found. Creating a new collection: {new_collection_name}")
-        get_or_create_collection(new_collection_name)
-        return new_collection_name
+    async with _centroid_load_lock:
+        if centroid_index.loaded and not force:
+            return
 
-    stacked_embeddings = torch.stack(query_embedding)
-    avg_query_embedding = torch.mean(stacked_embeddings, dim=0).to(device=device)
-    
-    best_collection = None
-    highest_similarity = threshold
+        logger.info("Loading collection centroids into the routing index...")
+        centroid_index.clear()
 
-    # Iterate through each collection to retrieve the centroid and compute similarity
-    for collection_name in collection_names:
-        logger.debug(f"Processing collection: {collection_name}")
-        collection = collection_name
-        
-        try:
-            # Retrieve the centroid of the collection
-            logger.debug(f"Fetching centroid for collection: {collection_name}")
-            centroid_doc = collection.get(ids=["centroid"], include=["embeddings"])
+        # Fetch the centroids concurrently, bounded by the Chroma executor pool
+        collections = await chroma_call(chroma_client.list_collections)
+        await asyncio.gather(*[_load_centroid(collection) for collection in collections])
 
-            if not centroid_doc:
-                logger.debug(f"Centroid not found for collection {collection_name}. Updating centroid.")
-                await update_collection_centroid(collection=collection)
-                centroid_doc = collection.get(ids=["centroid"], include=["embeddings"])
+        centroid_index.sync_ann()
+        centroid_index.save_ann()
+        centroid_index.loaded = True
+        logger.info(f"Routing index loaded with {len(centroid_index)} collection centroids")
 
+def restore_centroid_index() -> bool:
+    """
+    Restores the routing index from the snapshot of the last clean shutdown, in time independent of the corpus size.
+    The snapshot is removed once loaded: after a crash there is none and the next start loads from Chroma instead.
+    """
+    if not CENTROID_SNAPSHOT_PATH or not centroid_index.load_snapshot(CENTROID_SNAPSHOT_PATH):
+        return False
+    os.remove(CENTROID_SNAPSHOT_PATH)
+    return True
 
-            centroid_embedding = torch.Tensor(centroid_doc['embeddings'][0]).to(device=device)
-            similarity_score = torch.nn.functional.cosine_similarity(
-                avg_query_embedding.unsqueeze(0), 
-                centroid_embedding.unsqueeze(0), 
-                dim=1
-            ).item()
-            logger.debug(f"Similarity score for collection {collection_name}: {similarity_score}")
+async def reconcile_centroid_index():
+    """
+    Brings a restored index in line with the collections Chroma holds now: one list call, then centroids are only
+    fetched for collections the index lacks, and collections that no longer exist are dropped
+    """
+    # Only names indexed before listing may be stale, a collection an upload opens meanwhile is not in the list yet
+    indexed = list(centroid_index.names)
+    collections = await chroma_call(chroma_client.list_collections)
+    existing = {collection.name for collection in collections}
+
+    for name in [name for name in indexed if name not in existing]:
+        centroid_index.remove(name)
+    missing = [collection for collection in collections if collection.name not in centroid_index]
+    await asyncio.gather(*[_load_centroid(collection) for collection in missing])
+    logger.info(f"Routing index reconciled with Chroma: {len(missing)} centroids fetched, {len(centroid_index)} in total")
+
+def save_centroid_index():
+    # On shutdown, once no writer is running any more
+    centroid_index.save_ann()
+    if CENTROID_SNAPSHOT_PATH and centroid_index.loaded:
+        centroid_index.save_snapshot(CENTROID_SNAPSHOT_PATH)
 
-            if similarity_score > highest_similarity:
-                highest_similarity = similarity_score
-                best_collection = collection.name
-                logger.debug(f"New best collection found: {best_collection} with similarity {highest_similarity}")
+#---------------------------------------------------------------------------------------------------------------
 
-        except Exception as e:
-            logger.error(f"Error retrieving centroid for collection '{collection_name}': {e}", exc_info=True)
-            continue  # In case a collection doesn't have a centroid or some other issue
-
-    if best_collection and highest_similarity >= threshold:
-        logger.debug(f"Best collection found: {best_collection} with similarity: {highest_similarity}")
-        return best_collection
-    else:
-        new_collection_name = f"collection-{uuid.uuid4()}"
-        logger.debug(f"No matching collection found or similarity below threshold. Creating a new collection: {new_collection_name}")
-        get_or_create_collection(new_collection_name)
-        return new_collection_name
+@observe_stage("route_to_collections")
+async def route_to_collections(group_embeddings: np.ndarray, threshold: float = 0.35) -> List[str]:
+    """
+    Destination collection for every row of a (groups, dim) matrix of chunk-group mean embeddings.
+    Groups scoring at most threshold against every collection open new collections; later groups of the same call
+    join such a new collection when they are similar enough to it, so one call does not open a collection per group.
+    """
+    logger.debug(f"route_to_collections called for {len(group_embeddings)} groups with threshold: {threshold}")
+
+    await load_centroid_index()
+    routed = centroid_index.top_k_batch(group_embeddings, k=1)
+
+    destinations: List[str] = []
+    new_names: List[str] = []
+    new_sums: List[np.ndarray] = []
+    for group, best in zip(group_embeddings, routed):
+        if best and best[0][1] > threshold:
+            destinations.append(best[0][0])
+            continue
+
+        vector = group / (np.linalg.norm(group) or 1.0)
+        if new_sums:
+            sums = np.stack(new_sums)
+            scores = sums @ vector / np.maximum(np.linalg.norm(sums, axis=1), 1e-12)
+            idx = int(np.argmax(scores))
+            if scores[idx] > threshold:
+                new_sums[idx] += vector
+                destinations.append(new_names[idx])
+                continue
+
+        new_names.append(f"collection-{uuid.uuid4()}")
+        new_sums.append(vector.astype(np.float64))
+        destinations.append(new_names[-1])
+
+    if new_names:
+        logger.debug(f"No matching collection for some groups. Creating {len(new_names)} new collections")
+        await asyncio.gather(*[get_or_create_collection(name) for name in new_names])
+
+    return destinations
 
 #---------------------------------------------------------------------------------------------------------------
 
@@ -186,13 +372,13 @@ async def update_query_centroid(filename:str, document:SearchDocument ):
     try:
         
         embeddings = document.embedding.content
-        stacked_embeddings = torch.stack(embeddings)
-        centroid = torch.mean(stacked_embeddings, dim=0)
+        centroid = embeddings.mean(axis=0, keepdims=True)
 
-        document.centroid.content = [centroid]
+        document.centroid.content = centroid
         document.centroid.error = None
 
     except Exception as e:
+        document.centroid.error = f"Failed to compute the query centroid: {str(e)}"
         logger.error(f"An error occurred while updating the centroid for query. Error: {str(e)}", exc_info=True)
     
     logger.debug(f"Completed update_query_centroid for query : {filename}")
@@ -209,68 +395,201 @@ async def update_top_k_collections(query:str, document:SearchDocument, top_k:int
     try:
         if not document.centroid.error:
             query_centroid = document.centroid.content
-            stacked_embeddings = torch.stack(query_centroid)
-            avg_query_embedding = torch.mean(stacked_embeddings, dim=0).to(device=device)
-            
-            collections_list = chroma_client.list_collections()
-            similarity_scores = []
-
-            for collection in collections_list:
-                logger.debug(f"Fetching centroid for collection: {collection.name}")
-                centroid_doc = collection.get(ids=["centroid"], include=["embeddings"])
-                if len(centroid_doc['embeddings']) == 0:
-                    logger.warning(f"No centroid embedding found for collection: {collection.name}")
-                    continue
-
-                centroid_embedding = torch.Tensor(centroid_doc['embeddings'][0]).to(device=device)
-                similarity_score = torch.nn.functional.cosine_similarity(
-                    avg_query_embedding.unsqueeze(0), 
-                    centroid_embedding.unsqueeze(0), 
-                    dim=1
-                ).item()
-
-                if similarity_score >= threshold:
-                    logger.info(f"collection_name:{collection.name} similarity_score:{similarity_score}")
-                    similarity_scores.append((collection.name, similarity_score))
-
-            sorted_collections = sorted(similarity_scores, key=lambda x: x[1], reverse=True)
-            collection_names = [name for name, _ in sorted_collections[:top_k]]
-            
-            document.top_k_collections = collection_names
+            avg_query_embedding = query_centroid.mean(axis=0)
+
+            await load_centroid_index()
+            sorted_collections = centroid_index.top_k(avg_query_embedding, k=top_k, threshold=threshold)
+
+            for collection_name, similarity_score in sorted_collections:
+                logger.info(f"collection_name:{collection_name} similarity_score:{similarity_score}")
+
+            document.top_k_collections = [name for name, _ in sorted_collections]
         
     except Exception as e:
+        document.error = f"Failed to route the query: {str(e)}"
         logger.error(f"An error occuered while finding top_k_collections for query. Error: {str(e)}",exc_info=True)
 
     logger.debug(f"Completed update_top_k_collections for query : {query}")
 
 #---------------------------------------------------------------------------------------------------------------
 
-async def update_top_k_documents(query:str, document:SearchDocument, top_k:int, threshold: float = 0.0):
+def distance_to_score(distance: float) -> float:
+    # Collections use Chroma's default squared L2 space; on unit-length embeddings that is 2 - 2 * cosine
+    return 1.0 - distance / 2.0
+
+def scored_chunks(results: Dict, row: int = 0) -> List[ScoredChunk]:
+    """
+    Turns one query row of a collection.query result into ScoredChunks, best first
+    """
+    return [
+        (distance_to_score(distance), chunk_id, text)
+        for chunk_id, text, distance in zip(results["ids"][row], results["documents"][row], results["distances"][row])
+    ]
+
+def chunks_overlap(first: str, second: str, min_chars: int = SEARCH_DEDUPE_MIN_OVERLAP) -> bool:
+    """
+    True when one text contains the other, or the end of one is the start of the other for at least min_chars
+    characters, as with consecutive chunks of a file that share the splitter's chunk_overlap.
+    Containment only counts when the shorter text has min_chars characters, a short chunk like a heading is kept.
+    """
+    if min(len(first), len(second)) >= min_chars and (first in second or second in first):
+        return True
+    return _tail_is_head(first, second, min_chars) or _tail_is_head(second, first, min_chars)
+
+def _tail_is_head(first: str, second: str, min_chars: int) -> bool:
+    if min_chars <= 0 or len(second) < min_chars:
+        return False
+    probe = second[:min_chars]
+    # Candidate starts of the shared part; it cannot be longer than second
+    pos = first.find(probe, max(0, len(first) - len(second)))
+    while pos != -1:
+        if second.startswith(first[pos:]):
+            return True
+        pos = first.find(probe, pos + 1)
+    return False
+
+def merge_top_k(ranked: List[List[ScoredChunk]], top_k: int, min_score: float = float("-inf")) -> List[ScoredChunk]:
+    """
+    k-way heap merge of per-collection ranked chunks into one global top k.
+    Drops repeated ids and chunks that overlap a better chunk: contained in it, or its neighbour in the same file
+    sharing the splitter's chunk_overlap (see chunks_overlap).
+    """
+    selected: List[ScoredChunk] = []
+    seen_ids = set()
+
+    for score, chunk_id, text in heapq.merge(*ranked, key=lambda chunk: -chunk[0]):
+        if len(selected) == top_k or score < min_score:
+            break
+        if chunk_id in seen_ids or any(chunks_overlap(text, kept_text) for _, _, kept_text in selected):
+            continue
+        seen_ids.add(chunk_id)
+        selected.append((score, chunk_id, text))
+
+    return selected
+
+async def query_collection(collection_name: str, query_embeddings: List[List[float]], n_results: int) -> Dict:
+    collection = await chroma_call(chroma_client.get_collection, name=collection_name)
+    return await chroma_call(
+        collection.query,
+        query_embeddings=query_embeddings,
+        n_results=n_results,
+        include=["documents", "distances"],
+        where={"is_centroid": False}
+    )
+
+#---------------------------------------------------------------------------------------------------------------
+
+async def update_top_k_documents(
+    query:str,
+    document:SearchDocument,
+    top_k:int,
+    threshold: float = 0.0,
+    early_stop_score: float = SEARCH_EARLY_STOP_SCORE
+):
     """
-    Gets a file_map and query and tries to find relevant documents from a collection to send as additional context
+    Queries every routed collection concurrently and keeps the global top_k chunks with their scores.
+    Remaining collection queries are cancelled once the top_k found so far all score at least early_stop_score.
+    A collection whose query fails is recorded in document.error, the other collections' results are kept.
     """
 
-    logger.debug("start update_top_k_documents for query : {query}")
+    logger.debug(f"start update_top_k_documents for query : {query}")
+
+    async def query_one(collection_name: str, query_embedding: List[List[float]]):
+        try:
+            return collection_name, await query_collection(collection_name, query_embedding, top_k)
+        except Exception as e:
+            logger.error(f"An error occuered while querying collection {collection_name}. Error : {str(e)}",exc_info=True)
+            return collection_name, None
 
+    tasks = []
     try:
-        query_embedding = document.embedding.vectordb_embeddings
-        collection_list = document.top_k_collections
-        for collection_name in collection_list:
-            logger.debug(f"collection_name {collection_name}")
-            collection = chroma_client.get_collection(name=collection_name)
-            
-            results = collection.query(
-                query_embeddings=query_embedding,
-                n_results=top_k,
-                include=["documents"],
-                where={"is_centroid": False}
-            )
+        query_embedding = document.embedding.to_wire()
+        tasks = [
+            asyncio.create_task(query_one(collection_name, query_embedding))
+            for collection_name in document.top_k_collections
+        ]
 
-            if "documents" in results and results["documents"]:
-                for doc_list in results["documents"]:
-                    document.top_k_results.extend(doc_list)
+        ranked: List[List[ScoredChunk]] = []
+        top: List[ScoredChunk] = []
+        failed: List[str] = []
+        for next_result in asyncio.as_completed(tasks):
+            collection_name, results = await next_result
+            if results is None:
+                failed.append(collection_name)
+                continue
+            ranked.extend(scored_chunks(results, row) for row in range(len(results["ids"])))
+            top = merge_top_k(ranked, top_k, min_score=threshold)
+
+            if len(top) == top_k and top[-1][0] >= early_stop_score:
+                logger.debug(f"Early stop for query : {query}, top {top_k} all score >= {early_stop_score}")
+                break
+
+        document.top_k_results = [text for _, _, text in top]
+        document.top_k_scores = [score for score, _, _ in top]
+        if failed:
+            document.error = f"Failed to query collection {', '.join(failed)}"
 
     except Exception as e:
+        document.error = f"Failed to query the routed collections: {str(e)}"
         logger.error(f"An error occuered while finding top_k_documents for query. Error : {str(e)}",exc_info=True)
+
+    finally:
+        for task in tasks:
+            task.cancel()
     
-    logger.debug(f"Completed update_top_k_documents for query : {query}")
\ No newline at end of file
+    logger.debug(f"Completed update_top_k_documents for query : {query}")
+
+#---------------------------------------------------------------------------------------------------------------
+
+async def update_top_k_collections_batch(documents: List[SearchDocument], top_k: List[int], threshold: float = 0.25):
+    """
+    update_top_k_collections for many query chunks at once: one matrix multiply against all collection centroids
+    """
+    if not documents:
+        return
+
+    await load_centroid_index()
+    centroids = np.stack([document.centroid.content.mean(axis=0) for document in documents])
+    routed = centroid_index.top_k_batch(centroids, k=max(top_k), threshold=threshold)
+
+    for document, k, collections in zip(documents, top_k, routed):
+        document.top_k_collections = [name for name, _ in collections[:k]]
+
+async def update_top_k_documents_batch(documents: List[SearchDocument], top_k: List[int], threshold: float = 0.0):
+    """
+    update_top_k_documents for many query chunks at once.
+    Chunks are grouped by routed collection so each collection gets one query with many query_embeddings.
+    """
+    by_collection: Dict[str, List[int]] = {}
+    for idx, document in enumerate(documents):
+        for collection_name in document.top_k_collections:
+            by_collection.setdefault(collection_name, []).append(idx)
+
+    async def query_group(collection_name: str, members: List[int]):
+        try:
+            results = await query_collection(
+                collection_name,
+                query_embeddings=[documents[idx].embedding.to_wire()[0] for idx in members],
+                n_results=max(top_k[idx] for idx in members),
+            )
+            return collection_name, members, results
+        except Exception as e:
+            logger.error(f"An error occuered while querying collection {collection_name}. Error : {str(e)}",exc_info=True)
+            return collection_name, members, None
+
+    logger.debug(f"Querying {len(by_collection)} collections for {len(documents)} query chunks")
+    grouped = await asyncio.gather(*[query_group(name, members) for name, members in by_collection.items()])
+
+    ranked: List[List[List[ScoredChunk]]] = [[] for _ in documents]
+    for collection_name, members, results in grouped:
+        if results is None:
+            for idx in members:
+                documents[idx].error = f"Failed to query collection {collection_name}"
+            continue
+        for row, idx in enumerate(members):
+            ranked[idx].append(scored_chunks(results, row))
+
+    for document, k, document_ranked in zip(documents, top_k, ranked):
+        top = merge_top_k(document_ranked, k, min_score=threshold)
+        document.top_k_results = [text for _, _, text in top]
+        document.top_k_scores = [score for score, _, _ in top]
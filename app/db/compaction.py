@@ -0,0 +1,260 @@
+import asyncio
+import math
+import os
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from chromadb.api.models.Collection import Collection
+from app.db.client import chroma_client,get_or_create_collection,load_centroid_index
+from app.db.executor import chroma_call
+from app.db.index import centroid_index
+from app.db.writer import collection_writers
+from app.logger import logger
+from app.metrics import ERRORS_TOTAL, observe_stage
+
+# Seconds between background compaction passes, 0 disables the background job (POST /index/compact still works)
+COMPACTION_INTERVAL_S = float(os.getenv("COMPACTION_INTERVAL_S", "300"))
+# Collections above this many chunks are split with k-means into parts of about half this size
+COMPACTION_SPLIT_MAX_CHUNKS = int(os.getenv("COMPACTION_SPLIT_MAX_CHUNKS", "20000"))
+# Collections whose centroids are at least this similar are merged, as long as the result stays below the split size
+COMPACTION_MERGE_SIMILARITY = float(os.getenv("COMPACTION_MERGE_SIMILARITY", "0.9"))
+# Throttling: at most this many splits / merges per pass, chunks moved per Chroma call, pause between calls
+COMPACTION_MAX_OPERATIONS = int(os.getenv("COMPACTION_MAX_OPERATIONS", "10"))
+COMPACTION_BATCH_SIZE = int(os.getenv("COMPACTION_BATCH_SIZE", "1000"))
+COMPACTION_PAUSE_S = float(os.getenv("COMPACTION_PAUSE_S", "0.05"))
+
+KMEANS_ITERATIONS = 20
+MERGE_SCAN_BLOCK_ROWS = 1024
+
+#---------------------------------------------------------------------------------------------------------------
+
+def spherical_kmeans(embeddings: np.ndarray, k: int, seed: int = 0) -> np.ndarray:
+    """
+    Cluster label per row; cosine k-means with k-means++ seeding on L2-normalized rows
+    """
+    rng = np.random.default_rng(seed)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    points = embeddings / np.where(norms > 0, norms, 1)
+
+    centers = [points[rng.integers(len(points))]]
+    for _ in range(1, k):
+        distance = 1.0 - np.max(points @ np.stack(centers).T, axis=1)
+        weights = np.clip(distance, 0, None)
+        total = weights.sum()
+        centers.append(points[rng.choice(len(points), p=weights / total)] if total > 0 else points[rng.integers(len(points))])
+    centers = np.stack(centers)
+
+    labels = np.zeros(len(points), dtype=np.intp)
+    for _ in range(KMEANS_ITERATIONS):
+        new_labels = np.argmax(points @ centers.T, axis=1)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        for cluster in range(k):
+            members = points[labels == cluster]
+            if len(members):
+                center = members.sum(axis=0)
+                centers[cluster] = center / (np.linalg.norm(center) or 1.0)
+    return labels
+
+def merge_candidates(names: List[str], matrix: np.ndarray, counts: Dict[str, int], min_similarity: float, max_chunks: int) -> List[Tuple[str, str]]:
+    """
+    (source, target) pairs of near-duplicate collections, most similar first; every collection is in at most one pair.
+    The smaller collection is the source so fewer chunks move.
+    """
+    pairs = {}
+    # Blocks of rows keep the score matrix small when the exact scan is used
+    for start in range(0, len(names), MERGE_SCAN_BLOCK_ROWS):
+        routed = centroid_index.top_k_batch(matrix[start:start + MERGE_SCAN_BLOCK_ROWS], k=2, threshold=min_similarity)
+        for name, neighbours in zip(names[start:start + MERGE_SCAN_BLOCK_ROWS], routed):
+            for other, score in neighbours:
+                if other != name:
+                    pairs[(min(name, other), max(name, other))] = score
+
+    merged = set()
+    result = []
+    for score, first, second in sorted(((score, *pair) for pair, score in pairs.items()), reverse=True):
+        if first in merged or second in merged or counts.get(first, 0) + counts.get(second, 0) > max_chunks:
+            continue
+        source, target = (first, second) if counts.get(first, 0) <= counts.get(second, 0) else (second, first)
+        merged.update((first, second))
+        result.append((source, target))
+    return result
+
+#---------------------------------------------------------------------------------------------------------------
+
+class CollectionCompactor:
+    """
+    Background job that keeps collections in shape: splits oversized collections with k-means and merges
+    collections with near-identical centroids. Chunks keep their ids and metadata and the running centroid sums are
+    updated as chunks move. Work is done in small batches and waits while busy() reports foreground load.
+    """
+
+    def __init__(self, interval: float, busy: Optional[Callable[[], bool]] = None):
+        self.interval = interval
+        self.busy = busy or (lambda: False)
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def start(self):
+        if self.interval <= 0 or (self._task is not None and not self._task.done()):
+            return
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        logger.info(f"Collection compaction started, every {self.interval}s")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Collection compaction pass failed. Error: {str(e)}", exc_info=True)
+
+    async def _throttle(self):
+        await asyncio.sleep(COMPACTION_PAUSE_S)
+        while self.busy():
+            await asyncio.sleep(max(COMPACTION_PAUSE_S, 0.1))
+
+    #-----------------------------------------------------------------------------------------------------------
+
+    @observe_stage("compaction")
+    async def run_once(self) -> Dict:
+        """
+        One compaction pass: splits first, then merges, at most COMPACTION_MAX_OPERATIONS of each
+        """
+        async with self._lock:
+            await load_centroid_index()
+            report = {"split": [], "merged": []}
+
+            oversized = sorted(
+                (name for name, stats in centroid_index.stats.items() if stats.count > COMPACTION_SPLIT_MAX_CHUNKS),
+                key=lambda name: -centroid_index.stats[name].count,
+            )
+            for name in oversized[:COMPACTION_MAX_OPERATIONS]:
+                created = await self._guarded(self.split_collection, name)
+                if created:
+                    report["split"].append({"collection": name, "into": created})
+
+            names = list(centroid_index.names)
+            counts = {name: stats.count for name, stats in centroid_index.stats.items()}
+            pairs = merge_candidates(names, centroid_index.matrix.copy(), counts, COMPACTION_MERGE_SIMILARITY, COMPACTION_SPLIT_MAX_CHUNKS)
+            for source, target in pairs[:COMPACTION_MAX_OPERATIONS]:
+                if await self._guarded(self.merge_collections, source, target):
+                    report["merged"].append({"collection": source, "into": target})
+
+            logger.info(f"Compaction pass finished: {len(report['split'])} splits, {len(report['merged'])} merges")
+            return report
+
+    async def _guarded(self, operation, *args):
+        try:
+            return await operation(*args)
+        except Exception as e:
+            ERRORS_TOTAL.labels("compaction").inc()
+            logger.error(f"Compaction {operation.__name__}{args} failed. Error: {str(e)}", exc_info=True)
+            return None
+
+    async def _fetch_chunks(self, collection: Collection) -> Dict:
+        return await chroma_call(collection.get, where={"is_centroid": False}, include=["embeddings", "documents", "metadatas"])
+
+    async def _move(self, source: Collection, target_name: str, chunks: Dict, rows: List[int], update_source: bool = True):
+        """
+        Moves the given rows of a _fetch_chunks result from source to target, COMPACTION_BATCH_SIZE chunks per call.
+        Both sides go through the collection writers, so moves merge with concurrent uploads to the same collections.
+        update_source=False deletes from source directly and leaves its centroid alone, for a source that is dropped.
+        A chunk whose id the target already holds is another copy and moves under a new id rather than replacing it;
+        chunks are only deleted from source once the target holds every one of them.
+        """
+        target = await get_or_create_collection(target_name)
+        for start in range(0, len(rows), COMPACTION_BATCH_SIZE):
+            batch = rows[start:start + COMPACTION_BATCH_SIZE]
+            ids = [chunks["ids"][row] for row in batch]
+            embeddings = np.asarray([chunks["embeddings"][row] for row in batch], dtype=np.float32)
+
+            taken = set((await chroma_call(target.get, ids=ids, include=[]))["ids"])
+            target_ids = [f"{chunk_id}-{uuid.uuid4().hex[:8]}" if chunk_id in taken else chunk_id for chunk_id in ids]
+
+            await collection_writers.add(
+                target_name,
+                texts=[chunks["documents"][row] for row in batch],
+                embeddings=embeddings,
+                ids=target_ids,
+                metadatas=[chunks["metadatas"][row] for row in batch],
+            )
+
+            stored = (await chroma_call(target.get, ids=target_ids, include=[]))["ids"]
+            if len(stored) != len(target_ids):
+                raise RuntimeError(f"Only {len(stored)} of {len(target_ids)} moved chunks are in {target_name}, leaving them in {source.name}")
+
+            if update_source:
+                await collection_writers.delete(source.name, ids=ids)
+            else:
+                await chroma_call(source.delete, ids=ids)
+
+            await self._throttle()
+
+    async def split_collection(self, name: str) -> List[str]:
+        """
+        Splits a collection with k-means; the largest cluster stays, every other cluster moves to a new collection
+        """
+        collection = await chroma_call(chroma_client.get_collection, name=name)
+        chunks = await self._fetch_chunks(collection)
+        if len(chunks["ids"]) <= COMPACTION_SPLIT_MAX_CHUNKS:
+            return []
+
+        k = math.ceil(len(chunks["ids"]) / max(COMPACTION_SPLIT_MAX_CHUNKS // 2, 1))
+        embeddings = np.asarray(chunks["embeddings"], dtype=np.float32)
+        labels = await asyncio.to_thread(spherical_kmeans, embeddings, k)
+        del embeddings
+
+        sizes = np.bincount(labels, minlength=k)
+        keep = int(np.argmax(sizes))
+        logger.info(f"Splitting collection {name} with {len(labels)} chunks into clusters of {sizes.tolist()}")
+
+        created = []
+        for cluster in range(k):
+            if cluster == keep or sizes[cluster] == 0:
+                continue
+            new_name = f"collection-{uuid.uuid4()}"
+            await self._move(collection, new_name, chunks, np.flatnonzero(labels == cluster).tolist())
+            created.append(new_name)
+        return created
+
+    async def merge_collections(self, source_name: str, target_name: str) -> bool:
+        """
+        Moves every chunk of source into target and deletes source
+        """
+        if source_name not in centroid_index or target_name not in centroid_index:
+            return False
+
+        logger.info(f"Merging collection {source_name} into {target_name}")
+        source = await chroma_call(chroma_client.get_collection, name=source_name)
+
+        try:
+            # Writes routed to source go to target from here on; source leaves routing once its queued writes are in
+            await collection_writers.close(source_name, redirect=target_name)
+            while True:
+                chunks = await self._fetch_chunks(source)
+                if not chunks["ids"]:
+                    break
+                await self._move(source, target_name, chunks, list(range(len(chunks["ids"]))), update_source=False)
+        except Exception:
+            # Whatever is left stays a collection of its own: writable again and back in routing with its centroid
+            collection_writers.reopen(source_name)
+            await collection_writers.recompute(source_name)
+            raise
+
+        await chroma_call(chroma_client.delete_collection, name=source_name)
+        return True
+
+# Shared by the background job and POST /index/compact; app/server.py wires busy to the foreground queues
+collection_compactor = CollectionCompactor(interval=COMPACTION_INTERVAL_S)
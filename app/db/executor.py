@@ -0,0 +1,130 @@
+import asyncio
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, Tuple, Type
+from app.logger import logger
+from app.metrics import CHROMA_CALL_SECONDS, ERRORS_TOTAL, QUEUE_DEPTH
+
+# Concurrent Chroma calls; also the number of keep-alive connections the shared HTTP client ends up holding
+CHROMA_POOL_SIZE = int(os.getenv("CHROMA_POOL_SIZE", "8"))
+CHROMA_TIMEOUT_S = float(os.getenv("CHROMA_TIMEOUT_S", "30"))
+# Writes are not retried on timeout, so they get longer before the caller sees a TimeoutError
+CHROMA_WRITE_TIMEOUT_S = float(os.getenv("CHROMA_WRITE_TIMEOUT_S", "90"))
+# Timeout of the HTTP client itself; it ends a hung request on the pool thread, which wait_for cannot do
+CHROMA_HTTP_TIMEOUT_S = float(os.getenv("CHROMA_HTTP_TIMEOUT_S", "60"))
+CHROMA_RETRIES = int(os.getenv("CHROMA_RETRIES", "2"))
+CHROMA_RETRY_BACKOFF_S = float(os.getenv("CHROMA_RETRY_BACKOFF_S", "0.1"))
+
+# Client methods that only read; a timed-out read is simply issued again
+_READ_CALLS = frozenset({"get", "query", "count", "peek", "list_collections", "get_collection", "count_collections", "heartbeat"})
+
+def _retryable_errors() -> Tuple[Type[BaseException], ...]:
+    # Transport errors: the failed attempt has finished, so a retry never runs alongside it
+    errors: Tuple[Type[BaseException], ...] = (ConnectionError,)
+    try:
+        import httpx
+        errors += (httpx.TransportError,)
+    except ImportError:
+        pass
+    try:
+        import requests
+        errors += (requests.ConnectionError, requests.Timeout)
+    except ImportError:
+        pass
+    return errors
+
+class ChromaExecutor:
+    """
+    Runs blocking chromadb client calls on a dedicated, bounded thread pool so they never block the event loop.
+    Every call gets a timeout and is retried with exponential backoff on transport errors. Timeouts are only
+    retried for reads: wait_for cannot stop the pool thread, so a retried write would run alongside the first
+    attempt and could apply twice. A write gets write_timeout instead and then fails; the HTTP client timeout
+    (CHROMA_HTTP_TIMEOUT_S) frees its pool thread.
+    """
+
+    def __init__(self, pool_size: int, timeout: float, write_timeout: float, retries: int, backoff: float):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.write_timeout = write_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._retryable = _retryable_errors()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._in_flight = 0
+
+    @property
+    def queue_depth(self) -> int:
+        # Calls waiting for a free pool thread
+        return max(0, self._in_flight - self.pool_size)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="chroma")
+        return self._executor
+
+    async def call(
+        self,
+        fn: Callable[..., Any],
+        *args,
+        timeout: Optional[float] = None,
+        retries: Optional[int] = None,
+        **kwargs
+    ) -> Any:
+        loop = asyncio.get_running_loop()
+        name = getattr(fn, "__name__", repr(fn))
+        is_read = name in _READ_CALLS
+        if timeout is None:
+            timeout = self.timeout if is_read else self.write_timeout
+        retries = self.retries if retries is None else retries
+        start = time.perf_counter()
+        self._in_flight += 1
+
+        try:
+            for attempt in range(retries + 1):
+                future = loop.run_in_executor(self._get_executor(), functools.partial(fn, *args, **kwargs))
+                try:
+                    return await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+
+                except asyncio.TimeoutError:
+                    if not is_read:
+                        logger.error(f"Chroma write {name} did not finish within {timeout}s, it may still be applied")
+                        raise
+                    if attempt == retries:
+                        raise
+                    delay = self.backoff * (2 ** attempt)
+                    logger.warning(f"Chroma call {name} timed out after {timeout}s, retry {attempt + 1}/{retries} in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+
+                except self._retryable as e:
+                    if attempt == retries:
+                        raise
+                    delay = self.backoff * (2 ** attempt)
+                    logger.warning(f"Chroma call {name} failed ({type(e).__name__}: {e}), retry {attempt + 1}/{retries} in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+
+        except Exception:
+            ERRORS_TOTAL.labels(f"chroma.{name}").inc()
+            raise
+
+        finally:
+            self._in_flight -= 1
+            CHROMA_CALL_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+chroma_executor = ChromaExecutor(
+    pool_size=CHROMA_POOL_SIZE,
+    timeout=CHROMA_TIMEOUT_S,
+    write_timeout=CHROMA_WRITE_TIMEOUT_S,
+    retries=CHROMA_RETRIES,
+    backoff=CHROMA_RETRY_BACKOFF_S,
+)
+QUEUE_DEPTH.labels("chroma").set_function(lambda: chroma_executor.queue_depth)
+
+# Shorthand used across app.db: await chroma_call(collection.add, documents=..., ...)
+chroma_call = chroma_executor.call
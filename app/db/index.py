@@ -0,0 +1,455 @@
+import importlib.util
+import json
+import os
+import numpy as np
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+from app.logger import logger
+
+# Optional HNSW candidate search for large collection counts: "off" (exact scan only) or "hnsw" (needs hnswlib)
+CENTROID_ANN = os.getenv("CENTROID_ANN", "off")
+# Below this many collections the exact matrix scan is already fast enough
+CENTROID_ANN_MIN_COLLECTIONS = int(os.getenv("CENTROID_ANN_MIN_COLLECTIONS", "5000"))
+# Directory the graph is saved to on shutdown and reloaded from on startup, unset keeps it in memory only
+CENTROID_ANN_DIR = os.getenv("CENTROID_ANN_DIR")
+CENTROID_ANN_M = int(os.getenv("CENTROID_ANN_M", "16"))
+CENTROID_ANN_EF_CONSTRUCTION = int(os.getenv("CENTROID_ANN_EF_CONSTRUCTION", "200"))
+CENTROID_ANN_EF_SEARCH = int(os.getenv("CENTROID_ANN_EF_SEARCH", "64"))
+# A centroid is re-inserted into the graph once its cosine to the indexed vector drops below this
+CENTROID_ANN_REINDEX_COSINE = float(os.getenv("CENTROID_ANN_REINDEX_COSINE", "0.995"))
+# Graph candidates per requested result, re-scored exactly against the dense matrix
+CENTROID_ANN_OVERSAMPLE = int(os.getenv("CENTROID_ANN_OVERSAMPLE", "4"))
+# Routing index snapshot (.npz) written on shutdown and restored on a persistent start, unset disables it
+CENTROID_SNAPSHOT_PATH = os.getenv("CENTROID_SNAPSHOT_PATH")
+
+@dataclass
+class CentroidStats:
+    """
+    Running sum and count of the chunk embeddings in one collection; the centroid is total / count
+    """
+    total: np.ndarray
+    count: int
+    updates: int = 0
+
+    @property
+    def mean(self) -> np.ndarray:
+        return (self.total / self.count).astype(np.float32)
+
+class CollectionVersions:
+    """
+    Monotonic change counters for cache invalidation. Every bump takes the next value of one global clock, so a
+    result computed at clock t is still current as long as none of the collections it read has a version above t.
+    membership is the clock of the last time a collection was added to or removed from routing.
+    """
+
+    def __init__(self):
+        self.clock = 0
+        self.membership = 0
+        self._versions: Dict[str, int] = {}
+
+    def bump(self, name: str):
+        self.clock += 1
+        self._versions[name] = self.clock
+
+    def bump_membership(self):
+        self.clock += 1
+        self.membership = self.clock
+
+    def get(self, name: str) -> int:
+        return self._versions.get(name, 0)
+
+    def changed_since(self, names: Iterable[str], clock: int) -> bool:
+        return self.membership > clock or any(self._versions.get(name, 0) > clock for name in names)
+
+class AnnIndex:
+    """
+    HNSW graph (hnswlib) over the normalized collection centroids that returns routing candidates in sub-linear time.
+    A centroid is only re-inserted once it drifted past reindex_cosine from its indexed vector, so the graph may lag
+    slightly behind; CentroidIndex re-scores every candidate exactly, which keeps the returned scores current.
+    A new collection takes over the slot of a removed one, so splits and merges do not grow the graph.
+    """
+
+    _GRAPH_FILE = "centroids.hnsw"
+    _LABELS_FILE = "centroids.labels.json"
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        m: int = 16,
+        ef_construction: int = 200,
+        ef_search: int = 64,
+        reindex_cosine: float = 0.995,
+        initial_capacity: int = 1024,
+    ):
+        import hnswlib  # optional dependency, only needed when the ANN index is enabled
+
+        self._hnswlib = hnswlib
+        self.directory = directory
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.reindex_cosine = reindex_cosine
+        self.initial_capacity = initial_capacity
+        self.labels: Dict[str, int] = {}
+        self.names: Dict[int, str] = {}
+        self.next_label = 0
+        # Slots of removed collections that a new collection can take over
+        self.deleted = 0
+        self.dirty = False
+        self._index = None
+
+        if directory is not None:
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def _create(self, dim: int):
+        self._index = self._hnswlib.Index(space="ip", dim=dim)
+        self._index.init_index(max_elements=self.initial_capacity, M=self.m, ef_construction=self.ef_construction, allow_replace_deleted=True)
+        self._index.set_ef(self.ef_search)
+
+    def upsert(self, name: str, vector: np.ndarray):
+        if self._index is None:
+            self._create(vector.shape[0])
+        elif self._index.dim != vector.shape[0]:
+            # Restored graph from another embedding model, start over
+            logger.warning(f"ANN index dimension {self._index.dim} does not match centroid dimension {vector.shape[0]}. Rebuilding it.")
+            self.clear()
+            self._create(vector.shape[0])
+
+        label = self.labels.get(name)
+        if label is not None:
+            indexed = np.asarray(self._index.get_items([label])[0], dtype=np.float32)
+            if float(indexed @ vector) >= self.reindex_cosine:
+                return
+            # Updated in place; replace_deleted would leave the old element of the label behind
+            self._index.add_items(vector.reshape(1, -1), [label])
+            self.dirty = True
+            return
+
+        label = self.next_label
+        self.next_label += 1
+        self.labels[name] = label
+        self.names[label] = name
+
+        if self.deleted:
+            self._index.add_items(vector.reshape(1, -1), [label], replace_deleted=True)
+            self.deleted -= 1
+        else:
+            capacity = self._index.get_max_elements()
+            if self._index.element_count >= capacity:
+                self._index.resize_index(capacity * 2)
+            self._index.add_items(vector.reshape(1, -1), [label])
+        self.dirty = True
+
+    def remove(self, name: str):
+        label = self.labels.pop(name, None)
+        if label is None:
+            return
+        del self.names[label]
+        self._index.mark_deleted(label)
+        self.deleted += 1
+        self.dirty = True
+
+    def retain(self, names: Iterable[str]):
+        # Drops graph entries of collections that no longer exist, e.g. after restoring a saved graph
+        keep = set(names)
+        for name in [name for name in self.labels if name not in keep]:
+            self.remove(name)
+
+    def clear(self):
+        self.labels = {}
+        self.names = {}
+        self.next_label = 0
+        self.deleted = 0
+        self.dirty = True
+        self._index = None
+
+    def candidates(self, queries: np.ndarray, count: int) -> Optional[List[List[str]]]:
+        """
+        Up to count approximate nearest collection names per query row, or None if the graph cannot answer
+        """
+        count = min(count, len(self.labels))
+        if self._index is None or count == 0:
+            return None
+
+        self._index.set_ef(max(self.ef_search, count))
+        try:
+            labels, _ = self._index.knn_query(queries, k=count)
+        except RuntimeError:
+            # Too few reachable elements, e.g. right after many deletions
+            return None
+        return [[self.names[label] for label in row if label in self.names] for row in labels]
+
+    #-----------------------------------------------------------------------------------------------------------
+
+    def save(self):
+        """
+        Writes the graph and its label map to directory; both are replaced atomically
+        """
+        if self.directory is None or not self.dirty or self._index is None:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        graph_path = os.path.join(self.directory, self._GRAPH_FILE)
+        labels_path = os.path.join(self.directory, self._LABELS_FILE)
+
+        self._index.save_index(graph_path + ".tmp")
+        with open(labels_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"dim": self._index.dim, "next_label": self.next_label, "labels": self.labels}, f)
+        os.replace(graph_path + ".tmp", graph_path)
+        os.replace(labels_path + ".tmp", labels_path)
+
+        self.dirty = False
+        logger.info(f"ANN index with {len(self.labels)} centroids saved to {self.directory}")
+
+    def _load(self):
+        graph_path = os.path.join(self.directory, self._GRAPH_FILE)
+        labels_path = os.path.join(self.directory, self._LABELS_FILE)
+        if not (os.path.exists(graph_path) and os.path.exists(labels_path)):
+            return
+
+        try:
+            with open(labels_path, encoding="utf-8") as f:
+                saved = json.load(f)
+            index = self._hnswlib.Index(space="ip", dim=saved["dim"])
+            index.load_index(graph_path, allow_replace_deleted=True)
+            index.set_ef(self.ef_search)
+        except Exception as e:
+            logger.warning(f"Could not load ANN index from {self.directory}, it will be rebuilt. Error: {e}")
+            return
+
+        self._index = index
+        self.labels = {name: int(label) for name, label in saved["labels"].items()}
+        self.names = {label: name for name, label in self.labels.items()}
+        self.next_label = saved["next_label"]
+        self.deleted = index.element_count - len(self.labels)
+        logger.info(f"ANN index with {len(self.labels)} centroids loaded from {self.directory}")
+
+class CentroidIndex:
+    """
+    Process-local routing index: one L2-normalized centroid row per collection.
+    Cosine similarity against every collection is a single matrix-vector product.
+    With an AnnIndex attached and at least ann_min_collections collections, only the graph candidates are scored.
+    """
+
+    def __init__(self, initial_capacity: int = 64, ann: Optional[AnnIndex] = None, ann_min_collections: int = 0, ann_oversample: int = 4):
+        # Kept across clear(), versions must never go backwards
+        self.versions = CollectionVersions()
+        self.ann = ann
+        self.ann_min_collections = ann_min_collections
+        self.ann_oversample = ann_oversample
+        self.names: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.stats: Dict[str, CentroidStats] = {}
+        self.loaded = False
+        self._initial_capacity = initial_capacity
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.rows
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._matrix[:len(self.names)]
+
+    def clear(self):
+        # The ANN graph is kept: reloading the same centroids only re-inserts the ones that moved, see sync_ann
+        self.names = []
+        self.rows = {}
+        self.stats = {}
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self.loaded = False
+
+    def upsert(self, name: str, centroid: np.ndarray):
+        vector = _normalize(np.asarray(centroid, dtype=np.float32).reshape(-1))
+
+        if self._matrix.shape[1] != vector.shape[0]:
+            if self.names:
+                raise ValueError(f"Centroid dimension {vector.shape[0]} does not match index dimension {self._matrix.shape[1]}")
+            self._matrix = np.empty((self._initial_capacity, vector.shape[0]), dtype=np.float32)
+
+        row = self.rows.get(name)
+        if row is None:
+            row = len(self.names)
+            if row == self._matrix.shape[0]:
+                grown = np.empty((max(row * 2, self._initial_capacity), self._matrix.shape[1]), dtype=np.float32)
+                grown[:row] = self._matrix[:row]
+                self._matrix = grown
+            self.names.append(name)
+            self.rows[name] = row
+            self.versions.bump_membership()
+
+        self._matrix[row] = vector
+        if self.ann is not None:
+            self.ann.upsert(name, vector)
+
+    def set_stats(self, name: str, stats: CentroidStats):
+        self.stats[name] = stats
+        self.upsert(name, stats.total)
+
+    def remove(self, name: str):
+        self.stats.pop(name, None)
+        row = self.rows.pop(name, None)
+        if row is None:
+            return
+
+        # Move the last row into the freed slot to keep the matrix dense
+        last = len(self.names) - 1
+        if row != last:
+            moved = self.names[last]
+            self._matrix[row] = self._matrix[last]
+            self.names[row] = moved
+            self.rows[moved] = row
+        self.names.pop()
+        self.versions.bump_membership()
+
+        if self.ann is not None:
+            self.ann.remove(name)
+
+    def save_snapshot(self, path: str):
+        """
+        Writes every centroid row with its running sum, chunk count and update counter to path; replaced atomically
+        """
+        dim = self._matrix.shape[1]
+        totals = np.zeros((len(self.names), dim), dtype=np.float64)
+        counts = np.zeros(len(self.names), dtype=np.int64)
+        updates = np.zeros(len(self.names), dtype=np.int64)
+        for row, name in enumerate(self.names):
+            stats = self.stats.get(name)
+            if stats is not None:
+                totals[row], counts[row], updates[row] = stats.total, stats.count, stats.updates
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, names=np.asarray(self.names, dtype=str), matrix=self.matrix, totals=totals, counts=counts, updates=updates)
+        os.replace(path + ".tmp", path)
+        logger.info(f"Routing index snapshot with {len(self.names)} centroids saved to {path}")
+
+    def load_snapshot(self, path: str) -> bool:
+        """
+        Replaces the index with a save_snapshot file in one bulk copy instead of one upsert per collection.
+        Returns False, leaving the index untouched, when there is no snapshot or it cannot be read.
+        """
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as saved:
+                names = saved["names"].tolist()
+                matrix = np.array(saved["matrix"], dtype=np.float32)
+                totals, counts, updates = saved["totals"], saved["counts"], saved["updates"]
+        except Exception as e:
+            logger.warning(f"Could not read routing index snapshot {path}, the index will be loaded from Chroma. Error: {e}")
+            return False
+
+        self.clear()
+        self.names = names
+        self.rows = {name: row for row, name in enumerate(names)}
+        self._matrix = matrix
+        self.stats = {
+            name: CentroidStats(total=totals[row].copy(), count=int(counts[row]), updates=int(updates[row]))
+            for row, name in enumerate(names) if counts[row] > 0
+        }
+        self.versions.bump_membership()
+
+        if self.ann is not None:
+            # The graph saved alongside normally matches already, only fill in what it lacks
+            self.ann.retain(self.rows)
+            for row, name in enumerate(names):
+                if name not in self.ann.labels:
+                    self.ann.upsert(name, matrix[row])
+
+        self.loaded = True
+        logger.info(f"Routing index restored with {len(names)} centroids from {path}")
+        return True
+
+    def sync_ann(self):
+        # Call after a full reload so graph entries of collections that disappeared meanwhile are dropped
+        if self.ann is not None:
+            self.ann.retain(self.rows)
+
+    def save_ann(self):
+        if self.ann is not None:
+            self.ann.save()
+
+    def get(self, name: str) -> np.ndarray:
+        return self._matrix[self.rows[name]]
+
+    def top_k(self, query: np.ndarray, k: int, threshold: float = -1.0) -> List[Tuple[str, float]]:
+        """
+        Returns up to k (collection name, cosine similarity) pairs with similarity >= threshold, best first
+        """
+        return self.top_k_batch(np.asarray(query, dtype=np.float32).reshape(1, -1), k, threshold)[0]
+
+    def top_k_batch(self, queries: np.ndarray, k: int, threshold: float = -1.0) -> List[List[Tuple[str, float]]]:
+        """
+        top_k for every row of an (m, dim) query matrix with a single matrix multiply
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        if not self.names or k <= 0:
+            return [[] for _ in range(len(queries))]
+
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms > 0, norms, 1)
+
+        if self.ann is not None and len(self.names) >= self.ann_min_collections and k < len(self.names):
+            candidates = self.ann.candidates(queries, k * self.ann_oversample)
+            if candidates is not None:
+                return [self._rescore(query, names, k, threshold) for query, names in zip(queries, candidates)]
+
+        scores = queries @ self.matrix.T
+
+        if k < scores.shape[1]:
+            candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.tile(np.arange(scores.shape[1]), (len(scores), 1))
+
+        results = []
+        for row, row_candidates in enumerate(candidates):
+            row_scores = scores[row]
+            row_candidates = row_candidates[np.argsort(-row_scores[row_candidates], kind="stable")]
+            results.append([(self.names[idx], float(row_scores[idx])) for idx in row_candidates if row_scores[idx] >= threshold])
+        return results
+
+    def _rescore(self, query: np.ndarray, names: List[str], k: int, threshold: float) -> List[Tuple[str, float]]:
+        # Exact cosine of the current centroids for the ANN candidates
+        rows = np.fromiter((self.rows[name] for name in names if name in self.rows), dtype=np.intp)
+        row_scores = self._matrix[rows] @ query
+        order = np.argsort(-row_scores, kind="stable")[:k]
+        return [(self.names[rows[idx]], float(row_scores[idx])) for idx in order if row_scores[idx] >= threshold]
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+def create_ann_index() -> Optional[AnnIndex]:
+    if CENTROID_ANN == "off":
+        return None
+    if CENTROID_ANN != "hnsw":
+        raise ValueError(f"Unknown CENTROID_ANN '{CENTROID_ANN}'. Use one of: off, hnsw")
+
+    if importlib.util.find_spec("hnswlib") is None:
+        logger.error("CENTROID_ANN=hnsw needs the hnswlib package (pip install hnswlib), routing falls back to the exact scan")
+        return None
+
+    logger.info(f"Routing uses an HNSW index above {CENTROID_ANN_MIN_COLLECTIONS} collections (persisted to: {CENTROID_ANN_DIR or 'memory only'})")
+    return AnnIndex(
+        directory=CENTROID_ANN_DIR,
+        m=CENTROID_ANN_M,
+        ef_construction=CENTROID_ANN_EF_CONSTRUCTION,
+        ef_search=CENTROID_ANN_EF_SEARCH,
+        reindex_cosine=CENTROID_ANN_REINDEX_COSINE,
+    )
+
+# Shared by the upload and search paths
+centroid_index = CentroidIndex(
+    ann=create_ann_index(),
+    ann_min_collections=CENTROID_ANN_MIN_COLLECTIONS,
+    ann_oversample=CENTROID_ANN_OVERSAMPLE,
+)
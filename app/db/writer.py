@@ -0,0 +1,238 @@
+import asyncio
+from collections import deque
+from typing import Deque, Dict, List, Optional
+import numpy as np
+from chromadb.api.models.Collection import Collection
+from app.db.client import add_to_collection,chroma_client,delete_from_collection,get_or_create_collection
+from app.db.client import recompute_collection_centroid,update_collection_centroid
+from app.db.executor import chroma_call
+from app.db.index import centroid_index
+from app.logger import logger
+
+class _Op:
+    """
+    One queued change to a collection: "add", "delete", "recompute" or "drop"
+    """
+    __slots__ = ("kind", "future", "texts", "embeddings", "ids", "metadatas")
+
+    def __init__(
+        self,
+        kind: str,
+        future: asyncio.Future,
+        texts: Optional[List[str]] = None,
+        embeddings: Optional[np.ndarray] = None,
+        ids: Optional[List[str]] = None,
+        metadatas: Optional[List[dict]] = None,
+    ):
+        self.kind = kind
+        self.future = future
+        self.texts = texts
+        self.embeddings = embeddings
+        self.ids = ids
+        self.metadatas = metadatas
+
+#---------------------------------------------------------------------------------------------------------------
+
+class CollectionWriter:
+    """
+    Single writer for one collection. Changes queue up while a flush is running; the next flush merges each run
+    of consecutive queued adds into one add_to_collection call, runs deletes where they were queued, and applies
+    all of it in one centroid update, so the result is the same as applying the changes one by one.
+    Adds are upserts: a chunk id that is written again replaces the stored chunk, and its old embedding is
+    subtracted from the centroid. A drop takes the collection out of routing after the rest of its flush.
+    Callers resume once their change and the centroid update covering it are written.
+    """
+
+    def __init__(self, name: str, on_idle):
+        self.name = name
+        self._ops: Deque[_Op] = deque()
+        self._task: Optional[asyncio.Task] = None
+        self._on_idle = on_idle
+
+    @property
+    def idle(self) -> bool:
+        return self._task is None and not self._ops
+
+    def submit(self, op: _Op):
+        self._ops.append(op)
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        ops: List[_Op] = []
+        try:
+            while self._ops:
+                ops = list(self._ops)
+                self._ops.clear()
+                try:
+                    await self._flush(ops)
+                except Exception as e:
+                    logger.error(f"Flush for collection: {self.name} failed. Error: {str(e)}", exc_info=True)
+                    _fail(ops, e)
+        finally:
+            # Cancelled with work left: fail it rather than leave callers waiting
+            _fail(ops + list(self._ops), RuntimeError(f"Writer for collection {self.name} stopped"))
+            self._ops.clear()
+            self._task = None
+            self._on_idle(self)
+
+    async def _flush(self, ops: List[_Op]):
+        logger.debug(f"Flushing {len(ops)} queued changes for collection: {self.name}")
+        collection = await get_or_create_collection(self.name)
+
+        added: List[np.ndarray] = []
+        removed: List[np.ndarray] = []
+        recompute = False
+        drop = False
+        results: Dict[int, Optional[BaseException]] = {}
+
+        adds: List[_Op] = []
+        for op in ops:
+            if op.kind == "add":
+                adds.append(op)
+                continue
+
+            if op.kind == "delete":
+                # A delete can target chunks the adds queued before it write, so those go first
+                if adds:
+                    await self._write_adds(collection, adds, results, added, removed)
+                    adds = []
+                try:
+                    removed.append(await delete_from_collection(op.ids, collection))
+                    results[id(op)] = None
+                except Exception as e:
+                    logger.error(f"An error occurred while deleting documents from collection: {self.name}. Error: {e}", exc_info=True)
+                    results[id(op)] = e
+            elif op.kind == "recompute":
+                recompute = True
+                results[id(op)] = None
+            elif op.kind == "drop":
+                drop = True
+                results[id(op)] = None
+        if adds:
+            await self._write_adds(collection, adds, results, added, removed)
+
+        # A recompute reads every chunk back from Chroma, which already covers this flush's adds and deletes
+        if recompute:
+            await recompute_collection_centroid(collection=collection)
+        elif added or removed:
+            await update_collection_centroid(
+                collection=collection,
+                added=np.concatenate(added) if added else None,
+                removed=np.concatenate(removed) if removed else None
+            )
+        if drop:
+            centroid_index.remove(self.name)
+
+        for op in ops:
+            error = results[id(op)]
+            if op.future.done():
+                continue
+            if error is None:
+                op.future.set_result(None)
+            else:
+                op.future.set_exception(error)
+
+    async def _write_adds(
+        self,
+        collection: Collection,
+        adds: List[_Op],
+        results: Dict[int, Optional[BaseException]],
+        added: List[np.ndarray],
+        removed: List[np.ndarray],
+    ):
+        written, replaced = await add_to_collection(
+            text=[text for op in adds for text in op.texts],
+            embedding=np.concatenate([op.embeddings for op in adds]),
+            ids=[chunk_id for op in adds for chunk_id in op.ids],
+            metadatas=[metadata for op in adds for metadata in op.metadatas],
+            collection=collection
+        )
+        # Slices are written in order, so every add that ends within written landed completely
+        offset = 0
+        for op in adds:
+            end = offset + len(op.texts)
+            if end <= written:
+                results[id(op)] = None
+                added.append(op.embeddings)
+            else:
+                results[id(op)] = RuntimeError(f"Failed to add chunks to collection {self.name}")
+                if offset < written:
+                    added.append(op.embeddings[:written - offset])
+            offset = end
+        if len(replaced):
+            removed.append(replaced)
+
+def _fail(ops: List[_Op], error: BaseException):
+    for op in ops:
+        if not op.future.done():
+            op.future.set_exception(error)
+
+#---------------------------------------------------------------------------------------------------------------
+
+class CollectionWriters:
+    """
+    Registry of the per-collection writers. All collection writes and centroid updates go through here, so the
+    centroid index is only ever changed by one flush per collection and routing reads it without locks.
+    Idle writers are dropped, so the registry only holds collections with queued changes.
+    """
+
+    def __init__(self):
+        self._writers: Dict[str, CollectionWriter] = {}
+        # Closed collection -> the collection its later writes go to instead
+        self._redirects: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._writers)
+
+    def _submit(self, collection_name: str, op: _Op) -> asyncio.Future:
+        while collection_name in self._redirects:
+            collection_name = self._redirects[collection_name]
+        writer = self._writers.get(collection_name)
+        if writer is None:
+            writer = self._writers[collection_name] = CollectionWriter(collection_name, on_idle=self._release)
+        writer.submit(op)
+        return op.future
+
+    def _release(self, writer: CollectionWriter):
+        if self._writers.get(writer.name) is writer and writer.idle:
+            del self._writers[writer.name]
+
+    async def close(self, collection_name: str, redirect: str):
+        """
+        Sends every later write for the collection to redirect, and takes the collection out of routing on its own
+        writer once the writes already queued for it are flushed. No flush can put it back into routing after
+        that, and nothing recreates the collection once it is deleted.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._submit(collection_name, _Op("drop", future))
+        self._redirects[collection_name] = redirect
+        await future
+
+    def reopen(self, collection_name: str):
+        self._redirects.pop(collection_name, None)
+
+    async def add(self, collection_name: str, texts: List[str], embeddings: np.ndarray, ids: List[str], metadatas: List[dict]):
+        """
+        Adds chunks to the collection, merged with every other add queued for it meanwhile.
+        Raises if the chunks could not be written.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._submit(collection_name, _Op("add", future, texts=texts, embeddings=embeddings, ids=ids, metadatas=metadatas))
+
+    async def delete(self, collection_name: str, ids: List[str]):
+        # Deletes chunks by id; the embeddings subtracted from the centroid are read at delete time
+        future = asyncio.get_running_loop().create_future()
+        await self._submit(collection_name, _Op("delete", future, ids=ids))
+
+    async def recompute(self, collection_name: str):
+        # Rebuilds the centroid from every chunk, after whatever is queued for the collection
+        future = asyncio.get_running_loop().create_future()
+        await self._submit(collection_name, _Op("recompute", future))
+
+collection_writers = CollectionWriters()
+
+async def recompute_all_centroids():
+    # Full drift correction for every collection
+    collections = await chroma_call(chroma_client.list_collections)
+    await asyncio.gather(*[collection_writers.recompute(collection.name) for collection in collections])
@@ -0,0 +1,205 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Type
+from sentence_transformers import SentenceTransformer
+from app.logger import logger
+import torch
+
+class EmbeddingBackend(ABC):
+    """
+    One way of running the sentence transformer. encode returns a (len(texts), dim) tensor in input order.
+    """
+    name = ""
+
+    def __init__(self, model_name: str, device: str, num_threads: int = 0):
+        self.model_name = model_name
+        self.device = device
+        self.num_threads = num_threads
+        self.model = self.load()
+
+    @abstractmethod
+    def load(self) -> SentenceTransformer:
+        ...
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: List[str], batch_size: int) -> torch.Tensor:
+        return self.model.encode(texts, batch_size=batch_size, convert_to_tensor=True)
+
+    def encode_by_length(self, texts: List[str], batch_size: int) -> torch.Tensor:
+        """
+        encode with the chunks sorted by length, so every batch pads to similar sequence lengths; rows in input order
+        """
+        if not texts:
+            return torch.empty((0, self.dimension), device=self.device)
+
+        order = sorted(range(len(texts)), key=lambda idx: len(texts[idx]))
+        sorted_embeddings = self.encode([texts[idx] for idx in order], batch_size=batch_size)
+
+        # Scatter the rows back to the original chunk order
+        embeddings = torch.empty_like(sorted_embeddings)
+        embeddings[torch.tensor(order, device=sorted_embeddings.device)] = sorted_embeddings
+        return embeddings
+
+class TorchBackend(EmbeddingBackend):
+    # Full-precision PyTorch, the original path
+    name = "torch"
+
+    def load(self) -> SentenceTransformer:
+        if self.num_threads > 0:
+            torch.set_num_threads(self.num_threads)
+        return SentenceTransformer(self.model_name, device=self.device)
+
+class QuantizedTorchBackend(TorchBackend):
+    # Dynamic int8 quantization of every Linear layer; CPU only
+    name = "torch-int8"
+
+    def load(self) -> SentenceTransformer:
+        self.device = "cpu"
+        model = super().load()
+        torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        return model
+
+class OnnxBackend(EmbeddingBackend):
+    # ONNX Runtime on CPU; sentence-transformers exports the model to ONNX on first load
+    name = "onnx"
+
+    def load(self) -> SentenceTransformer:
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError("EMBEDDING_BACKEND=onnx needs the onnxruntime package (pip install onnxruntime)") from e
+
+        self.device = "cpu"
+        session_options = onnxruntime.SessionOptions()
+        if self.num_threads > 0:
+            session_options.intra_op_num_threads = self.num_threads
+
+        return SentenceTransformer(
+            self.model_name,
+            device=self.device,
+            backend="onnx",
+            model_kwargs={"provider": "CPUExecutionProvider", "session_options": session_options},
+        )
+
+BACKENDS: Dict[str, Type[EmbeddingBackend]] = {
+    backend.name: backend for backend in (TorchBackend, QuantizedTorchBackend, OnnxBackend)
+}
+
+def create_backend(name: str, model_name: str, device: str, num_threads: int = 0) -> EmbeddingBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{name}'. Use one of: {', '.join(BACKENDS)}")
+
+    logger.info(f"Loading embedding backend '{name}' for model {model_name} on {device} (threads: {num_threads or 'default'})")
+    return BACKENDS[name](model_name=model_name, device=device, num_threads=num_threads)
+
+class LazyBackend:
+    """
+    Stands in for an EmbeddingBackend that is loaded on demand, so importing the app does not load the model.
+    load() builds it and runs one warm-up forward pass; the app calls it in a thread at startup, anything that
+    needs the model earlier loads it on the calling thread. name and dimension are known without loading.
+    """
+
+    def __init__(self, name: str, model_name: str, device: str, num_threads: int, dimension: int):
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown embedding backend '{name}'. Use one of: {', '.join(BACKENDS)}")
+        self.name = name
+        self.model_name = model_name
+        self.dimension = dimension
+        self._device = device
+        self._num_threads = num_threads
+        self._backend: Optional[EmbeddingBackend] = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._backend is not None
+
+    def load(self) -> EmbeddingBackend:
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    start = time.perf_counter()
+                    backend = create_backend(self.name, self.model_name, self._device, self._num_threads)
+                    if backend.dimension != self.dimension:
+                        raise ValueError(f"Model {self.model_name} has dimension {backend.dimension}, configured {self.dimension}")
+                    backend.encode_by_length(["warm up"], batch_size=1)
+                    self._backend = backend
+                    logger.info(f"Embedding backend '{self.name}' ready in {time.perf_counter() - start:.1f}s")
+        return self._backend
+
+    @property
+    def device(self) -> str:
+        return self.load().device
+
+    @property
+    def model(self) -> SentenceTransformer:
+        return self.load().model
+
+    def encode(self, texts: List[str], batch_size: int) -> torch.Tensor:
+        return self.load().encode(texts, batch_size=batch_size)
+
+    def encode_by_length(self, texts: List[str], batch_size: int) -> torch.Tensor:
+        return self.load().encode_by_length(texts, batch_size=batch_size)
+
+#---------------------------------------------------------------------------------------------------------------
+
+def compare_backends(
+    texts: List[str],
+    model_name: str,
+    engines: Optional[List[str]] = None,
+    num_threads: int = 0,
+    batch_size: int = 32,
+    tolerance: float = 0.01,
+    reference: Optional[EmbeddingBackend] = None,
+) -> Dict:
+    """
+    Encodes texts with every engine and reports chunks/sec plus cosine agreement with the fp32 torch engine.
+    An engine is acceptable when its worst-case cosine agreement is at least 1 - tolerance;
+    "recommended" is the fastest acceptable engine.
+    """
+    def timed_encode(backend: EmbeddingBackend):
+        backend.encode(texts[:batch_size], batch_size=batch_size)  # warm up
+        start = time.perf_counter()
+        embeddings = backend.encode(texts, batch_size=batch_size).float().cpu()
+        return embeddings, len(texts) / (time.perf_counter() - start)
+
+    reference = reference or create_backend(TorchBackend.name, model_name, "cpu", num_threads)
+    reference_embeddings, reference_speed = timed_encode(reference)
+
+    report = [{
+        "engine": reference.name,
+        "chunks_per_sec": reference_speed,
+        "cosine_mean": 1.0,
+        "cosine_min": 1.0,
+        "within_tolerance": True,
+    }]
+
+    for engine in engines or [name for name in BACKENDS if name != TorchBackend.name]:
+        try:
+            backend = create_backend(engine, model_name, "cpu", num_threads)
+        except Exception as e:
+            logger.warning(f"Skipping embedding backend '{engine}': {e}")
+            report.append({"engine": engine, "error": str(e)})
+            continue
+
+        embeddings, speed = timed_encode(backend)
+        agreement = torch.nn.functional.cosine_similarity(reference_embeddings, embeddings, dim=1)
+        report.append({
+            "engine": engine,
+            "chunks_per_sec": speed,
+            "cosine_mean": agreement.mean().item(),
+            "cosine_min": agreement.min().item(),
+            "within_tolerance": agreement.min().item() >= 1 - tolerance,
+        })
+
+    acceptable = [entry for entry in report if entry.get("within_tolerance")]
+    return {
+        "chunks": len(texts),
+        "tolerance": tolerance,
+        "engines": report,
+        "recommended": max(acceptable, key=lambda entry: entry["chunks_per_sec"])["engine"],
+    }
@@ -1,13 +1,18 @@
 
+import asyncio
+import os
+from typing import Dict, List, Optional, Set
+import numpy as np
 from fastapi import UploadFile
-from app.document.extract import extract_text,generate_embeddings
-from app.db.client import add_to_collection,top_1_collection,get_or_create_collection
+from app.document.extract import extract_text,generate_embeddings,stream_chunks
+from app.document.scheduler import Priority
+from app.db.client import route_to_collections,generate_doc_ids,generate_metadatas
+from app.db.writer import collection_writers
 from app.api.request import Status,StatusEnum
 from app.logger import logger
-import torch
-from app.document.extract import device
-from app.api.request import BaseDocument,UploadDocument
+from app.api.request import BaseDocument,UploadDocument,create_upload_document
 from app.document.extract import text_splitter
+from app.metrics import CHUNKS_TOTAL, FILES_TOTAL, STAGE_SECONDS
 
 #---------------------------------------------------------------------------------------------------------------
 
@@ -15,7 +20,9 @@ async def process_file(file: UploadFile, upload_document: BaseDocument):
     try:
         logger.info(f"Started processing file: {file.filename}")
         text = await extract_text(file.file, file.filename)
-        chunks = text_splitter.split_text(text)
+        with STAGE_SECONDS.labels("split_text").time():
+            chunks = text_splitter.split_text(text)
+        CHUNKS_TOTAL.labels("split").inc(len(chunks))
         upload_document.text.content = chunks
         upload_document.text.error = None 
         upload_document.text.shape = [len(chunks)]
@@ -34,7 +41,7 @@ async def process_file(file: UploadFile, upload_document: BaseDocument):
 
 #---------------------------------------------------------------------------------------------------------------
 
-async def process_text(filename:str, upload_document: BaseDocument):
+async def process_text(filename:str, upload_document: BaseDocument, priority: Priority = Priority.INGEST):
     try:
         logger.info(f"Started processing text for file: {filename}")
 
@@ -42,11 +49,10 @@ async def process_text(filename:str, upload_document: BaseDocument):
             text = upload_document.text.content
             logger.info(f"Generating embeddings for file: {filename}")
 
-            embeddings = await generate_embeddings(text)
+            embeddings = await generate_embeddings(text, priority=priority)
             upload_document.embedding.content = embeddings
             upload_document.embedding.shape = len(embeddings)
             upload_document.embedding.error = None
-            upload_document.embedding.convert_to_list_floats()
 
             logger.info(f"Successfully generated embeddings for file: {filename} with {len(embeddings)} embeddings.")
         else:
@@ -62,55 +68,161 @@ async def process_text(filename:str, upload_document: BaseDocument):
         logger.error(f"Error occurred while generating embeddings for file {filename}: {str(e)}", exc_info=True)
 
 #---------------------------------------------------------------------------------------------------------------
-BATCH_SIZE = 5
+# Routing granularity: every run of this many consecutive chunks of a file is routed by its mean embedding
+ROUTING_GROUP_SIZE = int(os.getenv("ROUTING_GROUP_SIZE", "5"))
+
+class _Write:
+    """
+    Everything one flush adds to one collection, across all files of the request
+    """
+    __slots__ = ("texts", "embeddings", "ids", "metadatas", "filenames")
+
+    def __init__(self):
+        self.texts: List[str] = []
+        self.embeddings: List[np.ndarray] = []
+        self.ids: List[str] = []
+        self.metadatas: List[dict] = []
+        self.filenames: Set[str] = set()
+
+    def extend(self, filename: str, texts: List[str], embeddings: np.ndarray, start_idx: int):
+        self.texts.extend(texts)
+        self.embeddings.append(embeddings)
+        self.ids.extend(generate_doc_ids(filename=filename, num_chunks=len(texts), start_idx=start_idx))
+        self.metadatas.extend(generate_metadatas(filename=filename, num_chunks=len(texts), start_idx=start_idx))
+        self.filenames.add(filename)
+
+async def _route_and_write(documents: Dict[str, UploadDocument], offsets: Optional[Dict[str, int]] = None) -> Dict[str, str]:
+    """
+    Routes every chunk group of every document first, then issues one add per destination collection.
+    offsets shifts a file's chunk indices, for a document holding one window of a larger file.
+    Returns the error for every file whose chunks were not all written.
+    """
+    offsets = offsets or {}
+    groups = [
+        (filename, start)
+        for filename, upload_document in documents.items()
+        for start in range(0, len(upload_document.text.content), ROUTING_GROUP_SIZE)
+    ]
+    logger.info(f"Routing {len(groups)} chunk groups from {len(documents)} files.")
+
+    destinations = []
+    if groups:
+        means = np.stack([
+            documents[filename].embedding.content[start:start + ROUTING_GROUP_SIZE].mean(axis=0)
+            for filename, start in groups
+        ])
+        destinations = await route_to_collections(means)
+
+    writes: Dict[str, _Write] = {}
+    for (filename, start), collection_name in zip(groups, destinations):
+        upload_document = documents[filename]
+        end = start + ROUTING_GROUP_SIZE
+        writes.setdefault(collection_name, _Write()).extend(
+            filename, upload_document.text.content[start:end], upload_document.embedding.content[start:end], offsets.get(filename, 0) + start
+        )
+        if collection_name not in upload_document.collection:
+            upload_document.collection.append(collection_name)
+
+    failed: Dict[str, str] = {}
+
+    async def write(collection_name: str, pending: _Write):
+        try:
+            # Merged by the collection's writer with concurrent requests' adds to the same collection
+            await collection_writers.add(
+                collection_name,
+                texts=pending.texts,
+                embeddings=np.concatenate(pending.embeddings),
+                ids=pending.ids,
+                metadatas=pending.metadatas
+            )
+        except Exception as e:
+            for filename in pending.filenames:
+                failed[filename] = f"Failed to add embeddings to collection {collection_name}: {str(e)}"
+
+    logger.info(f"Writing {sum(len(pending.texts) for pending in writes.values())} chunks to {len(writes)} collections.")
+    await asyncio.gather(*[write(collection_name, pending) for collection_name, pending in writes.items()])
+    return failed
+
+async def process_embeddings_batch(file_map: Dict[str, UploadDocument]):
+    """
+    Routes every chunk group of every file first, then issues one add and one centroid update per destination
+    collection instead of one routing scan and one write per group
+    """
+    documents = {}
+    for filename, upload_document in file_map.items():
+        if upload_document.embedding.error is not None:
+            upload_document.status = Status(code=StatusEnum.FAILED,error="Embedding extraction failed")
+            logger.warning(f"Embedding extraction failed for file: {filename}. Skipping collection addition.")
+        elif len(upload_document.embedding.content) != len(upload_document.text.content):
+            upload_document.status = Status(code=StatusEnum.FAILED,error="Mismatch between number of embeddings and text chunks")
+            logger.warning(f"Embedding / chunk count mismatch for file: {filename}. Skipping collection addition.")
+        else:
+            documents[filename] = upload_document
 
-async def process_embeddings(filename:str, upload_document: UploadDocument):
     try:
-        logger.info(f"Started processing embeddings for file: {filename}")
-        
-        if upload_document.embedding.error is None:
-            embedding = upload_document.embedding.content
-            text = upload_document.text.content
-            uuid = upload_document.uuid
-            vectordb_embedding = upload_document.embedding.vectordb_embeddings
-
-            assert len(embedding) == len(text), "Mismatch between number of embeddings and text chunks"
-
-            total_chunks = len(embedding)
+        failed = await _route_and_write(documents)
 
-            logger.info(f"Embeddings are available for file: {filename}. Identifying closest collection.")
-            collection_set = set()
+        for filename, upload_document in documents.items():
+            if filename in failed:
+                upload_document.status = Status(code=StatusEnum.FAILED,error=failed[filename])
+            else:
+                upload_document.status = Status(code=StatusEnum.SUCCESS,error=None)
+                logger.info(f"Successfully added embeddings to collections {upload_document.collection} for file: {filename}")
 
-            for batch_start in range(0, total_chunks, BATCH_SIZE):
-                batch_end = min(batch_start + BATCH_SIZE, total_chunks)
-
-                batch_embeddings = embedding[batch_start:batch_end]
-                vectodb_batch_embeddings = vectordb_embedding[batch_start:batch_end]
-                batch_texts = text[batch_start:batch_end]
+    except Exception as e:
+        logger.error(f"Error occurred while processing embeddings for files {list(documents)}: {str(e)}", exc_info=True)
+        for upload_document in documents.values():
+            upload_document.status = Status(code=StatusEnum.FAILED,error= f"Failed to process embeddings for file: {str(e)}")
 
-                collection_name = await top_1_collection(batch_embeddings)
-                collection = get_or_create_collection(collection_name=collection_name)
-            
-                logger.info(f"Collection identified: {collection.name}. Adding embeddings to the collection.")
-            
-                await add_to_collection(text=batch_texts, embedding=vectodb_batch_embeddings, start_idx=batch_start, filename=filename, collection=collection)
-                collection_set.add(collection_name)
+    for upload_document in file_map.values():
+        FILES_TOTAL.labels(upload_document.status.code.value).inc()
 
-            upload_document.status = Status(code=StatusEnum.SUCCESS,error=None)
-            upload_document.collection = list(collection_set)
+async def process_embeddings(filename:str, upload_document: UploadDocument):
+    # Single file flush, used by the streaming pipeline
+    await process_embeddings_batch({filename: upload_document})
 
-            logger.info(f"Successfully added embeddings to collection {collection.name} for file: {filename}")
+#---------------------------------------------------------------------------------------------------------------
 
-        else:
-            upload_document.status = Status(code=StatusEnum.FAILED,error="Embedding extraction failed")
-            logger.warning(f"Embedding extraction failed for file: {filename}. Skipping collection addition.")
+async def process_large_file(file: UploadFile, upload_document: UploadDocument):
+    """
+    Bounded-memory extract -> embed -> write for one large file: every window of chunks from stream_chunks is
+    embedded and written before the next one is read, so memory does not grow with the file.
+    Replaces process_file, process_text and process_embeddings for the file. Text and embedding content stay
+    empty, the document only records the chunk count and collections; chunks of windows written before a
+    failure stay in their collections.
+    """
+    written = 0
+    try:
+        logger.info(f"Started streaming file: {file.filename}")
+        async for chunks in stream_chunks(file.file, file.filename):
+            CHUNKS_TOTAL.labels("split").inc(len(chunks))
+            window = create_upload_document()
+            window.text.content = chunks
+            window.embedding.content = await generate_embeddings(chunks)
+
+            failed = await _route_and_write({file.filename: window}, offsets={file.filename: written})
+            for collection_name in window.collection:
+                if collection_name not in upload_document.collection:
+                    upload_document.collection.append(collection_name)
+            if failed:
+                raise RuntimeError(failed[file.filename])
+            written += len(chunks)
+
+        upload_document.text.content = []
+        upload_document.text.shape = [written]
+        upload_document.embedding.shape = written
+        upload_document.status = Status(code=StatusEnum.SUCCESS,error=None)
+        logger.info(f"Successfully streamed {written} chunks to collections {upload_document.collection} for file: {file.filename}")
 
     except ValueError as ve:
-        upload_document.status = Status(code=StatusEnum.FAILED,error= str(ve))
-        logger.warning(f"ValueError while processing file {filename}: {str(ve)}")
+        logger.warning(f"ValueError while streaming file {file.filename}: {str(ve)}")
+        upload_document.text.error = str(ve)
+        upload_document.status = Status(code=StatusEnum.FAILED,error=str(ve))
 
     except Exception as e:
-        upload_document.status = Status(code=StatusEnum.FAILED,error= f"Failed to process embeddings for file: {str(e)}")
-        logger.error(f"Error occurred while processing embeddings for file {filename}: {str(e)}", exc_info=True)
+        logger.error(f"Error while streaming file {file.filename} after {written} chunks: {str(e)}", exc_info=True)
+        upload_document.status = Status(code=StatusEnum.FAILED,error=f"Failed to process file after {written} chunks: {str(e)}")
 
-#---------------------------------------------------------------------------------------------------------------
\ No newline at end of file
+    FILES_TOTAL.labels(upload_document.status.code.value).inc()
+
+#---------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,211 @@
+import asyncio
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+from app.logger import logger
+
+# Rough per-entry bookkeeping cost (OrderedDict node, key bytes, ndarray header) counted against the byte budget
+_ENTRY_OVERHEAD_BYTES = 200
+
+_KEY_BYTES = 16
+_NO_KEY = bytes(_KEY_BYTES)
+
+class _DiskTier:
+    """
+    Ring buffer of embeddings in a memory-mapped float32 file plus an append-only "key row" index log.
+    Every row also stores its key in a second memory-mapped file; a row is only served when that matches, so a
+    crash between overwriting a row and logging its new key cannot map the evicted key to the wrong vector.
+    Survives restarts; when full the oldest rows are overwritten. Blocking; callers run it off the event loop.
+    """
+
+    def __init__(self, directory: str, dim: int, rows: int):
+        os.makedirs(directory, exist_ok=True)
+        self.rows = rows
+        self.keys: Dict[bytes, int] = {}
+        self.row_keys: List[Optional[bytes]] = [None] * rows
+        self.next_row = 0
+        self._lock = threading.Lock()
+
+        data_path = os.path.join(directory, f"embeddings-{dim}x{rows}.f32")
+        mode = "r+" if os.path.exists(data_path) else "w+"
+        self.vectors = np.memmap(data_path, dtype=np.float32, mode=mode, shape=(rows, dim))
+        key_path = os.path.join(directory, f"keys-{dim}x{rows}.bin")
+        mode = "r+" if os.path.exists(key_path) else "w+"
+        self.stored_keys = np.memmap(key_path, dtype=np.uint8, mode=mode, shape=(rows, _KEY_BYTES))
+
+        self.index_path = os.path.join(directory, f"index-{dim}x{rows}.log")
+        self.log_lines = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) != 2:
+                        continue  # torn write at the end of the log
+                    self._assign(bytes.fromhex(parts[0]), int(parts[1]))
+                    self.next_row = (int(parts[1]) + 1) % rows
+                    self.log_lines += 1
+        self.index_file = open(self.index_path, "a")
+
+        # Log lines whose row has since been overwritten by a write the log never recorded
+        stale = [key for key, row in self.keys.items() if self.stored_keys[row].tobytes() != key]
+        for key in stale:
+            self.row_keys[self.keys.pop(key)] = None
+        if stale:
+            logger.warning(f"Embedding disk cache dropped {len(stale)} entries whose rows were overwritten before a crash")
+
+        logger.info(f"Embedding disk cache opened at {directory} with {len(self.keys)} entries")
+
+    def _assign(self, key: bytes, row: int):
+        previous = self.row_keys[row]
+        if previous is not None and self.keys.get(previous) == row:
+            del self.keys[previous]
+        self.row_keys[row] = key
+        self.keys[key] = row
+
+    def get_many(self, keys: List[bytes]) -> List[Optional[np.ndarray]]:
+        with self._lock:
+            results: List[Optional[np.ndarray]] = []
+            for key in keys:
+                row = self.keys.get(key)
+                if row is None or self.stored_keys[row].tobytes() != key:
+                    results.append(None)
+                else:
+                    results.append(np.array(self.vectors[row]))
+            return results
+
+    def put_many(self, keys: List[bytes], vectors: np.ndarray):
+        with self._lock:
+            self._put_many(keys, vectors)
+
+    def _put_many(self, keys: List[bytes], vectors: np.ndarray):
+        writes = []
+        batch_keys = set()
+        for key, vector in zip(keys, vectors):
+            if key in self.keys or key in batch_keys:
+                continue
+            batch_keys.add(key)
+            row = self.next_row
+            self.next_row = (row + 1) % self.rows
+            writes.append((key, row, vector))
+        if not writes:
+            return
+
+        # Rows lose their old key before their vector changes and get the new one after it, each step flushed,
+        # so a crash at any point leaves every row either unkeyed or keyed to the vector it holds
+        for _, row, _ in writes:
+            self.stored_keys[row] = np.frombuffer(_NO_KEY, dtype=np.uint8)
+        self.stored_keys.flush()
+        for _, row, vector in writes:
+            self.vectors[row] = vector
+        self.vectors.flush()
+        for key, row, _ in writes:
+            self.stored_keys[row] = np.frombuffer(key, dtype=np.uint8)
+            self._assign(key, row)
+        self.stored_keys.flush()
+
+        self.index_file.write("".join(f"{key.hex()} {row}\n" for key, row, _ in writes))
+        self.index_file.flush()
+        self.log_lines += len(writes)
+
+        # Overwritten rows leave stale lines behind, rewrite the log once it is twice the live size
+        if self.log_lines > 2 * self.rows:
+            self._compact_log()
+
+    def _compact_log(self):
+        # Oldest row first so replaying the log restores next_row
+        oldest_first = sorted(range(self.rows), key=lambda row: (row - self.next_row) % self.rows)
+        live = [row for row in oldest_first if self.row_keys[row] is not None]
+
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write("".join(f"{self.row_keys[row].hex()} {row}\n" for row in live))
+        self.index_file.close()
+        os.replace(tmp_path, self.index_path)
+        self.index_file = open(self.index_path, "a")
+        self.log_lines = len(live)
+
+#---------------------------------------------------------------------------------------------------------------
+
+class EmbeddingCache:
+    """
+    Content-addressed chunk embedding cache keyed by hash(model name + chunk text).
+    An in-memory LRU tier bounded by max_bytes sits in front of an optional on-disk tier, which is read and
+    written in a worker thread so memmap page faults and flushes never block the event loop.
+    """
+
+    def __init__(self, model_name: str, dim: int, max_bytes: int, disk_dir: Optional[str] = None, disk_rows: int = 0):
+        self.model_name = model_name
+        self.dim = dim
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = _DiskTier(disk_dir, dim, disk_rows) if disk_dir and disk_rows > 0 else None
+
+    def key(self, text: str) -> bytes:
+        return hashlib.blake2b(f"{self.model_name}\0{text}".encode("utf-8"), digest_size=16).digest()
+
+    async def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        keys = [self.key(text) for text in texts]
+        results: List[Optional[np.ndarray]] = []
+        for key in keys:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+            results.append(vector)
+
+        absent = [idx for idx, vector in enumerate(results) if vector is None]
+        if absent and self._disk is not None:
+            found = await asyncio.to_thread(self._disk.get_many, [keys[idx] for idx in absent])
+            for idx, vector in zip(absent, found):
+                if vector is not None:
+                    self._remember(keys[idx], vector)
+                    results[idx] = vector
+                    self.disk_hits += 1
+
+        misses = sum(vector is None for vector in results)
+        self.misses += misses
+        self.hits += len(results) - misses
+        return results
+
+    async def put_many(self, texts: List[str], vectors: np.ndarray):
+        keys = [self.key(text) for text in texts]
+        vectors = np.asarray(vectors, dtype=np.float32)
+
+        for key, vector in zip(keys, vectors):
+            self._remember(key, vector.copy())
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk.put_many, keys, vectors)
+
+    def _remember(self, key: bytes, vector: np.ndarray):
+        if self.max_bytes <= 0:
+            return
+
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+
+        self._memory[key] = vector
+        self._memory_bytes += vector.nbytes + _ENTRY_OVERHEAD_BYTES
+        while self._memory_bytes > self.max_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes + _ENTRY_OVERHEAD_BYTES
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "model": self.model_name,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "memory_max_bytes": self.max_bytes,
+            "disk_entries": len(self._disk.keys) if self._disk is not None else 0,
+        }
@@ -0,0 +1,106 @@
+# chunker.py
+#
+# Dependency-free text splitter, importable by extraction worker processes like parsers.py
+
+from typing import List, Optional, Sequence
+
+#---------------------------------------------------------------------------------------------------------------
+
+class RecursiveChunker:
+    """
+    Drop-in for langchain's RecursiveCharacterTextSplitter(keep_separator=True, strip_whitespace=True, len as length
+    function) that produces exactly the same chunks. Splits with str.split instead of a capturing re.split, finds
+    the separator with `in`, and merges with a moving start index instead of re-slicing the pending list.
+    """
+
+    def __init__(self, chunk_size: int, chunk_overlap: int, separators: Sequence[str]):
+        if chunk_overlap > chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) is larger than chunk_size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = list(separators)
+
+    def split_text(self, text: str) -> List[str]:
+        return self._split(text, self.separators)
+
+    def _split(self, text: str, separators: List[str]) -> List[str]:
+        # First separator present in the text; "" (single characters) ends the search without finer levels
+        separator = separators[-1]
+        finer: List[str] = []
+        for idx, candidate in enumerate(separators):
+            if candidate == "":
+                separator = candidate
+                break
+            if candidate in text:
+                separator = candidate
+                finer = separators[idx + 1:]
+                break
+
+        if separator:
+            # The separator is kept at the start of every piece but the first
+            pieces = text.split(separator)
+            splits = [pieces[0]] if pieces[0] else []
+            splits.extend(separator + piece for piece in pieces[1:])
+        elif self.chunk_size > 1:
+            return self._split_characters(text)
+        else:
+            splits = list(text)
+
+        chunks: List[str] = []
+        good: List[str] = []
+        for split in splits:
+            if len(split) < self.chunk_size:
+                good.append(split)
+                continue
+            if good:
+                chunks.extend(self._merge(good))
+                good = []
+            if finer:
+                chunks.extend(self._split(split, finer))
+            else:
+                chunks.append(split)
+        if good:
+            chunks.extend(self._merge(good))
+        return chunks
+
+    def _split_characters(self, text: str) -> List[str]:
+        """
+        _merge over single characters without building them: every chunk is chunk_size characters, the next one
+        starts chunk_size - min(chunk_overlap, chunk_size - 1) further, and the last one runs to the end of the text
+        """
+        step = self.chunk_size - min(self.chunk_overlap, self.chunk_size - 1)
+        chunks: List[str] = []
+        start = 0
+        while start + self.chunk_size < len(text):
+            chunks.append(text[start:start + self.chunk_size].strip())
+            start += step
+        chunks.append(text[start:].strip())
+        return [chunk for chunk in chunks if chunk]
+
+    def _merge(self, splits: List[str]) -> List[str]:
+        # Greedy merge up to chunk_size; a new chunk starts with the tail of the previous one, at most chunk_overlap long
+        chunk_size, chunk_overlap = self.chunk_size, self.chunk_overlap
+        docs: List[str] = []
+        current: List[str] = []
+        start = 0
+        total = 0
+        for split in splits:
+            length = len(split)
+            if total + length > chunk_size and start < len(current):
+                doc = _join(current[start:])
+                if doc is not None:
+                    docs.append(doc)
+                while total > chunk_overlap or (total + length > chunk_size and total > 0):
+                    total -= len(current[start])
+                    start += 1
+            current.append(split)
+            total += length
+
+        doc = _join(current[start:])
+        if doc is not None:
+            docs.append(doc)
+        return docs
+
+def _join(splits: List[str]) -> Optional[str]:
+    text = "".join(splits).strip()
+    return text or None
@@ -1,16 +1,18 @@
 import asyncio
-import re
 import os
 from io import BytesIO
-import pdfplumber
-import docx
-from sentence_transformers import SentenceTransformer
 from app.logger import logger
+from app.document.scheduler import EmbeddingScheduler, Priority
+from app.document.chunker import RecursiveChunker
+from app.document.parsers import clean_text, iter_chunks, iter_segments, iter_windows, process_docx, process_pdf
+from app.document.extraction_pool import ExtractionPool
+from app.document.cache import EmbeddingCache
+from app.document.backends import LazyBackend
+from app.document.replicas import ReplicaPool
+from app.metrics import CHUNKS_TOTAL, QUEUE_DEPTH, STAGE_SECONDS, observe_stage
+import numpy as np
 import torch
-from typing import List
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader
-import tempfile
+from typing import AsyncIterator, List
 
 # Determine device based on platform capabilities
 if torch.cuda.is_available():
@@ -21,11 +23,38 @@ else:
     device = 'cpu'
 
 # Load model with correct device
-# model = SentenceTransformer('all-MiniLM-L6-v2', device=device)
-model = SentenceTransformer('all-mpnet-base-v2', device=device)
-
-#text_splitter to chunk input document
-text_splitter = RecursiveCharacterTextSplitter(
+# MODEL_NAME = 'all-MiniLM-L6-v2'
+MODEL_NAME = 'all-mpnet-base-v2'
+# Output dimension of MODEL_NAME, known up front so nothing has to load the model at import
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "768"))
+
+# Embedding engine: "torch" (fp32), "torch-int8" (dynamic int8 quantization) or "onnx" (ONNX Runtime)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+# Intra-op threads for the engine, 0 keeps the library default
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+
+# Loaded by warm_up_embeddings() in the background at startup, or by the first request that needs it
+embedding_backend = LazyBackend(EMBEDDING_BACKEND, model_name=MODEL_NAME, device=device, num_threads=EMBEDDING_THREADS, dimension=EMBEDDING_DIM)
+
+# Number of chunks per forward pass in the embedding stage
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+
+# Cross-request micro-batching: flush at this many chunks or after this many milliseconds
+EMBEDDING_SCHEDULER_MAX_BATCH = int(os.getenv("EMBEDDING_SCHEDULER_MAX_BATCH", "128"))
+EMBEDDING_SCHEDULER_MAX_WAIT_MS = float(os.getenv("EMBEDDING_SCHEDULER_MAX_WAIT_MS", "5"))
+
+# CPU model replicas in worker processes, each pinned to an equal share of the cores; 0 encodes in this process
+EMBEDDING_REPLICAS = int(os.getenv("EMBEDDING_REPLICAS", "0"))
+# Smallest slice of a batch handed to one replica, so small batches do not fan out over every replica
+EMBEDDING_REPLICA_MIN_SHARD = int(os.getenv("EMBEDDING_REPLICA_MIN_SHARD", "16"))
+
+# Chunk embedding cache: in-memory LRU budget, plus an on-disk tier when EMBEDDING_CACHE_DIR is set
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR")
+EMBEDDING_CACHE_DISK_ROWS = int(os.getenv("EMBEDDING_CACHE_DISK_ROWS", "1000000"))
+
+#text_splitter to chunk input document; same chunks as langchain's RecursiveCharacterTextSplitter, see benchmark/chunking.py
+text_splitter = RecursiveChunker(
     chunk_size=1000,      
     chunk_overlap=150,    
     separators=["\n\n", "\n", ".", " ", ""],
@@ -33,22 +62,46 @@ text_splitter = RecursiveCharacterTextSplitter(
 
 #---------------------------------------------------------------------------------------------------------------
 
-def clean_text(text: str) -> str:
-    # Remove escape sequences like \n, \r, \t, etc. (both actual and literal)
-    text = re.sub(r'\\[nrtfbv]', ' ', text)              # Literal backslash escapes
-    text = re.sub(r'[\n\r\t\f\v]', ' ', text)            # Actual control characters
-    text = re.sub(r'\\x[0-9a-fA-F]{2}', '', text)        # Hex escape sequences
-    text = re.sub(r'\s+', ' ', text)                     # Collapse multiple spaces
-    return text.strip()
+# "thread" parses every file in-process, "process" ships PDF / DOCX bytes to the extraction pool
+EXTRACTION_BACKEND = os.getenv("EXTRACTION_BACKEND", "thread")
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", str(os.cpu_count() or 1)))
+EXTRACTION_TIMEOUT_S = float(os.getenv("EXTRACTION_TIMEOUT_S", "120"))
+EXTRACTION_MAX_TASKS_PER_WORKER = int(os.getenv("EXTRACTION_MAX_TASKS_PER_WORKER", "50"))
+# Below this size the IPC round trip costs more than parsing in a thread
+EXTRACTION_INLINE_MAX_BYTES = int(os.getenv("EXTRACTION_INLINE_MAX_BYTES", str(256 * 1024)))
+
+# Files above this size are extracted, embedded and written window by window instead of all at once
+EXTRACTION_STREAM_MIN_BYTES = int(os.getenv("EXTRACTION_STREAM_MIN_BYTES", str(32 * 1024 * 1024)))
+# Chunks per window on that path; bounds the text and embeddings held for one large file
+EXTRACTION_STREAM_WINDOW_CHUNKS = int(os.getenv("EXTRACTION_STREAM_WINDOW_CHUNKS", "512"))
+
+extraction_pool = ExtractionPool(
+    max_workers=EXTRACTION_WORKERS,
+    max_tasks_per_child=EXTRACTION_MAX_TASKS_PER_WORKER,
+    timeout=EXTRACTION_TIMEOUT_S,
+)
+QUEUE_DEPTH.labels("extraction").set_function(lambda: extraction_pool.queue_depth)
 
 #---------------------------------------------------------------------------------------------------------------
 
+@observe_stage("extract_text")
 async def extract_text(file_obj, filename: str) -> str:
     ext = os.path.splitext(filename)[1].lower()
 
     logger.debug(f"Extracting text from file: {filename}, detected extension: {ext}")
 
     try:
+        if EXTRACTION_BACKEND == "process" and ext in (".pdf", ".docx"):
+            content = await asyncio.to_thread(file_obj.read)
+            if len(content) > EXTRACTION_INLINE_MAX_BYTES:
+                logger.debug(f"Processing {ext} file in extraction pool: {filename}")
+                text = await extraction_pool.extract(content, ext, filename)
+                logger.debug(f"Successfully extracted text from {ext} file: {filename}")
+                return text
+
+            # Tiny file: parse the bytes already read in a thread instead
+            file_obj = BytesIO(content)
+
         if ext == ".txt":
             logger.debug(f"Processing .txt file: {filename}")
             # For .txt files, directly read from the file object asynchronously
@@ -78,41 +131,101 @@ async def extract_text(file_obj, filename: str) -> str:
         logger.debug(f"Error occurred while extracting text from file: {filename}. Error: {str(e)}", exc_info=True)
         raise  # Re-raise the exception to propagate it further
 
-#---------------------------------------------------------------------------------------------------------------
-
+def should_stream(file_obj) -> bool:
+    # Size from the end offset, the upload is already spooled to memory or disk
+    position = file_obj.tell()
+    size = file_obj.seek(0, os.SEEK_END)
+    file_obj.seek(position)
+    return size > EXTRACTION_STREAM_MIN_BYTES
+
+async def stream_chunks(file_obj, filename: str) -> AsyncIterator[List[str]]:
+    """
+    Chunks of a large file in windows of EXTRACTION_STREAM_WINDOW_CHUNKS, read page / paragraph / block at a time,
+    cleaned and split incrementally. Parsing runs in a thread one window at a time; the extraction pool is not used,
+    it would need the whole file as one bytes object.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    logger.debug(f"Streaming text from file: {filename}, detected extension: {ext}")
 
-# Helper function to handle DOCX processing in a separate thread
-def process_docx(file_obj):
-    file_bytes = BytesIO(file_obj.read())
-    doc = docx.Document(file_bytes)
-    return "\n".join(p.text for p in doc.paragraphs)
+    windows = iter_windows(iter_chunks(iter_segments(file_obj, ext), text_splitter.split_text), EXTRACTION_STREAM_WINDOW_CHUNKS)
+    while True:
+        with STAGE_SECONDS.labels("extract_text").time():
+            window = await asyncio.to_thread(next, windows, None)
+        if window is None:
+            return
+        yield window
 
+#---------------------------------------------------------------------------------------------------------------
 
 # Modify the embedding generation function to use SentenceTransformer
-async def generate_embeddings(texts: List[str]):
-    return await asyncio.to_thread(_generate_embeddings, texts)
-
-def _generate_embeddings(texts: List[str]) -> List[torch.Tensor]:
-    embeddings_list: List[torch.Tensor] = []
-    for text in texts:
-        embedding = model.encode(text, convert_to_tensor=True)
-        embeddings_list.append(embedding)
-    return embeddings_list
-
-# Helper function to handle PDF processing in a separate thread
-def process_pdf(file_obj):
-    # Write the file object to a temporary file because PyPDFLoader expects a file path
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-        tmp_file.write(file_obj.read())
-        tmp_file_path = tmp_file.name
-    
-    try:
-        # Use LangChain's PyPDFLoader
-        loader = PyPDFLoader(tmp_file_path)
-        documents = loader.load()
-        text = "\n".join(doc.page_content for doc in documents)
-    finally:
-        # Ensure the temporary file is deleted even if an error occurs
-        os.remove(tmp_file_path)
-
-    return text
\ No newline at end of file
+@observe_stage("generate_embeddings")
+async def generate_embeddings(texts: List[str], priority: Priority = Priority.INGEST) -> np.ndarray:
+    """
+    Serves chunks from the embedding cache and only sends the misses to the model.
+    Returns one contiguous (len(texts), dim) float32 array.
+    """
+    cached = await embedding_cache.get_many(texts)
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, cached) if vector is None))
+
+    if missing:
+        computed = await embedding_scheduler.submit(missing, priority=priority)
+        computed = np.ascontiguousarray(computed.cpu().numpy(), dtype=np.float32)
+        CHUNKS_TOTAL.labels("embedded").inc(len(missing))
+        await embedding_cache.put_many(missing, computed)
+        computed_rows = {text: row for row, text in enumerate(missing)}
+
+        # Nothing cached and nothing repeated: the model output already is the result, no copy needed
+        if len(missing) == len(texts):
+            return computed
+
+    embeddings = np.empty((len(texts), embedding_backend.dimension), dtype=np.float32)
+    for idx, (text, vector) in enumerate(zip(texts, cached)):
+        embeddings[idx] = vector if vector is not None else computed[computed_rows[text]]
+    return embeddings
+
+def _generate_embeddings(texts: List[str], batch_size: int = EMBEDDING_BATCH_SIZE) -> torch.Tensor:
+    """
+    Encodes all chunks in batches of batch_size and returns one (len(texts), dim) tensor in input order
+    """
+    return embedding_backend.encode_by_length(texts, batch_size=batch_size)
+
+# Replicas run the same engine as embedding_backend, results come back through shared memory
+embedding_replicas = ReplicaPool(
+    num_replicas=EMBEDDING_REPLICAS,
+    backend_name=EMBEDDING_BACKEND,
+    model_name=MODEL_NAME,
+    dim=embedding_backend.dimension,
+    batch_size=EMBEDDING_BATCH_SIZE,
+    max_rows=EMBEDDING_SCHEDULER_MAX_BATCH,
+    min_shard=EMBEDDING_REPLICA_MIN_SHARD,
+) if EMBEDDING_REPLICAS > 0 else None
+
+# Shared by every upload and search so concurrent requests share forward passes; one batch in flight per replica
+embedding_scheduler = EmbeddingScheduler(
+    encode=embedding_replicas.encode if embedding_replicas is not None else _generate_embeddings,
+    max_batch_size=EMBEDDING_SCHEDULER_MAX_BATCH,
+    max_wait_ms=EMBEDDING_SCHEDULER_MAX_WAIT_MS,
+    max_concurrent_batches=max(EMBEDDING_REPLICAS, 1),
+)
+QUEUE_DEPTH.labels("embedding").set_function(lambda: embedding_scheduler.pending_chunks)
+
+async def warm_up_embeddings():
+    """
+    Loads the model, or starts the replicas, and runs a first forward pass off the event loop
+    """
+    if embedding_replicas is not None:
+        await asyncio.to_thread(embedding_replicas.start)
+    else:
+        await asyncio.to_thread(embedding_backend.load)
+
+def embeddings_ready() -> bool:
+    return embedding_replicas.ready if embedding_replicas is not None else embedding_backend.ready
+
+# Keyed per engine as well, quantized embeddings are not interchangeable with fp32 ones
+embedding_cache = EmbeddingCache(
+    model_name=f"{MODEL_NAME}:{embedding_backend.name}",
+    dim=embedding_backend.dimension,
+    max_bytes=EMBEDDING_CACHE_MAX_BYTES,
+    disk_dir=EMBEDDING_CACHE_DIR,
+    disk_rows=EMBEDDING_CACHE_DISK_ROWS,
+)
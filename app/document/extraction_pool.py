@@ -0,0 +1,78 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+from app.document.parsers import extract_bytes
+from app.logger import logger
+
+class ExtractionPool:
+    """
+    Runs CPU-bound PDF / DOCX parsing in worker processes so concurrent files use more than one core.
+    Workers are recycled after max_tasks_per_child documents to cap memory growth, and a worker that
+    exceeds the per-file timeout is killed together with its pool.
+    """
+
+    def __init__(self, max_workers: int, max_tasks_per_child: int, timeout: float):
+        self.max_workers = max_workers
+        self.max_tasks_per_child = max_tasks_per_child
+        self.timeout = timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._in_flight = 0
+
+    @property
+    def queue_depth(self) -> int:
+        # Documents waiting for a free worker process
+        return max(0, self._in_flight - self.max_workers)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: workers import app.document.parsers and main.py, which skips the app under __mp_main__,
+            # so they never load the embedding model, torch or the Chroma client
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                max_tasks_per_child=self.max_tasks_per_child,
+            )
+            logger.info(f"Extraction pool started with {self.max_workers} workers")
+        return self._executor
+
+    async def extract(self, data: bytes, ext: str, filename: str) -> str:
+        loop = asyncio.get_running_loop()
+        self._in_flight += 1
+
+        try:
+            # A pool killed for another file's timeout is retried once on a fresh pool
+            for attempt in range(2):
+                executor = self._get_executor()
+                try:
+                    future = loop.run_in_executor(executor, extract_bytes, data, ext)
+                    return await asyncio.wait_for(future, timeout=self.timeout)
+
+                except asyncio.TimeoutError:
+                    logger.warning(f"Extraction of {filename} timed out after {self.timeout}s. Restarting extraction pool.")
+                    self._restart(executor)
+                    raise ValueError(f"Text extraction timed out after {self.timeout} seconds")
+
+                except BrokenProcessPool:
+                    logger.warning(f"Extraction pool broke while processing {filename}. Restarting extraction pool.")
+                    self._restart(executor)
+                    if attempt == 1:
+                        raise
+        finally:
+            self._in_flight -= 1
+
+    def _restart(self, executor: ProcessPoolExecutor):
+        if self._executor is not executor:
+            return
+        self._executor = None
+
+        # ProcessPoolExecutor cannot cancel a running task, so terminate the workers directly
+        for process in list((executor._processes or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,357 @@
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+from fastapi import UploadFile
+from app.api.request import Status, StatusEnum, Verbosity, create_upload_document
+from app.document.batch import process_file, process_text, process_embeddings_batch, process_large_file
+from app.document.extract import should_stream
+from app.logger import logger
+from app.metrics import ERRORS_TOTAL, QUEUE_DEPTH
+
+# Spooled upload files and the SQLite job database live here and survive restarts
+INGEST_SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR", "ingest_spool")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# Files a worker claims at once, across jobs, so extraction, embedding and writes run on full batches
+INGEST_BATCH_FILES = int(os.getenv("INGEST_BATCH_FILES", "16"))
+# Workers also re-check the queue this often in case a wake-up was missed
+INGEST_POLL_S = float(os.getenv("INGEST_POLL_S", "1.0"))
+# Finished jobs are deleted this long after their last file completed, GET /jobs/{id} then answers 404
+INGEST_JOB_TTL_S = float(os.getenv("INGEST_JOB_TTL_S", str(7 * 24 * 3600)))
+INGEST_PRUNE_INTERVAL_S = float(os.getenv("INGEST_PRUNE_INTERVAL_S", "3600"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    files INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_files (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL REFERENCES jobs(id),
+    position INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    path TEXT NOT NULL,
+    state TEXT NOT NULL,
+    result TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_files_state ON job_files (state, id);
+CREATE INDEX IF NOT EXISTS job_files_job ON job_files (job_id, position);
+"""
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+
+#---------------------------------------------------------------------------------------------------------------
+
+class _JobStore:
+    """
+    SQLite bookkeeping for jobs and their files; every method is blocking and is called through asyncio.to_thread
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def add_job(self, job_id: str, files: List[Dict]):
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.execute("INSERT INTO jobs (id, created_at, files) VALUES (?, ?, ?)", (job_id, now, len(files)))
+            self._db.executemany(
+                "INSERT INTO job_files (job_id, position, filename, path, state, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(job_id, idx, file["filename"], file["path"], QUEUED, now) for idx, file in enumerate(files)],
+            )
+            self._db.execute("COMMIT")
+
+    def claim(self, limit: int) -> List[Tuple]:
+        # Oldest queued files first, whichever jobs they belong to
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            rows = self._db.execute(
+                "SELECT id, job_id, filename, path FROM job_files WHERE state = ? ORDER BY id LIMIT ?", (QUEUED, limit)
+            ).fetchall()
+            self._db.executemany(
+                "UPDATE job_files SET state = ?, updated_at = ? WHERE id = ?",
+                [(RUNNING, time.time(), row[0]) for row in rows],
+            )
+            self._db.execute("COMMIT")
+        return rows
+
+    def finish(self, results: Dict[int, dict]):
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "UPDATE job_files SET state = ?, result = ?, updated_at = ? WHERE id = ?",
+                [(DONE, json.dumps(result), now, file_id) for file_id, result in results.items()],
+            )
+
+    def requeue_running(self) -> int:
+        # Files claimed by a worker of a previous process that never finished them
+        with self._lock:
+            return self._db.execute("UPDATE job_files SET state = ? WHERE state = ?", (QUEUED, RUNNING)).rowcount
+
+    def prune(self, cutoff: float) -> int:
+        # Jobs whose files are all done and finished before cutoff; returns how many were deleted
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            job_ids = [row[0] for row in self._db.execute(
+                """
+                SELECT jobs.id FROM jobs LEFT JOIN job_files ON job_files.job_id = jobs.id
+                GROUP BY jobs.id
+                HAVING COALESCE(SUM(job_files.state != ?), 0) = 0
+                   AND COALESCE(MAX(job_files.updated_at), jobs.created_at) < ?
+                """,
+                (DONE, cutoff),
+            ).fetchall()]
+            self._db.executemany("DELETE FROM job_files WHERE job_id = ?", [(job_id,) for job_id in job_ids])
+            self._db.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in job_ids])
+            self._db.execute("COMMIT")
+        return len(job_ids)
+
+    def queued(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM job_files WHERE state = ?", (QUEUED,)).fetchone()[0]
+
+    def job(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._db.execute("SELECT id, created_at, files FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            files = self._db.execute(
+                "SELECT filename, state, result, updated_at FROM job_files WHERE job_id = ? ORDER BY position", (job_id,)
+            ).fetchall()
+        return {"id": job[0], "created_at": job[1], "files": files}
+
+#---------------------------------------------------------------------------------------------------------------
+
+class IngestQueue:
+    """
+    Persistent ingest queue: submit() spools uploaded files to disk and records them in SQLite, a pool of workers
+    claims up to batch_files queued files at a time across jobs and runs them through extract -> embed -> write.
+    Files a crashed process left running are queued again on start. Finished jobs are pruned after job_ttl_s.
+    """
+
+    def __init__(self, spool_dir: str, num_workers: int, batch_files: int, poll_s: float, job_ttl_s: float, prune_interval_s: float):
+        self.spool_dir = spool_dir
+        self.num_workers = num_workers
+        self.batch_files = batch_files
+        self.poll_s = poll_s
+        self.job_ttl_s = job_ttl_s
+        self.prune_interval_s = prune_interval_s
+        self._store: Optional[_JobStore] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: List[asyncio.Task] = []
+        self._queued = 0
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    async def _get_store(self) -> _JobStore:
+        if self._store is None:
+            store = await asyncio.to_thread(_open_store, self.spool_dir)
+            # Another caller may have opened it while this one waited
+            if self._store is None:
+                self._store = store
+        return self._store
+
+    async def start(self):
+        if self._workers:
+            return
+        store = await self._get_store()
+        requeued = await asyncio.to_thread(store.requeue_running)
+        self._queued = await asyncio.to_thread(store.queued)
+        if requeued:
+            logger.info(f"Requeued {requeued} ingest files left running by a previous process")
+
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._worker(idx)) for idx in range(self.num_workers)]
+        if self.job_ttl_s > 0:
+            self._workers.append(asyncio.create_task(self._pruner()))
+        if self._queued:
+            self._wakeup.set()
+        logger.info(f"Ingest queue started with {self.num_workers} workers, {self._queued} files queued")
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    #-----------------------------------------------------------------------------------------------------------
+
+    async def submit(self, files: List[UploadFile]) -> str:
+        """
+        Spools the files and queues them as one job; returns the job id right away
+        """
+        job_id = str(uuid.uuid4())
+        job_dir = os.path.join(self.spool_dir, job_id)
+        await asyncio.to_thread(os.makedirs, job_dir, exist_ok=True)
+
+        spooled = []
+        for idx, file in enumerate(files):
+            # The index prefix keeps repeated filenames apart, the original name is kept for the extension and chunk ids
+            path = os.path.join(job_dir, f"{idx:05d}-{os.path.basename(file.filename)}")
+            await asyncio.to_thread(_spool, file.file, path)
+            spooled.append({"filename": file.filename, "path": path})
+
+        store = await self._get_store()
+        await asyncio.to_thread(store.add_job, job_id, spooled)
+        self._queued += len(spooled)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+        logger.info(f"Queued ingest job {job_id} with {len(spooled)} files")
+        return job_id
+
+    async def status(self, job_id: str) -> Optional[Dict]:
+        store = await self._get_store()
+        job = await asyncio.to_thread(store.job, job_id)
+        if job is None:
+            return None
+
+        files = []
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0}
+        failed = 0
+        for filename, state, result, updated_at in job["files"]:
+            counts[state] += 1
+            entry = {"filename": filename, "state": state, "updated_at": updated_at}
+            if result is not None:
+                entry.update(json.loads(result))
+                failed += entry["status"]["status"] != StatusEnum.SUCCESS.value
+            files.append(entry)
+
+        if counts[DONE] == len(job["files"]):
+            state = DONE
+        elif counts[QUEUED] == len(job["files"]):
+            state = QUEUED
+        else:
+            state = RUNNING
+
+        return {
+            "job_id": job["id"],
+            "state": state,
+            "created_at": job["created_at"],
+            "files": len(files),
+            "queued": counts[QUEUED],
+            "running": counts[RUNNING],
+            "done": counts[DONE],
+            "failed": failed,
+            "state_per_file": files,
+        }
+
+    #-----------------------------------------------------------------------------------------------------------
+
+    async def _pruner(self):
+        store = await self._get_store()
+        while True:
+            try:
+                pruned = await asyncio.to_thread(store.prune, time.time() - self.job_ttl_s)
+                if pruned:
+                    logger.info(f"Pruned {pruned} ingest jobs finished more than {self.job_ttl_s:.0f}s ago")
+            except Exception as e:
+                logger.error(f"Pruning finished ingest jobs failed. Error: {str(e)}", exc_info=True)
+            await asyncio.sleep(self.prune_interval_s)
+
+    async def _worker(self, idx: int):
+        store = await self._get_store()
+        while True:
+            try:
+                rows = await asyncio.to_thread(store.claim, self.batch_files)
+                if not rows:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_s)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                self._queued = max(0, self._queued - len(rows))
+                logger.info(f"Ingest worker {idx} processing {len(rows)} files from {len({row[1] for row in rows})} jobs")
+                results = await self._process(rows)
+                await asyncio.to_thread(store.finish, results)
+
+                # Only after the results are recorded, a crash before this point re-runs the files from the spool
+                for _, _, _, path in rows:
+                    await asyncio.to_thread(_remove, path)
+
+            except Exception as e:
+                # Files claimed by this iteration stay running until the next start queues them again
+                logger.error(f"Ingest worker {idx} failed, retrying in {self.poll_s}s. Error: {str(e)}", exc_info=True)
+                ERRORS_TOTAL.labels("ingest_worker").inc()
+                await asyncio.sleep(self.poll_s)
+
+    async def _process(self, rows: List[Tuple]) -> Dict[int, dict]:
+        # Keyed by file row id: the same filename may be queued by several jobs
+        documents = {row[0]: create_upload_document() for row in rows}
+        uploads = {}
+        try:
+            for file_id, _, filename, path in rows:
+                try:
+                    uploads[file_id] = UploadFile(file=await asyncio.to_thread(open, path, "rb"), filename=filename)
+                except OSError as e:
+                    documents[file_id].text.error = f"Spooled file is not readable: {str(e)}"
+
+            # Large files go window by window through process_large_file and skip the batched stages
+            streamed = {file_id for file_id, upload in uploads.items() if should_stream(upload.file)}
+            await asyncio.gather(*[
+                process_large_file(file=uploads[file_id], upload_document=documents[file_id]) if file_id in streamed else
+                process_file(file=uploads[file_id], upload_document=documents[file_id])
+                for file_id in uploads
+            ])
+            batched = [row for row in rows if row[0] not in streamed]
+            await asyncio.gather(*[process_text(filename=filename, upload_document=documents[file_id]) for file_id, _, filename, _ in batched])
+
+            # One coalesced write for the whole batch; filenames only need to be unique within one flush
+            file_map = {}
+            for file_id, _, filename, _ in batched:
+                key = filename if filename not in file_map else f"{filename}#{file_id}"
+                file_map[key] = documents[file_id]
+            await process_embeddings_batch(file_map)
+
+        except Exception as e:
+            logger.error(f"Ingest batch failed. Error: {str(e)}", exc_info=True)
+            for document in documents.values():
+                if document.status.code != StatusEnum.SUCCESS:
+                    document.status = Status(code=StatusEnum.FAILED, error=f"Failed to process file: {str(e)}")
+
+        finally:
+            for upload in uploads.values():
+                upload.file.close()
+
+        return {file_id: document.to_dict(Verbosity.SUMMARY) for file_id, document in documents.items()}
+
+def _open_store(spool_dir: str) -> _JobStore:
+    os.makedirs(spool_dir, exist_ok=True)
+    return _JobStore(os.path.join(spool_dir, "jobs.db"))
+
+def _spool(source, path: str):
+    with open(path, "wb") as target:
+        shutil.copyfileobj(source, target, length=1024 * 1024)
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+    except OSError:
+        pass  # other files of the job are still spooled
+
+ingest_queue = IngestQueue(
+    spool_dir=INGEST_SPOOL_DIR,
+    num_workers=INGEST_WORKERS,
+    batch_files=INGEST_BATCH_FILES,
+    poll_s=INGEST_POLL_S,
+    job_ttl_s=INGEST_JOB_TTL_S,
+    prune_interval_s=INGEST_PRUNE_INTERVAL_S,
+)
+QUEUE_DEPTH.labels("ingest").set_function(lambda: ingest_queue.queued)
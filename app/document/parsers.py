@@ -0,0 +1,178 @@
+# parsers.py
+#
+# Text extraction that does not depend on the embedding model, so it can be imported by extraction worker processes
+
+import codecs
+import os
+import re
+import tempfile
+import zipfile
+from io import BytesIO
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List
+from xml.etree import ElementTree
+import docx
+from langchain_community.document_loaders import PyPDFLoader
+from pypdf import PdfReader
+
+# Streaming extraction: bytes read per .txt block, characters of cleaned text split at once
+STREAM_TEXT_BLOCK_BYTES = 1024 * 1024
+STREAM_SPLIT_WINDOW_CHARS = 64 * 1024
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+#---------------------------------------------------------------------------------------------------------------
+
+_LITERAL_ESCAPE = re.compile(r'\\[nrtfbv]')
+_HEX_ESCAPE = re.compile(r'\\x[0-9a-fA-F]{2}')
+
+def clean_text(text: str) -> str:
+    """
+    Replaces literal escape sequences (\\n, \\t, ...) with spaces, removes hex escapes (\\x41), collapses whitespace
+    including control characters to single spaces and strips. The escape patterns are precompiled and skipped when
+    there is no backslash; split / join collapses and strips in one pass, \\s and str.split() agree on whitespace.
+    """
+    if "\\" in text:
+        text = _LITERAL_ESCAPE.sub(" ", text)
+        text = _HEX_ESCAPE.sub("", text)
+    return " ".join(text.split())
+
+#---------------------------------------------------------------------------------------------------------------
+
+# Helper function to handle DOCX processing in a separate thread
+def process_docx(file_obj):
+    file_bytes = BytesIO(file_obj.read())
+    doc = docx.Document(file_bytes)
+    return "\n".join(p.text for p in doc.paragraphs)
+
+# Helper function to handle PDF processing in a separate thread
+def process_pdf(file_obj):
+    # Write the file object to a temporary file because PyPDFLoader expects a file path
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
+        tmp_file.write(file_obj.read())
+        tmp_file_path = tmp_file.name
+    
+    try:
+        # Use LangChain's PyPDFLoader
+        loader = PyPDFLoader(tmp_file_path)
+        documents = loader.load()
+        text = "\n".join(doc.page_content for doc in documents)
+    finally:
+        # Ensure the temporary file is deleted even if an error occurs
+        os.remove(tmp_file_path)
+
+    return text
+
+def extract_bytes(data: bytes, ext: str) -> str:
+    """
+    Entry point for extraction worker processes: raw file bytes in, cleaned text out
+    """
+    if ext == ".pdf":
+        text = process_pdf(BytesIO(data))
+    elif ext == ".docx":
+        text = process_docx(BytesIO(data))
+    elif ext == ".txt":
+        text = data.decode("utf-8", errors="ignore")
+    else:
+        raise ValueError("Unsupported file type. Use .txt, .pdf, or .docx.")
+
+    return clean_text(text)
+
+#---------------------------------------------------------------------------------------------------------------
+# Streaming extraction for large files: one page / paragraph / block in memory at a time instead of the whole text
+
+def iter_pdf_pages(file_obj) -> Iterator[str]:
+    # PdfReader reads objects from the stream on demand, so the file is neither copied to a temp file nor loaded whole
+    reader = PdfReader(file_obj)
+    for page in reader.pages:
+        yield page.extract_text() or ""
+
+def iter_docx_paragraphs(file_obj) -> Iterator[str]:
+    """
+    Body paragraphs of a .docx, the same ones docx.Document(...).paragraphs returns, parsed incrementally from
+    word/document.xml; every paragraph is dropped from the tree once its text has been read
+    """
+    with zipfile.ZipFile(file_obj) as archive, archive.open("word/document.xml") as xml:
+        depth = 0
+        body = None
+        for event, element in ElementTree.iterparse(xml, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if depth == 2 and element.tag == _W + "body":
+                    body = element
+                continue
+
+            depth -= 1
+            if depth != 2 or body is None:
+                continue
+            if element.tag == _W + "p":
+                parts = []
+                for node in element.iter():
+                    if node.tag == _W + "t":
+                        parts.append(node.text or "")
+                    elif node.tag == _W + "tab":
+                        parts.append("\t")
+                    elif node.tag in (_W + "br", _W + "cr"):
+                        parts.append("\n")
+                yield "".join(parts)
+            body.clear()
+
+def iter_text_blocks(file_obj, block_bytes: int = STREAM_TEXT_BLOCK_BYTES) -> Iterator[str]:
+    # Blocks end at whitespace, so no word or escape sequence clean_text looks for is cut in two
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    carry = ""
+    while True:
+        data = file_obj.read(block_bytes)
+        text = carry + decoder.decode(data, final=not data)
+        if not data:
+            if text:
+                yield text
+            return
+
+        cut = max(text.rfind(" "), text.rfind("\n"), text.rfind("\t"))
+        if cut <= 0:
+            carry = text
+            continue
+        carry = text[cut:]
+        yield text[:cut]
+
+def iter_segments(file_obj, ext: str) -> Iterator[str]:
+    if ext == ".pdf":
+        return iter_pdf_pages(file_obj)
+    if ext == ".docx":
+        return iter_docx_paragraphs(file_obj)
+    if ext == ".txt":
+        return iter_text_blocks(file_obj)
+    raise ValueError("Unsupported file type. Use .txt, .pdf, or .docx.")
+
+def iter_chunks(segments: Iterable[str], split: Callable[[str], List[str]], window_chars: int = STREAM_SPLIT_WINDOW_CHARS) -> Iterator[str]:
+    """
+    Cleans and splits a stream of text segments incrementally. Cleaned segments are buffered up to window_chars and
+    split; every chunk but the last is emitted and the last one seeds the next window, so chunks keep the splitter's
+    overlap across windows. Memory is bounded by the window and the largest segment, not by the file.
+    """
+    buffer: List[str] = []
+    size = 0
+    for segment in segments:
+        segment = clean_text(segment)
+        if not segment:
+            continue
+        buffer.append(segment)
+        size += len(segment) + 1
+        if size < window_chars:
+            continue
+
+        chunks = split(" ".join(buffer))
+        yield from chunks[:-1]
+        buffer = chunks[-1:]
+        size = sum(len(chunk) for chunk in buffer)
+
+    if buffer:
+        yield from split(" ".join(buffer))
+
+def iter_windows(chunks: Iterator[str], size: int) -> Iterator[List[str]]:
+    while True:
+        window = list(islice(chunks, size))
+        if not window:
+            return
+        yield window
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import AsyncIterator, Awaitable, Callable, List, Optional
+from fastapi import UploadFile
+from app.api.request import UploadDocument, create_upload_document
+from app.document.batch import process_file, process_text, process_embeddings, process_large_file
+from app.document.extract import should_stream
+from app.logger import logger
+from app.metrics import IN_FLIGHT_REQUESTS
+
+# Bounded queues between stages give backpressure: a fast extractor cannot run ahead of the embedder
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
+PIPELINE_EXTRACT_WORKERS = int(os.getenv("PIPELINE_EXTRACT_WORKERS", "4"))
+PIPELINE_EMBED_WORKERS = int(os.getenv("PIPELINE_EMBED_WORKERS", "2"))
+PIPELINE_WRITE_WORKERS = int(os.getenv("PIPELINE_WRITE_WORKERS", "2"))
+# Copies of streamed uploads stay in memory up to this size, larger ones go to a temporary file
+PIPELINE_SPOOL_MAX_MEMORY_BYTES = int(os.getenv("PIPELINE_SPOOL_MAX_MEMORY_BYTES", str(1024 * 1024)))
+
+class _Item:
+    __slots__ = ("filename", "file", "document", "streamed")
+
+    def __init__(self, file: UploadFile, document: UploadDocument):
+        self.filename = file.filename
+        self.file = file
+        self.document = document
+        # Large file: the extract stage runs the whole windowed extract -> embed -> write, later stages pass it through
+        self.streamed = False
+
+#---------------------------------------------------------------------------------------------------------------
+
+def _extract_event(item: _Item) -> dict:
+    text = item.document.text
+    if item.streamed:
+        return {"error": item.document.status.error, "chunks": text.shape[0] if text.shape else 0}
+    return {"error": text.error, "chunks": len(text.content) if text.error is None else 0}
+
+def _embed_event(item: _Item) -> dict:
+    embedding = item.document.embedding
+    return {"error": embedding.error, "embeddings": embedding.shape}
+
+def _write_event(item: _Item) -> dict:
+    document = item.document
+    return {"error": document.status.error, "collection": document.collection}
+
+async def _extract(item: _Item):
+    item.streamed = should_stream(item.file.file)
+    if item.streamed:
+        await process_large_file(file=item.file, upload_document=item.document)
+    else:
+        await process_file(file=item.file, upload_document=item.document)
+
+async def _embed(item: _Item):
+    if not item.streamed:
+        await process_text(filename=item.filename, upload_document=item.document)
+
+async def _write(item: _Item):
+    if not item.streamed:
+        await process_embeddings(filename=item.filename, upload_document=item.document)
+
+STAGES = [
+    ("extract", _extract, _extract_event, PIPELINE_EXTRACT_WORKERS),
+    ("embed", _embed, _embed_event, PIPELINE_EMBED_WORKERS),
+    ("write", _write, _write_event, PIPELINE_WRITE_WORKERS),
+]
+
+#---------------------------------------------------------------------------------------------------------------
+
+async def _stage_worker(
+    stage: str,
+    process: Callable[[_Item], Awaitable[None]],
+    describe: Callable[[_Item], dict],
+    inbox: asyncio.Queue,
+    outbox: Optional[asyncio.Queue],
+    events: asyncio.Queue,
+):
+    while True:
+        item = await inbox.get()
+        if item is None:
+            return
+
+        start = time.perf_counter()
+        await process(item)
+
+        # The batch.py stages record their own errors, so failed files still flow downstream and are reported there
+        event = {"file": item.filename, "uuid": item.document.uuid, "stage": stage}
+        event.update(describe(item))
+        event["status"] = "failed" if event["error"] else "success"
+        event["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        await events.put(event)
+
+        if outbox is not None:
+            await outbox.put(item)
+
+async def run_pipeline(files: List[UploadFile], events: asyncio.Queue):
+    """
+    Runs every file through extract -> embed -> write as its own pipeline and reports each finished stage on events.
+    Puts None on events once every file has left the last stage.
+    """
+    queues = [asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE) for _ in STAGES]
+    workers: List[List[asyncio.Task]] = []
+
+    for idx, (stage, process, describe, num_workers) in enumerate(STAGES):
+        outbox = queues[idx + 1] if idx + 1 < len(queues) else None
+        workers.append([
+            asyncio.create_task(_stage_worker(stage, process, describe, queues[idx], outbox, events))
+            for _ in range(num_workers)
+        ])
+
+    try:
+        for file in files:
+            await queues[0].put(_Item(file=file, document=create_upload_document()))
+
+        # Drain the stages in order so each one sees every item from its predecessor
+        for idx, stage_workers in enumerate(workers):
+            for _ in stage_workers:
+                await queues[idx].put(None)
+            await asyncio.gather(*stage_workers)
+
+    finally:
+        for stage_workers in workers:
+            for task in stage_workers:
+                task.cancel()
+        await events.put(None)
+
+async def spool_uploads(files: List[UploadFile]) -> List[UploadFile]:
+    """
+    Copies the request's uploads into temporary files the streaming response owns. FastAPI closes the request's
+    UploadFiles as soon as the endpoint returns, before a StreamingResponse body has run.
+    """
+    spooled = []
+    try:
+        for file in files:
+            target = tempfile.SpooledTemporaryFile(max_size=PIPELINE_SPOOL_MAX_MEMORY_BYTES)
+            spooled.append(UploadFile(file=target, filename=file.filename))
+            await asyncio.to_thread(_copy, file.file, target)
+    except BaseException:
+        for upload in spooled:
+            upload.file.close()
+        raise
+    return spooled
+
+def _copy(source, target):
+    source.seek(0)
+    shutil.copyfileobj(source, target, length=1024 * 1024)
+    target.seek(0)
+
+async def stream_upload(files: List[UploadFile]) -> AsyncIterator[bytes]:
+    """
+    NDJSON body for the streaming upload endpoint: one line per file per finished stage, then a summary line.
+    Takes the copies from spool_uploads and closes them when the body ends.
+    """
+    logger.info(f"Starting streaming upload for {len(files)} files.")
+    events: asyncio.Queue = asyncio.Queue()
+    pipeline = asyncio.create_task(run_pipeline(files, events))
+    start = time.perf_counter()
+    failed = set()
+    in_flight = IN_FLIGHT_REQUESTS.labels("upload_stream")
+    in_flight.inc()
+
+    try:
+        yield _ndjson({"stage": "accepted", "files": [file.filename for file in files]})
+
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            if event["status"] == "failed":
+                failed.add(event["uuid"])
+            yield _ndjson(event)
+
+        await pipeline
+        yield _ndjson({
+            "stage": "done",
+            "files": len(files),
+            "failed": len(failed),
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+        })
+        logger.info(f"Streaming upload completed for {len(files)} files.")
+
+    finally:
+        # Stop the pipeline if the client disconnected mid-stream
+        if not pipeline.done():
+            pipeline.cancel()
+        in_flight.dec()
+        for file in files:
+            file.file.close()
+
+def _ndjson(event: dict) -> bytes:
+    return (json.dumps(event) + "\n").encode("utf-8")
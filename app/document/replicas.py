@@ -0,0 +1,238 @@
+import math
+import multiprocessing
+import os
+import queue
+import threading
+from typing import List, Optional
+import numpy as np
+import torch
+from app.document.backends import create_backend
+from app.logger import logger
+
+#---------------------------------------------------------------------------------------------------------------
+
+def _replica_main(conn, buffer, dim: int, cores: List[int], backend_name: str, model_name: str, batch_size: int):
+    """
+    Entry point of a replica process: pins itself to cores, loads and warms up its own model with one intra-op
+    thread per core, then encodes the texts it receives into the shared buffer and replies with the row count only
+    """
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    try:
+        backend = create_backend(backend_name, model_name=model_name, device="cpu", num_threads=len(cores))
+        backend.encode_by_length(["warm up"], batch_size=1)
+        out = np.frombuffer(buffer, dtype=np.float32).reshape(-1, dim)
+        conn.send(("ready", backend.dimension))
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+        return
+
+    while True:
+        try:
+            texts = conn.recv()
+        except EOFError:
+            return
+        if texts is None:
+            return
+
+        try:
+            embeddings = backend.encode_by_length(texts, batch_size=batch_size)
+            out[:len(texts)] = embeddings.float().cpu().numpy()
+            conn.send(("ok", len(texts)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+class _Replica:
+    """
+    Parent-side handle of one replica process: its pipe and the shared (max_rows, dim) float32 result buffer
+    """
+
+    def __init__(self, index: int, cores: List[int], dim: int, max_rows: int):
+        self.index = index
+        self.cores = cores
+        self.dim = dim
+        self.max_rows = max_rows
+        self.process = None
+        self.conn = None
+        self.buffer = None
+        self.view: Optional[np.ndarray] = None
+
+    def start(self, context, backend_name: str, model_name: str, batch_size: int):
+        # RawArray is an anonymous shared mapping handed to the child at spawn, nothing to unlink afterwards
+        self.buffer = context.RawArray("f", self.max_rows * self.dim)
+        self.view = np.frombuffer(self.buffer, dtype=np.float32).reshape(self.max_rows, self.dim)
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_replica_main,
+            args=(child_conn, self.buffer, self.dim, self.cores, backend_name, model_name, batch_size),
+            name=f"embedding-replica-{self.index}",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+    def wait_ready(self):
+        try:
+            status, value = self.conn.recv()
+        except EOFError:
+            raise RuntimeError(f"Embedding replica {self.index} exited during startup")
+        if status != "ready":
+            raise RuntimeError(f"Embedding replica {self.index} failed to load the model: {value}")
+        if value != self.dim:
+            raise RuntimeError(f"Embedding replica {self.index} has dimension {value}, expected {self.dim}")
+
+    def encode_into(self, texts: List[str], out: np.ndarray):
+        # Texts go over the pipe, embeddings come back through the shared buffer, max_rows at a time
+        for start in range(0, len(texts), self.max_rows):
+            self.conn.send(texts[start:start + self.max_rows])
+            status, value = self.conn.recv()
+            if status != "ok":
+                raise RuntimeError(f"Embedding replica {self.index} failed: {value}")
+            out[start:start + value] = self.view[:value]
+
+    def stop(self, timeout: float = 5.0):
+        if self.process is None:
+            return
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+        self.process = None
+
+#---------------------------------------------------------------------------------------------------------------
+
+class ReplicaPool:
+    """
+    CPU embedding replicas in separate processes, each pinned to its own share of the cores this process may run on
+    and running its intra-op threads on those cores only. encode shards a batch into contiguous slices of at least
+    min_shard chunks over the idle replicas and copies the results out of their shared buffers.
+    encode blocks; the scheduler calls it from a thread, up to one batch per replica at a time.
+    """
+
+    def __init__(
+        self,
+        num_replicas: int,
+        backend_name: str,
+        model_name: str,
+        dim: int,
+        batch_size: int,
+        max_rows: int,
+        min_shard: int,
+    ):
+        self.num_replicas = num_replicas
+        self.backend_name = backend_name
+        self.model_name = model_name
+        self.dim = dim
+        self.batch_size = batch_size
+        self.max_rows = max_rows
+        self.min_shard = max(min_shard, 1)
+        self._context = multiprocessing.get_context("spawn")
+        self._replicas: List[_Replica] = []
+        self._idle: "queue.Queue[_Replica]" = queue.Queue()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def core_groups(num_replicas: int) -> List[List[int]]:
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+        if num_replicas > len(cores):
+            logger.warning(f"{num_replicas} embedding replicas for {len(cores)} cores, replicas will share cores")
+            return [[cores[idx % len(cores)]] for idx in range(num_replicas)]
+        return [group.tolist() for group in np.array_split(np.asarray(cores), num_replicas)]
+
+    @property
+    def ready(self) -> bool:
+        return bool(self._replicas)
+
+    def start(self):
+        with self._lock:
+            if self._replicas:
+                return
+
+            groups = self.core_groups(self.num_replicas)
+            replicas = [_Replica(idx, cores, self.dim, self.max_rows) for idx, cores in enumerate(groups)]
+            # Spawn every replica first so the models load in parallel
+            for replica in replicas:
+                replica.start(self._context, self.backend_name, self.model_name, self.batch_size)
+            try:
+                for replica in replicas:
+                    replica.wait_ready()
+            except Exception:
+                for replica in replicas:
+                    replica.stop(timeout=0)
+                raise
+
+            for replica in replicas:
+                self._idle.put(replica)
+            self._replicas = replicas
+            logger.info(f"Embedding replica pool started: {len(replicas)} replicas on cores {[replica.cores for replica in replicas]}")
+
+    def shutdown(self):
+        with self._lock:
+            for replica in self._replicas:
+                replica.stop()
+            self._replicas = []
+            self._idle = queue.Queue()
+
+    def encode(self, texts: List[str]) -> torch.Tensor:
+        """
+        (len(texts), dim) tensor in input order, encoded by as many idle replicas as the batch has shards
+        """
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        if not texts:
+            return torch.from_numpy(out)
+        self.start()
+
+        # Wait for one replica, then take whichever others are idle right now, up to one per shard
+        wanted = min(self.num_replicas, math.ceil(len(texts) / self.min_shard))
+        replicas = [self._idle.get()]
+        while len(replicas) < wanted:
+            try:
+                replicas.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+        bounds = np.linspace(0, len(texts), len(replicas) + 1).astype(int)
+        errors: List[BaseException] = []
+
+        def run(replica: _Replica, start: int, end: int):
+            try:
+                replica.encode_into(texts[start:end], out[start:end])
+            except (EOFError, OSError) as e:
+                # The process died or its pipe broke; an error reply leaves the replica usable
+                errors.append(RuntimeError(f"Embedding replica {replica.index} is not responding: {e!r}"))
+                self._restart(replica)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [
+            threading.Thread(target=run, args=(replica, int(bounds[idx]), int(bounds[idx + 1])))
+            for idx, replica in enumerate(replicas[1:], start=1)
+        ]
+        for thread in threads:
+            thread.start()
+        # The first shard runs on the calling thread
+        run(replicas[0], int(bounds[0]), int(bounds[1]))
+        for thread in threads:
+            thread.join()
+
+        for replica in replicas:
+            self._idle.put(replica)
+        if errors:
+            raise errors[0]
+        return torch.from_numpy(out)
+
+    def _restart(self, replica: _Replica):
+        # Still handed back as idle if this fails; its next request fails fast and restarts it again
+        logger.warning(f"Restarting embedding replica {replica.index}")
+        replica.stop(timeout=0)
+        try:
+            replica.start(self._context, self.backend_name, self.model_name, self.batch_size)
+            replica.wait_ready()
+        except Exception as e:
+            logger.error(f"Embedding replica {replica.index} failed to restart. Error: {str(e)}", exc_info=True)
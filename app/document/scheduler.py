@@ -0,0 +1,190 @@
+import asyncio
+from collections import deque
+from enum import IntEnum
+from typing import Callable, Deque, Dict, List, Optional, Set
+from app.logger import logger
+import torch
+
+class Priority(IntEnum):
+    SEARCH = 0
+    INGEST = 1
+
+class _Request:
+    """
+    One caller of EmbeddingScheduler.submit, split into segments of at most max_batch_size chunks
+    """
+    __slots__ = ("future", "parts", "remaining")
+
+    def __init__(self, future: asyncio.Future, num_segments: int):
+        self.future = future
+        self.parts: List[Optional[torch.Tensor]] = [None] * num_segments
+        self.remaining = num_segments
+
+class _Segment:
+    __slots__ = ("request", "index", "texts")
+
+    def __init__(self, request: _Request, index: int, texts: List[str]):
+        self.request = request
+        self.index = index
+        self.texts = texts
+
+#---------------------------------------------------------------------------------------------------------------
+
+class EmbeddingScheduler:
+    """
+    Long-lived micro-batcher that collects chunks from all in-flight uploads and searches into shared forward passes.
+    A batch is flushed once it holds max_batch_size chunks or max_wait_ms after its first chunk arrived.
+    Search chunks are always taken before ingest chunks. Up to max_concurrent_batches flushes run at once, for an
+    encode that spreads over several model replicas; while all of them are busy the next batch keeps filling.
+    """
+
+    def __init__(
+        self,
+        encode: Callable[[List[str]], torch.Tensor],
+        max_batch_size: int,
+        max_wait_ms: float,
+        max_concurrent_batches: int = 1,
+    ):
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_concurrent_batches = max(max_concurrent_batches, 1)
+        self._queues: Dict[Priority, Deque[_Segment]] = {priority: deque() for priority in Priority}
+        self._pending_chunks = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._flushes: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def pending_chunks(self) -> int:
+        return self._pending_chunks
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+        self._task = loop.create_task(self._run())
+        logger.info(
+            f"Embedding scheduler started with max_batch_size: {self.max_batch_size}, max_wait_ms: {self.max_wait_ms}, "
+            f"max_concurrent_batches: {self.max_concurrent_batches}"
+        )
+
+    async def stop(self):
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        for flush in list(self._flushes):
+            flush.cancel()
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+
+        # Fail whatever is still queued so no caller waits forever
+        for queue in self._queues.values():
+            while queue:
+                segment = queue.popleft()
+                if not segment.request.future.done():
+                    segment.request.future.set_exception(RuntimeError("Embedding scheduler stopped"))
+        self._pending_chunks = 0
+        logger.info("Embedding scheduler stopped")
+
+    async def submit(self, texts: List[str], priority: Priority = Priority.INGEST) -> torch.Tensor:
+        """
+        Queues texts for embedding and returns their (len(texts), dim) tensor once every batch holding them is flushed
+        """
+        if not texts:
+            return self.encode([])
+
+        self.start()
+        future = self._loop.create_future()
+        starts = range(0, len(texts), self.max_batch_size)
+        request = _Request(future, len(starts))
+
+        for index, start in enumerate(starts):
+            self._queues[priority].append(_Segment(request, index, texts[start:start + self.max_batch_size]))
+        self._pending_chunks += len(texts)
+        self._wakeup.set()
+
+        return await future
+
+    #-----------------------------------------------------------------------------------------------------------
+
+    async def _run(self):
+        while True:
+            if not self._pending_chunks:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+            await self._slots.acquire()
+
+            # Give concurrent callers up to max_wait_ms to fill the batch
+            deadline = self._loop.time() + self.max_wait_ms / 1000
+            while self._pending_chunks < self.max_batch_size:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+
+            flush = self._loop.create_task(self._flush(self._take_batch()))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flush_done)
+
+    def _flush_done(self, flush: asyncio.Task):
+        self._flushes.discard(flush)
+        self._slots.release()
+
+    def _take_batch(self) -> List[_Segment]:
+        segments: List[_Segment] = []
+        size = 0
+        for priority in Priority:
+            queue = self._queues[priority]
+            while queue and (not segments or size + len(queue[0].texts) <= self.max_batch_size):
+                segment = queue.popleft()
+                segments.append(segment)
+                size += len(segment.texts)
+        self._pending_chunks -= size
+        return segments
+
+    async def _flush(self, segments: List[_Segment]):
+        texts = [text for segment in segments for text in segment.texts]
+        logger.debug(f"Flushing embedding batch of {len(texts)} chunks from {len(segments)} segments")
+
+        try:
+            embeddings = await asyncio.to_thread(self.encode, texts)
+        except Exception as e:
+            logger.error(f"Embedding batch of {len(texts)} chunks failed. Error: {str(e)}", exc_info=True)
+            for segment in segments:
+                if not segment.request.future.done():
+                    segment.request.future.set_exception(e)
+            return
+        except asyncio.CancelledError:
+            for segment in segments:
+                if not segment.request.future.done():
+                    segment.request.future.set_exception(RuntimeError("Embedding scheduler stopped"))
+            raise
+
+        offset = 0
+        for segment in segments:
+            request = segment.request
+            request.parts[segment.index] = embeddings[offset:offset + len(segment.texts)]
+            offset += len(segment.texts)
+            request.remaining -= 1
+
+            if request.remaining == 0 and not request.future.done():
+                parts = request.parts
+                request.future.set_result(parts[0] if len(parts) == 1 else torch.cat(parts))
@@ -0,0 +1,89 @@
+# metrics.py
+
+import functools
+import time
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Seconds; pipeline stages range from sub-millisecond routing to minute-long PDF extraction
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+STAGE_SECONDS = Histogram(
+    "chromadb_orm_stage_seconds",
+    "Wall time of one call of a pipeline stage",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+
+CHROMA_CALL_SECONDS = Histogram(
+    "chromadb_orm_chroma_call_seconds",
+    "Wall time of one Chroma client call including retries and executor queueing",
+    ["method"],
+    buckets=LATENCY_BUCKETS,
+)
+
+CHUNKS_TOTAL = Counter(
+    "chromadb_orm_chunks_total",
+    "Chunks that finished a stage: split from an upload, embedded by the model or stored in Chroma",
+    ["stage"],
+)
+
+FILES_TOTAL = Counter(
+    "chromadb_orm_files_total",
+    "Uploaded files by final status",
+    ["status"],
+)
+
+ERRORS_TOTAL = Counter(
+    "chromadb_orm_errors_total",
+    "Errors raised or handled inside a pipeline stage or Chroma call",
+    ["stage"],
+)
+
+IN_FLIGHT_REQUESTS = Gauge(
+    "chromadb_orm_in_flight_requests",
+    "Requests currently being processed",
+    ["route"],
+)
+
+QUEUE_DEPTH = Gauge(
+    "chromadb_orm_queue_depth",
+    "Work waiting for a free worker: Chroma calls, extraction jobs or embedding chunks",
+    ["executor"],
+)
+
+#---------------------------------------------------------------------------------------------------------------
+
+def observe_stage(stage: str):
+    """
+    Decorator for async stage functions: records the call time on STAGE_SECONDS and escaping errors on ERRORS_TOTAL
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception:
+                ERRORS_TOTAL.labels(stage).inc()
+                raise
+            finally:
+                STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def track_in_flight(route: str):
+    """
+    Decorator for async route handlers: counts the request on IN_FLIGHT_REQUESTS while the handler runs.
+    prometheus_client's own track_inprogress() decorator is sync only and would release on coroutine creation.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with IN_FLIGHT_REQUESTS.labels(route).track_inprogress():
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def render_metrics():
+    # (body, content type) of the Prometheus text exposition format
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,80 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+from app.api.routes import router
+from app.db.client import chroma_client,load_centroid_index,reconcile_centroid_index,restore_centroid_index,save_centroid_index
+from app.db.compaction import collection_compactor
+from app.db.executor import chroma_call,chroma_executor
+from app.document.extract import embedding_replicas,embedding_scheduler,extraction_pool,warm_up_embeddings
+from app.document.jobs import ingest_queue
+from app.logger import logger
+
+# "reset" deletes every collection on startup, "persistent" keeps them and restores the routing index instead
+STARTUP_MODE = os.getenv("STARTUP_MODE", "reset")
+if STARTUP_MODE not in ("reset", "persistent"):
+    raise ValueError(f"Unknown STARTUP_MODE '{STARTUP_MODE}'. Use 'reset' or 'persistent'")
+
+async def _run_in_background(name: str, coro):
+    try:
+        await coro
+        logger.info(f"Startup task '{name}' finished")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Startup task '{name}' failed. Error: {str(e)}", exc_info=True)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    background = []
+    if STARTUP_MODE == "reset":
+        # Startup logic - delete all collections
+        collection_names = await chroma_call(chroma_client.list_collections)
+        logger.info(f"Found {len(collection_names)} collections")
+
+        # Delete the collections concurrently, bounded by the Chroma executor pool
+        async def delete_collection(collection_name: str):
+            logger.info(f"Deleting collection: {collection_name}")
+            await chroma_call(chroma_client.delete_collection, name=collection_name)
+
+        await asyncio.gather(*[delete_collection(collection.name) for collection in collection_names])
+
+        # Build the in-process routing index from whatever survived the wipe
+        await load_centroid_index(force=True)
+    else:
+        # Route from the shutdown snapshot right away and catch up with Chroma in the background; without a
+        # snapshot the index loads in the background and the first request that routes waits for it
+        if await asyncio.to_thread(restore_centroid_index):
+            background.append(asyncio.create_task(_run_in_background("reconcile routing index", reconcile_centroid_index())))
+        else:
+            background.append(asyncio.create_task(_run_in_background("load routing index", load_centroid_index(force=True))))
+
+    # Load the model or the replicas off the critical path; GET /ready reports when they are warm
+    background.append(asyncio.create_task(_run_in_background("warm up embeddings", warm_up_embeddings())))
+
+    # Background split / merge compaction backs off while uploads or searches are queued
+    collection_compactor.busy = lambda: embedding_scheduler.pending_chunks > 0 or chroma_executor.queue_depth > 0
+    collection_compactor.start()
+
+    # Drain ingest jobs queued before the last shutdown and any submitted from now on
+    await ingest_queue.start()
+    
+    yield
+    # Shutdown logic - fail any embedding requests still queued and stop extraction workers
+    # Unfinished ingest files stay queued on disk and are picked up on the next start
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    await ingest_queue.stop()
+    await collection_compactor.stop()
+    await embedding_scheduler.stop()
+    if embedding_replicas is not None:
+        embedding_replicas.shutdown()
+    extraction_pool.shutdown()
+    chroma_executor.shutdown()
+    save_centroid_index()
+
+
+app = FastAPI(title="ChromaDB ORM Server", lifespan=lifespan)
+
+app.include_router(router)
@@ -0,0 +1,60 @@
+"""
+Accuracy / throughput comparison of the embedding engines against fp32 torch on the test/docs corpus
+
+    python -m benchmark.backends --engines torch-int8 onnx --threads 8 --tolerance 0.01
+"""
+import argparse
+import json
+import os
+from typing import List
+
+from app.document.backends import BACKENDS, compare_backends
+from app.document.extract import MODEL_NAME, EMBEDDING_BATCH_SIZE, embedding_backend, text_splitter
+from app.document.parsers import extract_bytes
+
+SAMPLE_DIR = "test/docs"
+
+#---------------------------------------------------------------------------------------------------------------
+
+def load_corpus(repeat: int) -> List[str]:
+    chunks = []
+    for filename in sorted(os.listdir(SAMPLE_DIR)):
+        with open(os.path.join(SAMPLE_DIR, filename), "rb") as f:
+            text = extract_bytes(f.read(), os.path.splitext(filename)[1].lower())
+        chunks.extend(text_splitter.split_text(text))
+    return chunks * repeat
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--engines", nargs="+", choices=[name for name in BACKENDS if name != "torch"])
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE)
+    parser.add_argument("--tolerance", type=float, default=0.01)
+    parser.add_argument("--repeat", type=int, default=8, help="repeat the sample corpus to get stable timings")
+    args = parser.parse_args()
+
+    texts = load_corpus(args.repeat)
+
+    # Reuse the already loaded fp32 model as the reference when the server runs the torch engine on CPU
+    reference = embedding_backend if embedding_backend.name == "torch" and embedding_backend.device == "cpu" else None
+    report = compare_backends(
+        texts,
+        model_name=MODEL_NAME,
+        engines=args.engines,
+        num_threads=args.threads,
+        batch_size=args.batch_size,
+        tolerance=args.tolerance,
+        reference=reference,
+    )
+
+    print(f"{'engine':<12} {'chunks/sec':>12} {'cos mean':>10} {'cos min':>10}  ok")
+    for entry in report["engines"]:
+        if "error" in entry:
+            print(f"{entry['engine']:<12} error: {entry['error']}")
+            continue
+        print(f"{entry['engine']:<12} {entry['chunks_per_sec']:>12.1f} {entry['cosine_mean']:>10.5f} {entry['cosine_min']:>10.5f}  {entry['within_tolerance']}")
+    print(f"recommended: {report['recommended']} (tolerance {args.tolerance})")
+    print(json.dumps(report))
+
+if __name__ == "__main__":
+    main()
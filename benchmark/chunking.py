@@ -0,0 +1,126 @@
+"""
+Text normalization and chunking: the four-pass regex clean_text and langchain's RecursiveCharacterTextSplitter vs
+parsers.clean_text and RecursiveChunker. Checks both produce identical output on every input, exits 1 otherwise.
+
+    python -m benchmark.chunking --mb 1 8 32 --repeat 3
+"""
+import argparse
+import random
+import re
+import sys
+import time
+from typing import Callable, List, Tuple
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from app.document.chunker import RecursiveChunker
+from app.document.parsers import clean_text, process_docx, process_pdf
+from benchmark.corpus import generate_paragraphs, load_vocabulary
+
+SAMPLE_DIR = "test/docs"
+
+# Settings of app.document.extract.text_splitter; importing it would load the embedding model
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+SEPARATORS = ["\n\n", "\n", ".", " ", ""]
+
+#---------------------------------------------------------------------------------------------------------------
+
+def reference_clean_text(text: str) -> str:
+    # clean_text before the single-pass rewrite
+    text = re.sub(r'\\[nrtfbv]', ' ', text)
+    text = re.sub(r'[\n\r\t\f\v]', ' ', text)
+    text = re.sub(r'\\x[0-9a-fA-F]{2}', '', text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+def load_samples() -> List[Tuple[str, str]]:
+    with open(f"{SAMPLE_DIR}/sample.txt", "rb") as f:
+        samples = [("sample.txt", f.read().decode("utf-8", errors="ignore"))]
+    with open(f"{SAMPLE_DIR}/sample.pdf", "rb") as f:
+        samples.append(("sample.pdf", process_pdf(f)))
+    with open(f"{SAMPLE_DIR}/sample.docx", "rb") as f:
+        samples.append(("sample.docx", process_docx(f)))
+    return samples
+
+def synthetic_prose(megabytes: float, seed: int) -> str:
+    rng = random.Random(seed)
+    vocabulary = load_vocabulary()
+    # About 8 characters per word with the separator
+    paragraphs = generate_paragraphs(rng, vocabulary, int(megabytes * 1024 * 1024 / 8))
+    return "\n\n".join(paragraphs)
+
+def synthetic_noisy(megabytes: float, seed: int) -> str:
+    """
+    Extraction-like noise: literal and hex escapes, control characters, runs of blanks, and long tokens
+    without separators that force the word and character levels of the splitter
+    """
+    rng = random.Random(seed)
+    vocabulary = load_vocabulary()
+    noise = ["\\n", "\\t", "\\x0c", "\\xa0", "\t", "\r\n", "\f", "   ", " \\n ", "\n\n"]
+    parts, size = [], 0
+    while size < megabytes * 1024 * 1024:
+        roll = rng.random()
+        if roll < 0.02:
+            part = "".join(rng.choice(vocabulary) for _ in range(rng.randint(100, 400)))
+        elif roll < 0.15:
+            part = rng.choice(noise)
+        elif roll < 0.25:
+            part = rng.choice(vocabulary).capitalize() + "."
+        else:
+            part = rng.choice(vocabulary)
+        parts.append(part)
+        parts.append(" ")
+        size += len(part) + 1
+    return "".join(parts)
+
+#---------------------------------------------------------------------------------------------------------------
+
+def best_of(fn: Callable, arg, repeat: int) -> Tuple[float, object]:
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(arg)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+def run(name: str, text: str, repeat: int, reference_splitter, splitter) -> bool:
+    clean_ref_ms, cleaned_ref = best_of(reference_clean_text, text, repeat)
+    clean_ms, cleaned = best_of(clean_text, text, repeat)
+    split_ref_ms, chunks_ref = best_of(reference_splitter.split_text, cleaned_ref, repeat)
+    split_ms, chunks = best_of(splitter.split_text, cleaned, repeat)
+    # The splitter also sees raw text (search queries), where the paragraph and line levels apply
+    raw_equal = reference_splitter.split_text(text) == splitter.split_text(text)
+
+    equal = cleaned == cleaned_ref and chunks == chunks_ref and raw_equal
+    total_ref, total = clean_ref_ms + split_ref_ms, clean_ms + split_ms
+    print(f"{name:<22} {len(text) / 1e6:>8.2f} {len(chunks):>8} "
+          f"{clean_ref_ms:>10.1f} {clean_ms:>10.1f} {split_ref_ms:>10.1f} {split_ms:>10.1f} "
+          f"{total_ref / total:>8.2f}x  {'identical' if equal else 'MISMATCH'}")
+    return equal
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mb", type=float, nargs="+", default=[1, 8, 32], help="sizes of the synthetic inputs")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    reference_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, separators=SEPARATORS)
+    splitter = RecursiveChunker(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, separators=SEPARATORS)
+
+    inputs = load_samples()
+    for megabytes in args.mb:
+        inputs.append((f"prose-{megabytes:g}mb", synthetic_prose(megabytes, args.seed)))
+        inputs.append((f"noisy-{megabytes:g}mb", synthetic_noisy(megabytes, args.seed)))
+
+    print(f"{'input':<22} {'MB':>8} {'chunks':>8} {'clean ref':>10} {'clean':>10} {'split ref':>10} {'split':>10} {'speedup':>9}")
+    identical = [run(name, text, args.repeat, reference_splitter, splitter) for name, text in inputs]
+
+    if not all(identical):
+        print("\nOutput differs from the reference implementation")
+        sys.exit(1)
+    print("\nAll inputs produce identical cleaned text and chunks")
+
+if __name__ == "__main__":
+    main()
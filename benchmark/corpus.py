@@ -0,0 +1,144 @@
+"""
+Synthetic txt / pdf / docx corpus for the benchmarks, built from the vocabulary of the test/docs samples
+
+    python -m benchmark.corpus --docs 30 --words 2000 --formats txt pdf docx --out /tmp/corpus
+"""
+import argparse
+import io
+import os
+import random
+import re
+from typing import List, Tuple
+
+from docx import Document
+
+SAMPLE_FILE = "test/docs/sample.txt"
+FORMATS = ("txt", "pdf", "docx")
+
+# PDF layout: Helvetica 10pt on US Letter
+_PDF_LINES_PER_PAGE = 60
+_PDF_WORDS_PER_LINE = 12
+
+#---------------------------------------------------------------------------------------------------------------
+
+def load_vocabulary() -> List[str]:
+    with open(SAMPLE_FILE, encoding="utf-8", errors="ignore") as f:
+        words = re.findall(r"[A-Za-z][A-Za-z'-]+", f.read())
+    return sorted({word.lower() for word in words})
+
+def generate_paragraphs(rng: random.Random, vocabulary: List[str], num_words: int) -> List[str]:
+    """
+    num_words words as sentences of 8-25 words, grouped into paragraphs of 3-8 sentences
+    """
+    paragraphs, sentences = [], []
+    remaining = num_words
+    target_sentences = rng.randint(3, 8)
+
+    while remaining > 0:
+        length = min(remaining, rng.randint(8, 25))
+        words = [rng.choice(vocabulary) for _ in range(length)]
+        sentences.append(" ".join(words).capitalize() + ".")
+        remaining -= length
+
+        if len(sentences) == target_sentences or remaining == 0:
+            paragraphs.append(" ".join(sentences))
+            sentences = []
+            target_sentences = rng.randint(3, 8)
+    return paragraphs
+
+#---------------------------------------------------------------------------------------------------------------
+
+def to_txt(paragraphs: List[str]) -> bytes:
+    return "\n\n".join(paragraphs).encode("utf-8")
+
+def to_docx(paragraphs: List[str]) -> bytes:
+    document = Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def to_pdf(paragraphs: List[str]) -> bytes:
+    """
+    Minimal uncompressed PDF with one text stream per page, written by hand so no PDF writer is needed
+    """
+    lines: List[str] = []
+    for paragraph in paragraphs:
+        words = paragraph.split()
+        lines.extend(" ".join(words[i:i + _PDF_WORDS_PER_LINE]) for i in range(0, len(words), _PDF_WORDS_PER_LINE))
+        lines.append("")
+    pages = [lines[i:i + _PDF_LINES_PER_PAGE] for i in range(0, len(lines), _PDF_LINES_PER_PAGE)] or [[]]
+
+    # Objects 1-3 are catalog, page tree and font, then a (page, content) pair per page
+    page_ids = [4 + 2 * idx for idx in range(len(pages))]
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{pid} 0 R' for pid in page_ids)}] /Count {len(pages)} >>".encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for page_id, page_lines in zip(page_ids, pages):
+        stream = "BT /F1 10 Tf 12 TL 50 750 Td " + " ".join(f"({_pdf_escape(line)}) '" for line in page_lines) + " ET"
+        stream = stream.encode("latin-1", errors="replace")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>".encode()
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    out.write(b"".join(b"%010d 00000 n \n" % offset for offset in offsets))
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+WRITERS = {"txt": to_txt, "pdf": to_pdf, "docx": to_docx}
+
+def generate_corpus(num_docs: int, num_words: int, formats=FORMATS, seed: int = 0) -> List[Tuple[str, bytes]]:
+    """
+    (filename, file bytes) for num_docs documents of about num_words words each, cycling through formats
+    """
+    rng = random.Random(seed)
+    vocabulary = load_vocabulary()
+    corpus = []
+    for idx in range(num_docs):
+        ext = formats[idx % len(formats)]
+        paragraphs = generate_paragraphs(rng, vocabulary, num_words)
+        corpus.append((f"synthetic-{idx:05d}.{ext}", WRITERS[ext](paragraphs)))
+    return corpus
+
+def generate_queries(num_queries: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed + 1)
+    vocabulary = load_vocabulary()
+    return [" ".join(rng.choice(vocabulary) for _ in range(rng.randint(3, 12))) for _ in range(num_queries)]
+
+#---------------------------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--docs", type=int, default=30)
+    parser.add_argument("--words", type=int, default=2000, help="words per document")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", required=True, help="directory to write the files to")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    corpus = generate_corpus(args.docs, args.words, args.formats, args.seed)
+    for filename, data in corpus:
+        with open(os.path.join(args.out, filename), "wb") as f:
+            f.write(data)
+    print(f"Wrote {len(corpus)} files ({sum(len(data) for _, data in corpus) / 1e6:.1f} MB) to {args.out}")
+
+if __name__ == "__main__":
+    main()
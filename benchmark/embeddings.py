@@ -0,0 +1,70 @@
+"""
+Embedding stage throughput: one model.encode call per chunk vs batched encoding
+
+    python -m benchmark.embeddings --chunks 256 --batch-size 32
+"""
+import argparse
+import random
+import time
+from typing import List
+
+import torch
+
+from app.document.extract import _generate_embeddings, embedding_backend, text_splitter
+
+SAMPLE_FILE = "test/docs/sample.txt"
+
+#---------------------------------------------------------------------------------------------------------------
+
+def load_chunks(num_chunks: int, seed: int = 0) -> List[str]:
+    """
+    Builds num_chunks chunks of mixed length from the sample text
+    """
+    with open(SAMPLE_FILE, encoding="utf-8", errors="ignore") as f:
+        words = f.read().split()
+
+    rng = random.Random(seed)
+    chunks = []
+    while len(chunks) < num_chunks:
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(20, 180)))
+        chunks.extend(text_splitter.split_text(text))
+    return chunks[:num_chunks]
+
+def per_chunk_embeddings(texts: List[str]) -> torch.Tensor:
+    # Previous behaviour: one forward pass per chunk
+    return torch.stack([embedding_backend.model.encode(text, convert_to_tensor=True) for text in texts])
+
+def measure(fn, texts: List[str], repeats: int) -> float:
+    fn(texts[:4])  # warm up
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(texts)
+        best = min(best, time.perf_counter() - start)
+    return len(texts) / best
+
+#---------------------------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    texts = load_chunks(args.chunks)
+
+    before = measure(per_chunk_embeddings, texts, args.repeats)
+    after = measure(lambda t: _generate_embeddings(t, batch_size=args.batch_size), texts, args.repeats)
+
+    agreement = torch.nn.functional.cosine_similarity(
+        per_chunk_embeddings(texts), _generate_embeddings(texts, batch_size=args.batch_size), dim=1
+    ).min().item()
+
+    print(f"chunks: {len(texts)}  batch_size: {args.batch_size}")
+    print(f"per-chunk encode : {before:10.1f} chunks/sec")
+    print(f"batched encode   : {after:10.1f} chunks/sec  ({after / before:.2f}x)")
+    print(f"min cosine agreement: {agreement:.6f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Collection routing latency and recall: exact centroid scan vs the HNSW candidate index
+
+    python -m benchmark.routing --collections 20000 --dim 768 --queries 500 --k 5
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.db.index import AnnIndex, CentroidIndex
+
+#---------------------------------------------------------------------------------------------------------------
+
+def build(index: CentroidIndex, centroids: np.ndarray) -> float:
+    start = time.perf_counter()
+    for idx, centroid in enumerate(centroids):
+        index.upsert(f"collection-{idx}", centroid)
+    return time.perf_counter() - start
+
+def measure(index: CentroidIndex, queries: np.ndarray, k: int) -> float:
+    start = time.perf_counter()
+    for query in queries:
+        index.top_k(query, k=k)
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--collections", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--noise", type=float, default=0.3, help="query distance from its source centroid")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    centroids = rng.standard_normal((args.collections, args.dim)).astype(np.float32)
+    sources = rng.integers(0, args.collections, args.queries)
+    queries = centroids[sources] + args.noise * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+
+    exact = CentroidIndex()
+    approximate = CentroidIndex(ann=AnnIndex(), ann_min_collections=0)
+    exact_build, ann_build = build(exact, centroids), build(approximate, centroids)
+
+    exact_ms, ann_ms = measure(exact, queries, args.k), measure(approximate, queries, args.k)
+
+    recall = np.mean([
+        len({name for name, _ in exact.top_k(query, args.k)} & {name for name, _ in approximate.top_k(query, args.k)}) / args.k
+        for query in queries
+    ])
+
+    print(f"collections: {args.collections}  dim: {args.dim}  k: {args.k}")
+    print(f"exact scan : build {exact_build:8.2f}s  {exact_ms:8.3f} ms/query")
+    print(f"hnsw       : build {ann_build:8.2f}s  {ann_ms:8.3f} ms/query  ({exact_ms / ann_ms:.1f}x)  recall@{args.k} {recall:.4f}")
+
+if __name__ == "__main__":
+    main()
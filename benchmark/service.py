@@ -0,0 +1,293 @@
+"""
+End-to-end /upload and /search/ benchmark: runs the FastAPI app in-process against an in-process Chroma client
+
+    python -m benchmark.service --docs 60 --words 2000 --files-per-request 4 --queries 200 --out bench.json
+    python -m benchmark.service --chroma persistent --baseline previous.json --out bench.json
+"""
+import argparse
+import functools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from benchmark.corpus import FORMATS, generate_corpus, generate_queries
+
+# Route-level calls timed per document / query chunk, in pipeline order
+UPLOAD_STAGES = ("process_file", "process_text", "process_embeddings_batch")
+SEARCH_STAGES = ("process_text", "update_query_centroid", "update_top_k_collections", "update_top_k_documents")
+
+# Metrics compared against --baseline, with True when higher is better
+HEADLINE_METRICS = {
+    "upload.docs_per_sec": True,
+    "upload.chunks_per_sec": True,
+    "upload.latency_ms.p95": False,
+    "search.queries_per_sec": True,
+    "search.latency_ms.p95": False,
+    "peak_rss_mb": False,
+}
+
+_MIME_TYPES = {
+    "txt": "text/plain",
+    "pdf": "application/pdf",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
+
+#---------------------------------------------------------------------------------------------------------------
+
+def latency_summary(samples_ms: List[float]) -> Dict[str, float]:
+    if not samples_ms:
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(samples_ms, [50, 95, 99])
+    return {
+        "count": len(samples_ms),
+        "mean": round(float(np.mean(samples_ms)), 3),
+        "p50": round(float(p50), 3),
+        "p95": round(float(p95), 3),
+        "p99": round(float(p99), 3),
+        "max": round(float(np.max(samples_ms)), 3),
+    }
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class StageTimer:
+    """
+    Wraps the stage coroutines the routes call so every call records its wall time under the stage name
+    """
+    def __init__(self, module, stages):
+        self.module = module
+        self.samples: Dict[str, List[float]] = {stage: [] for stage in stages}
+        self._originals = {stage: getattr(module, stage) for stage in stages}
+
+    def __enter__(self):
+        for stage, fn in self._originals.items():
+            setattr(self.module, stage, self._timed(stage, fn))
+        return self
+
+    def __exit__(self, *exc):
+        for stage, fn in self._originals.items():
+            setattr(self.module, stage, fn)
+
+    def _timed(self, stage, fn):
+        @functools.wraps(fn)
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                self.samples[stage].append((time.perf_counter() - start) * 1000)
+        return timed
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {stage: latency_summary(samples) for stage, samples in self.samples.items()}
+
+#---------------------------------------------------------------------------------------------------------------
+
+def run_upload(client, routes, corpus, files_per_request: int) -> Dict:
+    latencies, failed, chunks = [], 0, 0
+
+    with StageTimer(routes, UPLOAD_STAGES) as timer:
+        start = time.perf_counter()
+        for batch_start in range(0, len(corpus), files_per_request):
+            files = [
+                ("files", (filename, data, _MIME_TYPES[filename.rsplit(".", 1)[1]]))
+                for filename, data in corpus[batch_start:batch_start + files_per_request]
+            ]
+            request_start = time.perf_counter()
+            response = client.post("/upload", files=files)
+            latencies.append((time.perf_counter() - request_start) * 1000)
+            response.raise_for_status()
+
+            for document in response.json()["state"]:
+                if document["status"]["status"] != "success":
+                    failed += 1
+                    continue
+                chunks += document["embedding"]["vectordb_embeddings"]
+        elapsed = time.perf_counter() - start
+
+    return {
+        "requests": len(latencies),
+        "docs": len(corpus),
+        "failed_docs": failed,
+        "chunks": chunks,
+        "bytes": sum(len(data) for _, data in corpus),
+        "elapsed_s": round(elapsed, 3),
+        "docs_per_sec": round(len(corpus) / elapsed, 3),
+        "chunks_per_sec": round(chunks / elapsed, 3),
+        "latency_ms": latency_summary(latencies),
+        "stages_ms": timer.summary(),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def run_search(client, routes, queries: List[str], top_k_collections: int, top_k_documents: int) -> Dict:
+    latencies, empty = [], 0
+
+    with StageTimer(routes, SEARCH_STAGES) as timer:
+        start = time.perf_counter()
+        for query in queries:
+            request_start = time.perf_counter()
+            response = client.post("/search/", json={
+                "query": query,
+                "top_k_collections": top_k_collections,
+                "top_k_documents": top_k_documents,
+            })
+            latencies.append((time.perf_counter() - request_start) * 1000)
+            response.raise_for_status()
+
+            if not any(chunk["top_k_results"] for chunk in response.json()["state"]):
+                empty += 1
+        elapsed = time.perf_counter() - start
+
+    return {
+        "queries": len(queries),
+        "empty_results": empty,
+        "elapsed_s": round(elapsed, 3),
+        "queries_per_sec": round(len(queries) / elapsed, 3),
+        "latency_ms": latency_summary(latencies),
+        "stages_ms": timer.summary(),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+#---------------------------------------------------------------------------------------------------------------
+
+def wait_until_ready(client, timeout_s: float = 600.0) -> float:
+    """
+    Polls GET /ready until the model is warm and the routing index is loaded, so loading is not timed as traffic
+    """
+    start = time.perf_counter()
+    while client.get("/ready").status_code != 200:
+        if time.perf_counter() - start > timeout_s:
+            raise TimeoutError(f"Service not ready after {timeout_s}s")
+        time.sleep(0.1)
+    return time.perf_counter() - start
+
+def _lookup(report: Dict, dotted: str) -> Optional[float]:
+    value = report
+    for key in dotted.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+def compare(report: Dict, baseline: Dict) -> Dict[str, Dict]:
+    """
+    Relative change of the headline metrics against a previous report, positive change_pct is an improvement
+    """
+    deltas = {}
+    for metric, higher_is_better in HEADLINE_METRICS.items():
+        current, previous = _lookup(report, metric), _lookup(baseline, metric)
+        if not current or not previous:
+            continue
+        change = (current - previous) / previous * 100
+        deltas[metric] = {
+            "baseline": previous,
+            "current": current,
+            "change_pct": round(change if higher_is_better else -change, 2),
+        }
+    return deltas
+
+def print_report(report: Dict):
+    upload, search = report["upload"], report["search"]
+    print(f"upload : {upload['docs']} docs, {upload['chunks']} chunks in {upload['elapsed_s']}s  "
+          f"{upload['docs_per_sec']} docs/sec  {upload['chunks_per_sec']} chunks/sec  failed {upload['failed_docs']}")
+    print(f"search : {search['queries']} queries in {search['elapsed_s']}s  {search['queries_per_sec']} queries/sec  "
+          f"empty {search['empty_results']}")
+
+    print(f"\n{'latency (ms)':<34} {'p50':>10} {'p95':>10} {'p99':>10}")
+    rows = [("upload request", upload["latency_ms"])]
+    rows += [(f"  upload.{stage}", stats) for stage, stats in upload["stages_ms"].items()]
+    rows += [("search request", search["latency_ms"])]
+    rows += [(f"  search.{stage}", stats) for stage, stats in search["stages_ms"].items()]
+    for name, stats in rows:
+        if stats["count"]:
+            print(f"{name:<34} {stats['p50']:>10.2f} {stats['p95']:>10.2f} {stats['p99']:>10.2f}")
+
+    print(f"\npeak RSS: {report['peak_rss_mb']} MB")
+
+    for metric, delta in report.get("baseline", {}).items():
+        print(f"{metric:<24} {delta['baseline']:>12} -> {delta['current']:>12}  ({delta['change_pct']:+.2f}%)")
+
+#---------------------------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=30)
+    parser.add_argument("--words", type=int, default=2000, help="words per document")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--files-per-request", type=int, default=1)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k-collections", type=int, default=3)
+    parser.add_argument("--top-k-documents", type=int, default=5)
+    parser.add_argument("--chroma", choices=["ephemeral", "persistent"], default="ephemeral")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", help="previous report to compare the headline metrics against")
+    parser.add_argument("--out", default="bench_output.json", help="JSON report path")
+    args = parser.parse_args()
+
+    # The Chroma client is created at import time, so the mode has to be set before the app is imported
+    os.environ["CHROMA_MODE"] = args.chroma
+    chroma_dir = tempfile.TemporaryDirectory(prefix="chroma-bench-") if args.chroma == "persistent" else None
+    if chroma_dir is not None:
+        os.environ["CHROMA_PATH"] = chroma_dir.name
+
+    from fastapi.testclient import TestClient
+    import app.api.routes as routes
+    from app.document.extract import embedding_backend
+    from main import app
+
+    corpus = generate_corpus(args.docs, args.words, args.formats, args.seed)
+    queries = generate_queries(args.queries, args.seed)
+
+    try:
+        # Entering the client runs the lifespan: empty Chroma, empty routing index, model warming up in the background
+        with TestClient(app) as client:
+            ready_s = wait_until_ready(client)
+            upload = run_upload(client, routes, corpus, args.files_per_request)
+            search = run_search(client, routes, queries, args.top_k_collections, args.top_k_documents)
+    finally:
+        if chroma_dir is not None:
+            chroma_dir.cleanup()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "embedding_backend": embedding_backend.name,
+        "config": vars(args),
+        "ready_s": round(ready_s, 3),
+        "upload": upload,
+        "search": search,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["baseline"] = compare(report, json.load(f))
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print_report(report)
+    print(f"\nReport written to {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,10 @@
-from contextlib import asynccontextmanager
-from fastapi import FastAPI
-from app.api.routes import router
-from app.db.client import chroma_client
-from app.logger import logger
-
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Startup logic - delete all collections
-    collection_names = chroma_client.list_collections()
-    logger.info(f"Found {len(collection_names)} collections")
-
-    # Delete each collection
-    for collection in collection_names:
-        collection_name = collection.name
-        logger.info(f"Deleting collection: {collection_name}")
-        chroma_client.delete_collection(name=collection_name)
-    
-    yield
-    # Shutdown logic (if needed) would go here
-
-
-app = FastAPI(title="ChromaDB ORM Server", lifespan=lifespan)
-
-app.include_router(router)
+# Entry point: uvicorn main:app, or python main.py
+#
+# Spawned worker processes (the extraction pool, the embedding replicas) re-run this file as __mp_main__ before they
+# start. The app is only imported outside of them, so workers do not pull in routes, torch or the Chroma client.
+if __name__ != "__mp_main__":
+    from app.server import app
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=9000, reload=True)
\ No newline at end of file
+    uvicorn.run("main:app", host="0.0.0.0", port=9000, reload=True)
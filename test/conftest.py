@@ -0,0 +1,4 @@
+import os
+
+# Tests that import app.db use an in-process Chroma client instead of a server
+os.environ.setdefault("CHROMA_MODE", "ephemeral")
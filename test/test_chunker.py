@@ -0,0 +1,90 @@
+"""
+RecursiveChunker and clean_text must produce exactly what langchain's RecursiveCharacterTextSplitter and the
+regex clean_text they replaced produce. benchmark/chunking.py measures the speed-up on large inputs.
+"""
+import random
+import re
+
+import pytest
+
+text_splitters = pytest.importorskip("langchain_text_splitters")
+
+from app.document.chunker import RecursiveChunker
+
+SAMPLE_DIR = "test/docs"
+
+# Settings of app.document.extract.text_splitter
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+SEPARATORS = ["\n\n", "\n", ".", " ", ""]
+
+def reference_splitter(chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP):
+    return text_splitters.RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=SEPARATORS)
+
+def reference_clean_text(text: str) -> str:
+    # clean_text before the single-pass rewrite
+    text = re.sub(r'\\[nrtfbv]', ' ', text)
+    text = re.sub(r'[\n\r\t\f\v]', ' ', text)
+    text = re.sub(r'\\x[0-9a-fA-F]{2}', '', text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+def random_text(rng: random.Random, length: int) -> str:
+    alphabet = ["a", "b", "c", "word", "longerword", " ", "  ", ".", "\n", "\n\n", "\t", "\\n", "\\x0c", "\\", "x"]
+    return "".join(rng.choice(alphabet) for _ in range(length))
+
+#---------------------------------------------------------------------------------------------------------------
+
+EDGE_CASES = {
+    "empty": "",
+    "whitespace only": " \n\n \t ",
+    "single short word": "word",
+    "no separators": "x" * 3500,
+    "single long word in prose": "short words here " + "y" * 2500 + " and after it",
+    "only sentence breaks": ".".join(["sentence"] * 400),
+    "only line breaks": "\n".join(["line of text"] * 300),
+    "paragraphs": "\n\n".join(["A paragraph. With two sentences."] * 120),
+    "exactly chunk size": "z" * CHUNK_SIZE,
+    "one over chunk size": "z" * (CHUNK_SIZE + 1),
+}
+
+@pytest.mark.parametrize("name", list(EDGE_CASES))
+def test_chunker_matches_langchain_on_edge_cases(name):
+    text = EDGE_CASES[name]
+    chunker = RecursiveChunker(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, separators=SEPARATORS)
+    assert chunker.split_text(text) == reference_splitter().split_text(text)
+
+def test_chunker_matches_langchain_on_sample_text():
+    with open(f"{SAMPLE_DIR}/sample.txt", "rb") as f:
+        text = f.read().decode("utf-8", errors="ignore")
+    chunker = RecursiveChunker(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, separators=SEPARATORS)
+    assert chunker.split_text(text) == reference_splitter().split_text(text)
+
+@pytest.mark.parametrize("sample", ["sample.pdf", "sample.docx"])
+def test_chunker_matches_langchain_on_extracted_samples(sample):
+    parsers = pytest.importorskip("app.document.parsers")
+
+    with open(f"{SAMPLE_DIR}/{sample}", "rb") as f:
+        text = parsers.process_pdf(f) if sample.endswith(".pdf") else parsers.process_docx(f)
+    chunker = RecursiveChunker(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, separators=SEPARATORS)
+    assert chunker.split_text(text) == reference_splitter().split_text(text)
+
+@pytest.mark.parametrize("chunk_size,chunk_overlap", [(1, 0), (2, 1), (7, 3), (50, 0), (50, 49), (CHUNK_SIZE, CHUNK_OVERLAP)])
+def test_chunker_matches_langchain_on_random_text(chunk_size, chunk_overlap):
+    rng = random.Random(chunk_size * 1000 + chunk_overlap)
+    chunker = RecursiveChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=SEPARATORS)
+    reference = reference_splitter(chunk_size, chunk_overlap)
+    for _ in range(50):
+        text = random_text(rng, rng.randint(0, 800))
+        assert chunker.split_text(text) == reference.split_text(text)
+
+def test_chunker_rejects_overlap_larger_than_chunk_size():
+    with pytest.raises(ValueError):
+        RecursiveChunker(chunk_size=10, chunk_overlap=11, separators=SEPARATORS)
+
+def test_clean_text_matches_regex_reference():
+    parsers = pytest.importorskip("app.document.parsers")
+
+    rng = random.Random(0)
+    for text in list(EDGE_CASES.values()) + [random_text(rng, rng.randint(0, 500)) for _ in range(200)]:
+        assert parsers.clean_text(text) == reference_clean_text(text)
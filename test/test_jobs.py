@@ -0,0 +1,50 @@
+"""
+The ingest workers must survive a failing iteration: the error is logged and counted, and the worker keeps claiming
+queued files after poll_s.
+"""
+import asyncio
+import io
+import sqlite3
+
+import pytest
+
+pytest.importorskip("fastapi")
+jobs = pytest.importorskip("app.document.jobs")
+
+from fastapi import UploadFile
+
+def test_worker_recovers_when_claim_fails(tmp_path):
+    async def run():
+        queue = jobs.IngestQueue(spool_dir=str(tmp_path), num_workers=1, batch_files=4, poll_s=0.01, job_ttl_s=0, prune_interval_s=1)
+        store = await queue._get_store()
+
+        claim = store.claim
+        calls = []
+        def flaky_claim(limit):
+            calls.append(limit)
+            if len(calls) == 1:
+                raise sqlite3.OperationalError("database is locked")
+            return claim(limit)
+        store.claim = flaky_claim
+
+        async def process(rows):
+            # Skips extraction and embedding, only the worker loop is under test
+            return {row[0]: {"status": {"status": "success", "error": None}} for row in rows}
+        queue._process = process
+
+        await queue.start()
+        try:
+            job_id = await queue.submit([UploadFile(file=io.BytesIO(b"some text"), filename="a.txt")])
+            for _ in range(500):
+                status = await queue.status(job_id)
+                if status["state"] == jobs.DONE:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await queue.stop()
+        return calls, status
+
+    calls, status = asyncio.run(run())
+    assert len(calls) > 1
+    assert status["state"] == jobs.DONE
+    assert status["failed"] == 0
@@ -0,0 +1,71 @@
+"""
+EmbeddingScheduler must take search chunks before ingest chunks and hand every caller exactly the rows of its own
+texts, however the texts were spread over the shared batches. The encode function is a stub, no model is loaded.
+"""
+import asyncio
+import random
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from app.document.scheduler import EmbeddingScheduler, Priority
+
+class StubEncoder:
+    """
+    Embeds the numeric text "7" as the row [7.0, 14.0] and records every batch it was called with
+    """
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        return torch.tensor([[float(text), 2.0 * float(text)] for text in texts])
+
+def expected_rows(texts):
+    return [[float(text), 2.0 * float(text)] for text in texts]
+
+#---------------------------------------------------------------------------------------------------------------
+
+def test_search_chunks_are_batched_before_ingest_chunks():
+    encode = StubEncoder()
+
+    async def run():
+        scheduler = EmbeddingScheduler(encode=encode, max_batch_size=4, max_wait_ms=50)
+        try:
+            # The ingest request is queued first and fills two batches on its own
+            ingest = [str(idx) for idx in range(8)]
+            search = ["100", "101"]
+            await asyncio.gather(
+                scheduler.submit(ingest, priority=Priority.INGEST),
+                scheduler.submit(search, priority=Priority.SEARCH),
+            )
+        finally:
+            await scheduler.stop()
+
+    asyncio.run(run())
+    assert encode.batches[0] == ["100", "101"]
+    assert [text for batch in encode.batches[1:] for text in batch] == [str(idx) for idx in range(8)]
+
+def test_every_caller_gets_the_rows_of_its_own_texts():
+    encode = StubEncoder()
+    rng = random.Random(0)
+    requests = []
+    for caller in range(12):
+        # Some requests span several batches, some share a batch with others
+        texts = [str(caller * 1000 + idx) for idx in range(rng.randint(1, 11))]
+        requests.append((texts, Priority.SEARCH if caller % 3 == 0 else Priority.INGEST))
+
+    async def run():
+        scheduler = EmbeddingScheduler(encode=encode, max_batch_size=5, max_wait_ms=5, max_concurrent_batches=2)
+        try:
+            return await asyncio.gather(*[scheduler.submit(texts, priority=priority) for texts, priority in requests])
+        finally:
+            await scheduler.stop()
+
+    results = asyncio.run(run())
+    assert any(len({int(text) // 1000 for text in batch}) > 1 for batch in encode.batches)
+    for (texts, _), rows in zip(requests, results):
+        assert np.asarray(rows).tolist() == expected_rows(texts)
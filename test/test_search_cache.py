@@ -0,0 +1,82 @@
+"""
+SearchCache must stop serving an entry once any collection it was routed to is written or routing membership
+changes, and must stay within its byte budget by evicting the least recently used entries.
+"""
+from app.api.request import create_search_document
+from app.api.search_cache import SearchCache
+from app.db.index import CollectionVersions
+
+def routed_documents(query: str, collections):
+    document = create_search_document(query)
+    document.top_k_collections = list(collections)
+    document.top_k_results = [f"result for {query} from {name}" for name in collections]
+    return [document]
+
+#---------------------------------------------------------------------------------------------------------------
+
+def test_entry_is_not_served_after_a_routed_collection_changes():
+    versions = CollectionVersions()
+    cache = SearchCache(versions=versions, max_bytes=1 << 20)
+    key = SearchCache.key("what  is\tthe centroid", 2, 3)
+    documents = routed_documents("what is the centroid", ["a", "b"])
+    cache.put(key, documents, versions.clock)
+
+    assert cache.get(SearchCache.key("what is the centroid", 2, 3)) is documents
+
+    # A collection the search did not read leaves the entry valid
+    versions.bump("c")
+    assert cache.get(key) is documents
+
+    versions.bump("b")
+    assert cache.get(key) is None
+    assert cache.stats()["stale"] == 1
+    assert cache.stats()["entries"] == 0
+
+def test_entry_is_not_served_after_routing_membership_changes():
+    versions = CollectionVersions()
+    cache = SearchCache(versions=versions, max_bytes=1 << 20)
+    key = SearchCache.key("query", 1, 1)
+    cache.put(key, routed_documents("query", ["a"]), versions.clock)
+
+    versions.bump_membership()
+    assert cache.get(key) is None
+
+def test_write_racing_the_search_invalidates_the_entry():
+    versions = CollectionVersions()
+    cache = SearchCache(versions=versions, max_bytes=1 << 20)
+    key = SearchCache.key("query", 1, 1)
+
+    # Clock read before routing; the write lands while the search runs
+    clock = versions.clock
+    versions.bump("a")
+    cache.put(key, routed_documents("query", ["a"]), clock)
+    assert cache.get(key) is None
+
+def test_byte_budget_evicts_least_recently_used_entries():
+    versions = CollectionVersions()
+    probe = SearchCache(versions=versions, max_bytes=1 << 20)
+    probe.put(SearchCache.key("query 0", 1, 1), routed_documents("query 0", ["a"]), versions.clock)
+    size = probe.stats()["bytes"]
+
+    cache = SearchCache(versions=versions, max_bytes=2 * size)
+    keys = [SearchCache.key(f"query {idx}", 1, 1) for idx in range(3)]
+    cache.put(keys[0], routed_documents("query 0", ["a"]), versions.clock)
+    cache.put(keys[1], routed_documents("query 1", ["a"]), versions.clock)
+
+    # Touching the first entry makes the second one the least recently used
+    assert cache.get(keys[0]) is not None
+    cache.put(keys[2], routed_documents("query 2", ["a"]), versions.clock)
+
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["bytes"] <= cache.max_bytes
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[2]) is not None
+
+def test_entry_larger_than_the_budget_is_not_cached():
+    versions = CollectionVersions()
+    cache = SearchCache(versions=versions, max_bytes=100)
+    key = SearchCache.key("query", 1, 1)
+    cache.put(key, routed_documents("query", ["a"]), versions.clock)
+    assert cache.get(key) is None
+    assert cache.stats()["bytes"] == 0
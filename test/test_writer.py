@@ -0,0 +1,152 @@
+"""
+The running centroid sums the collection writers keep must match the chunks a collection actually holds. The
+writers run against an in-memory stand-in for a Chroma collection, no server is needed.
+"""
+import asyncio
+import itertools
+
+import numpy as np
+import pytest
+
+writer = pytest.importorskip("app.db.writer")
+
+import app.db.client as client
+from app.db.index import centroid_index
+
+DIM = 8
+_names = itertools.count()
+
+class FakeCollection:
+    """
+    The Chroma collection calls made by the writer path, on a dict of id -> (document, embedding, metadata)
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.rows = {}
+        self.upserts = 0
+
+    def get(self, ids=None, include=(), where=None):
+        keys = [chunk_id for chunk_id in (list(self.rows) if ids is None else ids) if chunk_id in self.rows]
+        return {"ids": keys, "embeddings": [self.rows[chunk_id][1] for chunk_id in keys]}
+
+    def upsert(self, documents, embeddings, ids, metadatas):
+        if ids != ["centroid"]:
+            self.upserts += 1
+        for document, embedding, chunk_id, metadata in zip(documents, embeddings, ids, metadatas):
+            self.rows[chunk_id] = (document, np.asarray(embedding, dtype=np.float32), metadata)
+
+    def delete(self, ids):
+        for chunk_id in ids:
+            self.rows.pop(chunk_id, None)
+
+    def chunks(self) -> np.ndarray:
+        return np.asarray([row[1] for chunk_id, row in self.rows.items() if chunk_id != "centroid"], dtype=np.float64)
+
+@pytest.fixture
+def collections(monkeypatch):
+    created = {}
+
+    async def get_or_create_collection(name: str):
+        return created.setdefault(name, FakeCollection(name))
+
+    monkeypatch.setattr(writer, "get_or_create_collection", get_or_create_collection)
+    yield created
+    for name in created:
+        centroid_index.remove(name)
+
+def new_name() -> str:
+    return f"test-writer-{next(_names)}"
+
+def chunks(rng: np.random.Generator, prefix: str, count: int):
+    ids = [f"{prefix}_chunk_{idx}" for idx in range(count)]
+    embeddings = rng.standard_normal((count, DIM)).astype(np.float32)
+    return [f"text of {chunk_id}" for chunk_id in ids], embeddings, ids, [{"is_centroid": False}] * count
+
+def assert_tracks_collection(collection: FakeCollection):
+    stored = collection.chunks()
+    stats = centroid_index.stats[collection.name]
+    assert stats.count == len(stored)
+    np.testing.assert_allclose(stats.total, stored.sum(axis=0), rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(stats.mean, stored.mean(axis=0), rtol=1e-5, atol=1e-5)
+
+#---------------------------------------------------------------------------------------------------------------
+
+def test_running_sum_matches_mean_after_add_replace_and_delete(collections):
+    async def run():
+        rng = np.random.default_rng(0)
+        writers = writer.CollectionWriters()
+        name = new_name()
+
+        await writers.add(name, *chunks(rng, "a", 5))
+        assert_tracks_collection(collections[name])
+
+        # Re-uploaded file: same ids, new embeddings, plus an id repeated within the write
+        texts, embeddings, ids, metadatas = chunks(rng, "a", 3)
+        await writers.add(name, texts + texts[:1], np.concatenate([embeddings, embeddings[:1] * 2]), ids + ids[:1], metadatas + metadatas[:1])
+        assert_tracks_collection(collections[name])
+
+        await writers.delete(name, ids=["a_chunk_1", "a_chunk_4", "missing_chunk_0"])
+        assert_tracks_collection(collections[name])
+
+    asyncio.run(run())
+
+def test_periodic_recompute_resets_drift(collections, monkeypatch):
+    monkeypatch.setattr(client, "CENTROID_RECOMPUTE_EVERY", 3)
+
+    async def run():
+        rng = np.random.default_rng(1)
+        writers = writer.CollectionWriters()
+        name = new_name()
+
+        await writers.add(name, *chunks(rng, "a", 4))
+        # Floating-point drift of the running sum
+        centroid_index.stats[name].total += 1e-2
+
+        await writers.add(name, *chunks(rng, "b", 2))
+        await writers.add(name, *chunks(rng, "c", 2))
+        stored = collections[name].chunks()
+        assert not np.allclose(centroid_index.stats[name].total, stored.sum(axis=0), rtol=1e-5, atol=1e-5)
+
+        # Third update since the last recompute rebuilds the sum from the stored chunks
+        await writers.add(name, *chunks(rng, "d", 2))
+        assert_tracks_collection(collections[name])
+        assert centroid_index.stats[name].updates == 0
+
+    asyncio.run(run())
+
+def test_merged_flush_matches_sequential_operations(collections):
+    rng = np.random.default_rng(2)
+    first = chunks(rng, "a", 4)
+    replace = chunks(rng, "a", 2)
+    readd = chunks(rng, "b", 3)
+    operations = [
+        ("add", first),
+        ("add", replace),
+        ("delete", ["a_chunk_0", "a_chunk_3"]),
+        ("add", readd),
+        ("delete", ["b_chunk_1"]),
+        ("add", chunks(rng, "a", 1)),
+    ]
+
+    def apply(writers: "writer.CollectionWriters", name: str, operation):
+        kind, args = operation
+        return writers.add(name, *args) if kind == "add" else writers.delete(name, ids=args)
+
+    async def run():
+        writers = writer.CollectionWriters()
+        sequential, merged = new_name(), new_name()
+
+        for operation in operations:
+            await apply(writers, sequential, operation)
+        # Submitted together, the writer applies all of them in one flush
+        await asyncio.gather(*[apply(writers, merged, operation) for operation in operations])
+        return collections[sequential], collections[merged]
+
+    sequential, merged = asyncio.run(run())
+    assert merged.upserts < sequential.upserts
+    assert sorted(merged.rows) == sorted(sequential.rows)
+    for chunk_id, row in sequential.rows.items():
+        np.testing.assert_array_equal(merged.rows[chunk_id][1], row[1])
+    assert_tracks_collection(merged)
+    np.testing.assert_allclose(centroid_index.stats[merged.name].total, centroid_index.stats[sequential.name].total, rtol=1e-5, atol=1e-5)